@@ -0,0 +1,96 @@
+# Бенчмарк: пошаговый (lockstep) батч-инференс против старого цикла по остановкам.
+# Запуск из корня репозитория:
+#   python for_testing/bench_predictions.py --routes 1000 10000
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fixture_models import LEGACY_MODEL_FILE, MODEL_DIR, use_fixture_models  # noqa: E402
+
+# Без обученных моделей - модели-заглушки, .pkl для старого пути лежит рядом
+MODELS_PATH = use_fixture_models()
+os.chdir(MODEL_DIR)
+import app  # noqa: E402
+
+
+def make_routes(n_routes, stops_per_route=10, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_routes * stops_per_route
+    df = pd.DataFrame({
+        'route_id': np.repeat(np.arange(n_routes), stops_per_route),
+        'stop_id': np.tile(np.arange(1, stops_per_route + 1), n_routes),
+        'latitude': 51.1 + rng.random(n) * 0.1,
+        'longitude': 71.4 + rng.random(n) * 0.1,
+        'scheduled_time': np.repeat(rng.integers(300, 1200, n_routes), stops_per_route).astype(float),
+        'scheduled_travel_time': rng.integers(1, 10, n).astype(float),
+        'dwell_time_in_seconds': 30,
+        'segment_length': rng.random(n) * 3,
+    })
+    df['scheduled_time'] += np.tile(np.arange(stops_per_route) * 5, n_routes)
+    return df
+
+
+def legacy_predictions(df):
+    # Старая реализация: один model.predict на каждую остановку
+    import joblib
+    legacy_model = joblib.load(os.path.join(MODELS_PATH, LEGACY_MODEL_FILE))
+    arrivals = []
+    for route_id, route_stops in df.groupby('route_id'):
+        first_stop = route_stops.iloc[0]
+        start_time = datetime.now().replace(
+            hour=int(first_stop['scheduled_time'] // 60),
+            minute=int(first_stop['scheduled_time'] % 60),
+            second=0, microsecond=0
+        )
+        for idx, row in route_stops.iterrows():
+            if idx == 0:
+                predicted_travel_time = 0
+            else:
+                features = pd.DataFrame([{
+                    'scheduled_travel_time': row['scheduled_travel_time'],
+                    'dwell_time_in_seconds': row['dwell_time_in_seconds'],
+                    'segment_length': row['segment_length'],
+                    'day_of_week': start_time.weekday(),
+                    'hour_of_day': start_time.hour
+                }])
+                predicted_travel_time = legacy_model.predict(features)[0]
+            arrival_time = start_time + timedelta(minutes=float(predicted_travel_time))
+            arrivals.append(arrival_time.strftime("%H:%M"))
+            start_time = arrival_time + timedelta(seconds=float(row['dwell_time_in_seconds']))
+    return arrivals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--routes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--stops', type=int, default=10)
+    parser.add_argument('--skip-legacy', action='store_true')
+    args = parser.parse_args()
+
+    app.load_and_warm_up_model()
+    for n_routes in args.routes:
+        df = make_routes(n_routes, args.stops)
+
+        start = time.perf_counter()
+        routes = app.process_data_with_predictions(df)
+        batched = time.perf_counter() - start
+        line = f"{n_routes:>6} routes x {args.stops} stops: batched {batched:8.3f}s"
+
+        if not args.skip_legacy:
+            start = time.perf_counter()
+            expected = legacy_predictions(df)
+            legacy = time.perf_counter() - start
+            got = [label for route in routes for label in route.arrival_labels()]
+            line += f"  legacy {legacy:8.3f}s  speedup x{legacy / batched:6.1f}"
+            line += "  (identical)" if got == expected else "  (MISMATCH)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
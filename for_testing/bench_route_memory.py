@@ -0,0 +1,57 @@
+# Память и размер ответа: Route (массивы) против словарей старого формата,
+# полный JSON против compact. Запуск из корня репозитория:
+#   python for_testing/bench_route_memory.py --routes 10000
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+# Кэш предсказаний не должен попадать в замер памяти маршрутов
+os.environ['PREDICTION_CACHE_SIZE'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_predictions import app, make_routes  # noqa: E402
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def measure(build):
+    gc.collect()
+    rss_before = rss_mb()
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / 2**20, rss_mb() - rss_before
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--routes', type=int, default=10000)
+    parser.add_argument('--stops', type=int, default=10)
+    args = parser.parse_args()
+
+    df = make_routes(args.routes, args.stops)
+    routes, routes_mb, routes_rss = measure(lambda: app.process_data_with_predictions(df))
+    dicts, dicts_mb, dicts_rss = measure(lambda: [route.to_dict() for route in routes])
+
+    full = len(json.dumps({"routes": dicts}).encode())
+    compact = len(json.dumps({"routes": [route.to_compact() for route in routes]}).encode())
+    storage = sum(len(json.dumps(route.to_storage()).encode()) for route in routes)
+
+    print(f"{args.routes} routes x {args.stops} stops")
+    print(f"  memory  Route objects {routes_mb:8.1f} MiB (RSS +{routes_rss:.1f})   "
+          f"dicts {dicts_mb:8.1f} MiB (RSS +{dicts_rss:.1f})   x{dicts_mb / routes_mb:.1f}")
+    print(f"  payload full {full / 2**20:8.1f} MiB   compact {compact / 2**20:8.1f} MiB   "
+          f"storage {storage / 2**20:8.1f} MiB   x{full / compact:.1f}")
+
+
+if __name__ == "__main__":
+    main()
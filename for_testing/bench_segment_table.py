@@ -0,0 +1,67 @@
+# Быстрый путь по таблице сегментов против модели: доля попаданий и время
+# process_data_with_predictions на синтетических загрузках. Таблица
+# строится заранее: cd model_t && python segment_table.py
+# Запуск из корня репозитория:
+#   python for_testing/bench_segment_table.py --routes 1000 10000
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Кэш предсказаний отключён, чтобы сравнивать таблицу с самой моделью
+os.environ['PREDICTION_CACHE_SIZE'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import MODEL_DIR, generate_upload  # noqa: E402
+from fixture_models import use_fixture_models  # noqa: E402
+
+# Без обученных моделей - модели-заглушки с таблицей под них
+use_fixture_models()
+os.chdir(MODEL_DIR)
+sys.path.insert(0, MODEL_DIR)
+import app  # noqa: E402
+import prediction  # noqa: E402
+
+
+def best_of(fn, repeat):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return result, float(np.median(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--routes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--stops', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    table = prediction.segment_table
+    if table is None:
+        sys.exit("No segment table, build it first: cd model_t && python segment_table.py")
+    app.load_and_warm_up_model()
+    print(f"table {table.path} {list(table.values.shape)}, model {app.get_model().version}")
+
+    for n_routes in args.routes:
+        # jitter 0 - остановки из stops_data.csv, иначе координаты сдвинуты
+        for jitter in (0.0, 0.0005):
+            df = app.prepare_upload_features(generate_upload(n_routes, args.stops, jitter=jitter))
+            prediction.segment_table = None
+            expected, model_time = best_of(lambda: app.process_data_with_predictions(df), args.repeat)
+            prediction.segment_table = table
+            table.hits = table.misses = 0
+            routes, table_time = best_of(lambda: app.process_data_with_predictions(df), args.repeat)
+            identical = all(np.array_equal(a.arrival_us, b.arrival_us) for a, b in zip(routes, expected))
+            print(f"{n_routes:>6} routes x {args.stops} stops, jitter {jitter}: hit ratio "
+                  f"{table.stats()['hitRate']:6.1%}  model {model_time * 1000:8.1f} ms  "
+                  f"table {table_time * 1000:8.1f} ms  x{model_time / table_time:4.1f}"
+                  f"  ({'identical' if identical else 'MISMATCH'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Время холодного старта: импорт app.py, загрузка модели и прогрев,
+# затем первое предсказание. Каждый замер - отдельный процесс.
+# Запуск из корня репозитория:
+#   python for_testing/bench_startup.py --runs 5
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fixture_models import FIXTURE_FILES, LEGACY_MODEL_FILE, MODEL_DIR, use_fixture_models  # noqa: E402
+
+APP_STARTUP = '''
+import time
+start = time.perf_counter()
+import app
+app.load_and_warm_up_model()
+ready = time.perf_counter()
+import numpy as np
+app.get_model().predict(np.array([[5, 30, 1.2, 0, 8]], dtype=np.float32))
+print(ready - start, time.perf_counter() - ready)
+'''
+
+# Старый путь: joblib/pickle при импорте, первый predict на DataFrame
+LEGACY_STARTUP = '''
+import time
+start = time.perf_counter()
+import joblib
+import pandas as pd
+from fastapi import FastAPI
+model = joblib.load(%r)
+ready = time.perf_counter()
+model.predict(pd.DataFrame([{
+    'scheduled_travel_time': 5, 'dwell_time_in_seconds': 30,
+    'segment_length': 1.2, 'day_of_week': 0, 'hour_of_day': 8
+}]))
+print(ready - start, time.perf_counter() - ready)
+'''
+
+
+def run(code, env_overrides, runs):
+    env = dict(os.environ, PYTHONWARNINGS='ignore', **env_overrides)
+    ready, first = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', code], cwd=MODEL_DIR, env=env,
+                             capture_output=True, text=True, check=True).stdout.split()
+        ready.append(float(out[-2]))
+        first.append(float(out[-1]))
+    return statistics.median(ready), statistics.median(first)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--fixture-model', action='store_true',
+                        help='use small fixture models even if data/train.py models exist')
+    args = parser.parse_args()
+
+    # Без обученных моделей - модели-заглушки (переменные окружения
+    # наследуют процессы замеров)
+    models_path = use_fixture_models(args.fixture_model)
+    legacy_path = os.path.join(models_path, LEGACY_MODEL_FILE)
+    cases = [
+        ('legacy (pickle at import)', LEGACY_STARTUP % legacy_path, {}),
+        ('app, .pkl model', APP_STARTUP, {'MODEL_PATH': legacy_path}),
+        ('app, native .ubj model', APP_STARTUP,
+         {'MODEL_PATH': os.path.join(models_path, FIXTURE_FILES['MODEL_PATH'])}),
+    ]
+    for name, code, env in cases:
+        ready, first = run(code, env, args.runs)
+        print(f"{name:<28} ready {ready * 1000:8.1f} ms   first predict {first * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
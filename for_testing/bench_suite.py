@@ -0,0 +1,280 @@
+# Набор бенчмарков: синтетические загрузки в формате for_testing/test.csv
+# (координаты - вокруг остановок data/stops_data.csv), микробенчмарки
+# признаков и process_data_with_predictions, нагрузка на эндпоинты
+# FastAPI внутри процесса. Результаты пишутся в JSON и сравниваются с
+# сохранённым baseline. Запуск из корня репозитория:
+#   python for_testing/bench_suite.py --routes 10 1000 10000 --output bench.json
+#   python for_testing/bench_suite.py --baseline bench.json --output bench-new.json
+#   python for_testing/bench_suite.py --generate 100000 --output city.csv
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model_t')
+sys.path.insert(0, MODEL_DIR)
+
+UPLOAD_COLUMNS = [
+    'route_id', 'trip_id', 'stop_id', 'arrival_time', 'departure_time', 'scheduled_time',
+    'dwell_time_in_seconds', 'segment_length', 'day_of_week', 'hour_of_day', 'latitude', 'longitude'
+]
+
+
+def clock_strings(seconds):
+    seconds = np.asarray(seconds, dtype=np.int64) % (24 * 3600)
+    return pd.Series([f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in seconds.tolist()])
+
+
+def generate_upload(n_routes, stops_per_route=10, seed=0, stops_path=None, jitter=0.0005):
+    # Каждый маршрут - непрерывный отрезок реальной последовательности
+    # остановок (в случайном направлении) со сдвигом координат до ~100 м
+    # (jitter - СКО сдвига в градусах, 0 - точно на остановках), старт между 05:00 и 20:00, 2-6 минут между остановками.
+    rng = np.random.default_rng(seed)
+    stops = pd.read_csv(stops_path or os.path.join(MODEL_DIR, 'data', 'stops_data.csv'))
+    base = stops[['latitude', 'longitude']].to_numpy(dtype=np.float64)
+    n = n_routes * stops_per_route
+
+    offsets = rng.integers(0, len(base), n_routes)
+    direction = rng.choice([-1, 1], n_routes)
+    position = (offsets[:, None] + direction[:, None] * np.arange(stops_per_route)) % len(base)
+    coordinates = base[position.ravel()] + rng.normal(0, jitter, (n, 2))
+
+    start = rng.integers(5 * 3600, 20 * 3600, n_routes) // 60 * 60
+    gaps = rng.integers(2, 7, (n_routes, stops_per_route)) * 60
+    gaps[:, 0] = 0
+    scheduled = (start[:, None] + np.cumsum(gaps, axis=1)).ravel()
+    dwell = rng.choice([30, 60, 300], n)
+    arrival = scheduled + rng.integers(-60, 180, n)
+
+    df = pd.DataFrame({
+        'route_id': np.repeat(np.arange(1, n_routes + 1), stops_per_route),
+        'trip_id': np.repeat(np.arange(100001, 100001 + n_routes), stops_per_route),
+        'stop_id': np.arange(1, n + 1),
+        'arrival_time': clock_strings(arrival),
+        'departure_time': clock_strings(arrival + dwell),
+        'scheduled_time': clock_strings(scheduled),
+        'dwell_time_in_seconds': dwell,
+        'segment_length': 0.0,
+        'day_of_week': np.repeat(rng.integers(0, 7, n_routes), stops_per_route),
+        'hour_of_day': (scheduled // 3600) % 24,
+        'latitude': coordinates[:, 0],
+        'longitude': coordinates[:, 1],
+    })
+    return df[UPLOAD_COLUMNS]
+
+
+def summarize(samples, items=None):
+    # Время в миллисекундах; items - сколько строк/запросов приходится на замер
+    samples = np.asarray(samples, dtype=np.float64)
+    result = {
+        "runs": len(samples),
+        "p50Ms": float(np.percentile(samples, 50) * 1000),
+        "p95Ms": float(np.percentile(samples, 95) * 1000),
+        "p99Ms": float(np.percentile(samples, 99) * 1000),
+        "meanMs": float(samples.mean() * 1000),
+    }
+    if items:
+        result["throughput"] = float(items / np.median(samples))
+    return result
+
+
+def timeit(fn, repeat):
+    fn()  # прогрев
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def micro_benchmarks(app, features, sizes, stops_per_route, repeat):
+    results = {}
+    for n_routes in sizes:
+        upload = generate_upload(n_routes, stops_per_route)
+        rows = len(upload)
+        prepared = app.prepare_upload_features(upload.copy())
+        # Большие наборы гоняем реже, чтобы прогон оставался в пределах минут
+        runs = max(1, repeat if rows <= 100000 else repeat // 5)
+
+        cases = {
+            "time_to_minutes": lambda: [features.time_to_minutes(t) for t in upload['scheduled_time'].iloc[:10000]],
+            "times_to_minutes": lambda: features.times_to_minutes(upload['scheduled_time']),
+            "haversine_km": lambda: features.haversine_km(
+                upload['latitude'].to_numpy(), upload['longitude'].to_numpy(),
+                upload['latitude'].to_numpy()[::-1], upload['longitude'].to_numpy()[::-1]),
+            "segment_lengths": lambda: features.segment_lengths(upload),
+            "prepare_upload_features": lambda: app.prepare_upload_features(upload.copy()),
+            "process_data_with_predictions": lambda: app.process_data_with_predictions(prepared),
+        }
+        items = {"time_to_minutes": min(rows, 10000)}
+        for name, fn in cases.items():
+            results[f"{name}[{n_routes}]"] = summarize(timeit(fn, runs), items.get(name, rows))
+            print(f"  {name:<30} {n_routes:>7} routes  {results[f'{name}[{n_routes}]']['p50Ms']:10.2f} ms")
+    return results
+
+
+async def drive(client, make_request, total, concurrency):
+    # concurrency корутин разбирают total запросов. Перцентили считаются по
+    # успешным ответам, отказы пула (503) видны в statuses.
+    latencies = []
+    statuses = {}
+    queue = iter(range(total))
+
+    async def worker():
+        for i in queue:
+            start = time.perf_counter()
+            response = await make_request(client, i)
+            if response.status_code < 400:
+                latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    result = summarize(latencies or [elapsed])
+    result["throughput"] = total / elapsed
+    result["statuses"] = {str(code): count for code, count in sorted(statuses.items())}
+    return result
+
+
+async def endpoint_benchmarks(app, upload_routes, stops_per_route, requests, concurrency):
+    import httpx
+
+    upload = generate_upload(upload_routes, stops_per_route, seed=1).to_csv(index=False).encode()
+    small = generate_upload(5, stops_per_route, seed=2).to_csv(index=False).encode()
+    new_route = {
+        "name": "Bench route",
+        "stops": [
+            {"name": f"Stop {i}", "latitude": 7.29 + i * 0.001, "longitude": 80.63 + i * 0.001,
+             "scheduled_time": f"08:{i * 4:02d}"}
+            for i in range(stops_per_route)
+        ]
+    }
+
+    scenarios = {
+        "POST /api/upload": (lambda c, i: c.post('/api/upload', files={'file': ('bench.csv', upload)}),
+                             max(1, requests // 10)),
+        "POST /api/upload?stream=true": (
+            lambda c, i: c.post('/api/upload?stream=true', files={'file': ('bench.csv', upload)}),
+            max(1, requests // 10)),
+        "GET /api/routes": (lambda c, i: c.get('/api/routes'), requests),
+        "GET /api/routes?fields=id,name": (lambda c, i: c.get('/api/routes?fields=id,name'), requests),
+        "POST /api/routes/create": (lambda c, i: c.post('/api/routes/create', json=new_route), requests),
+        "POST /api/upload (small)": (lambda c, i: c.post('/api/upload', files={'file': ('small.csv', small)}),
+                                     requests),
+    }
+
+    results = {}
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=600) as client:
+        for name, (make_request, total) in scenarios.items():
+            # Загрузка заменяет набор маршрутов, поэтому GET идёт после неё
+            results[name] = await drive(client, make_request, total, concurrency)
+            r = results[name]
+            print(f"  {name:<34} p50 {r['p50Ms']:8.2f} ms  p95 {r['p95Ms']:8.2f}  p99 {r['p99Ms']:8.2f}  "
+                  f"{r['throughput']:8.1f} req/s  {r['statuses']}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Регрессия - p50 медленнее baseline больше чем на tolerance
+    regressions = []
+    for section in ('micro', 'endpoints'):
+        for name, current in results.get(section, {}).items():
+            previous = baseline.get(section, {}).get(name)
+            if previous is None:
+                continue
+            ratio = current['p50Ms'] / previous['p50Ms'] if previous['p50Ms'] else float('inf')
+            marker = ''
+            if ratio > 1 + tolerance:
+                marker = '  REGRESSION'
+                regressions.append(name)
+            print(f"  {section:<9} {name:<44} {previous['p50Ms']:10.2f} -> {current['p50Ms']:10.2f} ms "
+                  f"x{ratio:5.2f}{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--routes', type=int, nargs='+', default=[10, 1000, 10000],
+                        help='sizes for micro-benchmarks, up to 100000')
+    parser.add_argument('--stops', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--upload-routes', type=int, default=1000, help='routes per upload in endpoint load')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-endpoints', action='store_true')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='compare with a previous --output file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p50 slowdown vs baseline')
+    parser.add_argument('--generate', type=int, metavar='ROUTES',
+                        help='only write a synthetic upload CSV with this many routes to --output')
+    parser.add_argument('--fixture-model', action='store_true',
+                        help='use small fixture models even if data/train.py models exist')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    if args.generate:
+        df = generate_upload(args.generate, args.stops)
+        df.to_csv(args.output or sys.stdout, index=False)
+        return
+
+    # Замеры не должны задевать рабочую базу маршрутов и кэш предсказаний
+    os.environ.setdefault('ROUTES_DB', os.path.join(tempfile.gettempdir(), 'bench_routes.db'))
+    os.environ.setdefault('PREDICTION_CACHE_SIZE', '0')
+    from fixture_models import use_fixture_models
+    use_fixture_models(args.fixture_model)
+    os.chdir(MODEL_DIR)
+    import app
+    import features
+
+    app.load_and_warm_up_model()
+    results = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "modelVersion": app.get_model().version,
+            "pool": app.prediction_pool.kind,
+            "args": vars(args),
+        }
+    }
+    try:
+        if not args.skip_micro:
+            print("micro-benchmarks")
+            results["micro"] = micro_benchmarks(app, features, args.routes, args.stops, args.repeat)
+        if not args.skip_endpoints:
+            print(f"endpoints, concurrency {args.concurrency}")
+            results["endpoints"] = asyncio.run(endpoint_benchmarks(
+                app, args.upload_routes, args.stops, args.requests, args.concurrency))
+    finally:
+        app.prediction_pool.shutdown()
+        app.route_store.close()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        print(f"compared with {args.baseline}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
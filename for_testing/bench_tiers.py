@@ -0,0 +1,153 @@
+# Бенчмарк уровней модели (full - XGBoost, fast - почасовая линейная модель):
+# задержка predict на пачку и на строку, время расчёта маршрутов через
+# process_data_with_predictions и MAE на отложенной части обучающей выборки
+# (то же разбиение по номеру строки, что в train.py). По результатам
+# выбираются уровни по умолчанию и FAST_TIER_LOAD. Запуск из корня репозитория:
+#   python for_testing/bench_tiers.py
+#   python for_testing/bench_tiers.py --arrivals 'avl_*.csv' --sla-ms 50 --output tiers.json
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bench_suite import MODEL_DIR, generate_upload, summarize, timeit
+from fixture_models import use_fixture_models
+
+sys.path.insert(0, os.path.join(MODEL_DIR, 'data'))
+from out_of_core import chunks_mae, iter_split  # noqa: E402
+
+TIERS = ['full', 'fast']
+
+
+def held_out_mae(models, paths):
+    return {tier: chunks_mae(model.predict, iter_split(paths, 'test')) for tier, model in models.items()}
+
+
+def predict_benchmarks(models, features, batch_rows, repeat):
+    results = {}
+    for rows in batch_rows:
+        batch = features[np.arange(rows) % len(features)]
+        for tier, model in models.items():
+            result = summarize(timeit(lambda: model.predict(batch), repeat), rows)
+            result["perRowUs"] = result["p50Ms"] * 1000 / rows
+            results[f"{tier}[{rows}]"] = result
+    return results
+
+
+def route_benchmarks(app, sizes, stops_per_route, repeat):
+    # Как в сервере: full - через таблицу сегментов (кэш предсказаний выключен),
+    # fast - сразу моделью
+    results = {}
+    for n_routes in sizes:
+        prepared = app.prepare_upload_features(generate_upload(n_routes, stops_per_route))
+        runs = max(1, repeat if n_routes <= 100 else repeat // 10)
+        for tier in TIERS:
+            results[f"{tier}[{n_routes}]"] = summarize(
+                timeit(lambda: app.process_data_with_predictions(prepared, tier=tier), runs), n_routes)
+    return results
+
+
+def print_table(title, results, sizes, unit):
+    print(f"{title:<10} " + ' '.join(f"{tier + ' p50 ms':>13} {tier + ' p99 ms':>13}" for tier in TIERS)
+          + (f" {'full/row us':>12} {'fast/row us':>12}" if unit == 'rows' else ''))
+    for size in sizes:
+        line = f"{size:<10} " + ' '.join(
+            f"{results[f'{tier}[{size}]']['p50Ms']:>13.3f} {results[f'{tier}[{size}]']['p99Ms']:>13.3f}"
+            for tier in TIERS)
+        if unit == 'rows':
+            line += ''.join(f" {results[f'{tier}[{size}]']['perRowUs']:>12.3f}" for tier in TIERS)
+        print(line)
+    print()
+
+
+def sla_policy(routes, sizes, sla_ms, mae=None):
+    # Для каждого размера запроса - самый точный уровень (по MAE, без неё -
+    # full), у которого p99 укладывается в SLA
+    tiers = sorted(TIERS, key=lambda tier: mae[tier]) if mae else TIERS
+    policy = {}
+    for size in sizes:
+        fitting = [tier for tier in tiers if routes[f"{tier}[{size}]"]["p99Ms"] <= sla_ms]
+        policy[size] = fitting[0] if fitting else None
+    return policy
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default='data', help='training data, relative to model_t/')
+    parser.add_argument('--arrivals', default='dwell_sorted.csv', help='glob of arrival files, as in train.py')
+    parser.add_argument('--batch-rows', type=int, nargs='+', default=[1, 10, 100, 1000, 10000])
+    parser.add_argument('--routes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--stops', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--sla-ms', type=float, help='print the tier to use per route count for this p99 budget')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--fixture-model', action='store_true',
+                        help='use small fixture models even if data/train.py models exist')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    os.environ.setdefault('ROUTES_DB', os.path.join(tempfile.gettempdir(), 'bench_routes.db'))
+    os.environ.setdefault('PREDICTION_CACHE_SIZE', '0')
+    # Без обученных моделей - небольшие модели-заглушки, MAE тогда только для сравнения уровней
+    use_fixture_models(args.fixture_model)
+    os.chdir(MODEL_DIR)
+    import app
+    from feature_pipeline import prepare_training_partitions
+    from model_loader import reference_batch
+
+    app.load_and_warm_up_model()
+    models = {tier: app.get_model(tier) for tier in TIERS}
+    if models['fast'].tier != 'fast':
+        print("Error: no fast model tier, run data/train.py first or set FAST_MODEL_PATH")
+        sys.exit(1)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "models": {tier: model.info() for tier, model in models.items()},
+            "args": vars(args),
+        }
+    }
+    try:
+        paths, _ = prepare_training_partitions(args.data_dir, args.arrivals)
+    except (ValueError, FileNotFoundError) as e:
+        print(f"No held-out data ({e}), MAE is skipped, latency is measured on synthetic features")
+        paths = None
+    try:
+        if paths:
+            results["heldOutMae"] = held_out_mae(models, paths)
+            features = next(iter_split(paths, 'test', max(args.batch_rows)))[0]
+            print("held-out MAE: " + ', '.join(f"{tier} {mae:.4f}" for tier, mae in results["heldOutMae"].items()))
+            print()
+        else:
+            features = reference_batch(max(args.batch_rows))
+        results["predict"] = predict_benchmarks(models, np.asarray(features, dtype=np.float32), args.batch_rows,
+                                                args.repeat)
+        print_table('rows', results["predict"], args.batch_rows, 'rows')
+        results["routes"] = route_benchmarks(app, args.routes, args.stops, args.repeat)
+        print_table('routes', results["routes"], args.routes, 'routes')
+    finally:
+        app.prediction_pool.shutdown()
+        app.route_store.close()
+
+    if args.sla_ms:
+        results["slaPolicy"] = sla_policy(results["routes"], args.routes, args.sla_ms,
+                                           results.get("heldOutMae"))
+        print(f"p99 within {args.sla_ms:g} ms: " + ', '.join(
+            f"{size} routes -> {tier or 'none'}" for size, tier in results["slaPolicy"].items()))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
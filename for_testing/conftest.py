@@ -0,0 +1,35 @@
+# Общие фикстуры тестов: модели-заглушки из fixture_models.py и app,
+# импортированный с ними и с отдельной базой маршрутов.
+# Запуск из корня репозитория: python -m pytest -q
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fixture_models import MODEL_DIR, build_fixture_models  # noqa: E402
+
+# Оси таблицы сегментов для тестов: маленькая таблица строится быстро
+FIXTURE_LENGTHS = [0.5, 1.0, 2.0]
+
+
+@pytest.fixture(scope='session')
+def fixture_models(tmp_path_factory):
+    return build_fixture_models(str(tmp_path_factory.mktemp('models')), rows=5000, lengths=FIXTURE_LENGTHS)
+
+
+@pytest.fixture(scope='session')
+def app(fixture_models, tmp_path_factory):
+    # app читает окружение при импорте, поэтому импорт - только здесь
+    with pytest.MonkeyPatch.context() as patch:
+        for variable, path in fixture_models.items():
+            patch.setenv(variable, path)
+        patch.setenv('ROUTES_DB', str(tmp_path_factory.mktemp('store') / 'routes.db'))
+        patch.setenv('PREDICTION_CACHE_SIZE', '0')
+        patch.chdir(MODEL_DIR)
+        module = importlib.import_module('app')
+    yield module
+    module.prediction_pool.shutdown()
+    module.route_store.close()
+    module.stop_registry.close()
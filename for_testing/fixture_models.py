@@ -0,0 +1,84 @@
+# Модели для бенчмарков и тестов: небольшой XGBoost (.ubj и .pkl), быстрый
+# уровень и таблица сегментов под него, обученные за секунды на
+# синтетических признаках. Имена файлов - как в model_t/data, сервер
+# получает их через MODEL_PATH, FAST_MODEL_PATH и SEGMENT_TABLE.
+# Бенчмарки берут их, если train.py ещё не запускали (или с --fixture-model).
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model_t')
+sys.path.insert(0, MODEL_DIR)
+sys.path.insert(0, os.path.join(MODEL_DIR, 'data'))
+
+from fast_tier import fit_hourly_linear, save_fast_model  # noqa: E402
+from model_loader import DEFAULT_FAST_MODEL_PATH, DEFAULT_MODEL_PATHS, load_model, reference_batch  # noqa: E402
+from segment_table import SegmentTable, known_segment_lengths  # noqa: E402
+
+FIXTURE_FILES = {
+    'MODEL_PATH': 'bus_travel_time_model.ubj',
+    'FAST_MODEL_PATH': 'bus_travel_time_fast.json',
+    'SEGMENT_TABLE': 'segment_table.npy',
+}
+# Для замеров старого пути через joblib (bench_predictions, bench_startup)
+LEGACY_MODEL_FILE = 'bus_travel_time_model.pkl'
+
+
+def synthetic_training_set(rows=20000, seed=0):
+    # Признаки как у reference_batch; время в пути растёт с плановым, длиной
+    # сегмента и стоянкой, в часы пик - медленнее
+    features = reference_batch(rows, seed)
+    rng = np.random.default_rng(seed + 1)
+    scheduled, dwell, length, _, hour = features.T
+    peak = np.isin(hour, [7, 8, 17, 18])
+    target = scheduled * np.where(peak, 1.3, 1.0) + length * 0.5 + dwell / 60 + rng.normal(0, 0.5, rows)
+    return features, np.maximum(target, 0).astype(np.float32)
+
+
+def build_fixture_models(directory, rows=20000, seed=0, lengths=None):
+    # lengths - оси таблицы сегментов, по умолчанию соседние остановки
+    # model_t/data/stops_data.csv. Возвращает {переменная окружения: путь}
+    from xgboost import XGBRegressor
+    import joblib
+
+    os.makedirs(directory, exist_ok=True)
+    paths = {variable: os.path.join(directory, name) for variable, name in FIXTURE_FILES.items()}
+    features, target = synthetic_training_set(rows, seed)
+
+    model = XGBRegressor(n_estimators=30, max_depth=4, learning_rate=0.3, tree_method='hist', random_state=seed)
+    model.fit(features, target)
+    model.get_booster().save_model(paths['MODEL_PATH'])
+    joblib.dump(model, os.path.join(directory, LEGACY_MODEL_FILE))
+
+    coefficients, train_rows = fit_hourly_linear([(features, target)])
+    save_fast_model(coefficients, paths['FAST_MODEL_PATH'], train_rows)
+
+    if lengths is None:
+        lengths = known_segment_lengths(pd.read_csv(os.path.join(MODEL_DIR, 'data', 'stops_data.csv')))
+    SegmentTable.build(load_model(paths['MODEL_PATH']), lengths).save(paths['SEGMENT_TABLE'])
+    return paths
+
+
+def trained_models_present():
+    # Есть ли то, что сервер загрузит сам: основная модель и быстрый уровень
+    def exists(path):
+        return os.path.exists(path if os.path.isabs(path) else os.path.join(MODEL_DIR, path))
+
+    full = [os.environ['MODEL_PATH']] if os.environ.get('MODEL_PATH') else DEFAULT_MODEL_PATHS
+    fast = os.environ.get('FAST_MODEL_PATH') or DEFAULT_FAST_MODEL_PATH
+    return any(exists(path) for path in full) and exists(fast)
+
+
+def use_fixture_models(force=False):
+    # До import app: без обученных моделей (или с force) строит модели во
+    # временном каталоге и указывает на них серверу. Возвращает каталог
+    # моделей, в котором лежит и .pkl для старого пути.
+    if not force and trained_models_present():
+        return os.path.join(MODEL_DIR, 'data')
+    directory = tempfile.mkdtemp(prefix='fixture_models_')
+    os.environ.update(build_fixture_models(directory))
+    print(f"Using fixture models from {directory}")
+    return directory
@@ -0,0 +1,40 @@
+import sys
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def batch_score(app):
+    import batch_score
+    return batch_score
+
+
+def trip_frames():
+    stops = pd.DataFrame({'stop_id': ['1', '2', '3'], 'latitude': [51.16, 51.17, 51.18],
+                          'longitude': [71.47, 71.48, 71.49]})
+    trips = pd.DataFrame({'trip_id': [10, 11], 'start_time': [480.0, 540.0],
+                          'date': pd.to_datetime(['2024-03-04', '2024-03-04'])})
+    arrivals = pd.DataFrame({'trip_id': [10, 10, 10, 11, 11, 11], 'bus_stop': ['1', '2', '3'] * 2,
+                             'arrival_time': ['08:00', '08:06', '08:12', '09:00', '09:05', '09:11']})
+    return arrivals, stops, trips
+
+
+def test_score_chunk_skips_first_stop_of_every_trip(batch_score, tmp_path):
+    from feature_pipeline import load_frame
+
+    arrivals, stops, trips = trip_frames()
+    part, rows = batch_score.score_chunk(0, arrivals, stops, trips, str(tmp_path))
+    scores = load_frame(batch_score.part_path(str(tmp_path), part))
+    assert rows == 6
+    first = scores.groupby('trip_id').head(1)
+    # Первая остановка рейса - плановое время старта, без предсказанного сегмента
+    assert first['predicted_arrival'].tolist() == [480.0, 540.0]
+    assert first['predicted_travel_time'].isna().all()
+    assert (scores.groupby('trip_id')['predicted_travel_time'].count() == 2).all()
+
+
+def test_batch_score_does_not_import_the_server(batch_score):
+    # Пакетный прогон берёт предсказания из prediction, без FastAPI-приложения
+    assert 'app' not in vars(batch_score)
+    assert batch_score.process_data_with_predictions is sys.modules['prediction'].process_data_with_predictions
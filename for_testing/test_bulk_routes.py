@@ -0,0 +1,54 @@
+import pytest
+
+from bulk_routes import BULK_REPORTED_ROWS, bulk_frame, decode_columns
+
+
+def columns(rows=3, **overrides):
+    data = {
+        'routeId': ['1'] * rows,
+        'latitude': [51.16 + i * 0.01 for i in range(rows)],
+        'longitude': [71.47 + i * 0.01 for i in range(rows)],
+        'scheduledTime': [f"08:{i * 5:02d}" for i in range(rows)],
+    }
+    data.update(overrides)
+    return data
+
+
+def test_valid_columns():
+    df, route_names = bulk_frame(columns(routeName=['Line 1', None, None], name=['a', None, 'c']))
+    assert df.index.tolist() == [0, 1, 2]
+    assert df['scheduled_time'].tolist() == [480.0, 485.0, 490.0]
+    assert df['address'].tolist() == ['a', 'Stop 2', 'c']
+    assert route_names == {'1': 'Line 1'}
+
+
+@pytest.mark.parametrize('data, message', [
+    ({'routeId': ['1'], 'latitude': [51.1]}, "Missing required columns: longitude, scheduledTime"),
+    (columns(latitude=[51.1, 51.2]), "All columns must have the same length"),
+    (columns(name=['a']), "All columns must have the same length"),
+    (columns(0), "A bulk request needs 1..500000 stops, got 0"),
+    (columns(routeId=['1', None, '1']), "routeId must not be empty (rows 1)"),
+    (columns(latitude=[51.1, 91, -95]), "latitude must be in -90..90 (rows 1, 2)"),
+    (columns(longitude=[71.4, 'east', 71.5]), "longitude must be numbers"),
+    (columns(longitude=[71.4, None, 71.5]), "longitude must be in -180..180 (rows 1)"),
+    (columns(scheduledTime=['08:00', '8.05', '25:00']), "scheduledTime must be HH:MM or HH:MM:SS (rows 1, 2)"),
+    (columns(scheduledTime=[1500, 1505, 1510]), "scheduledTime of a first stop must be before 24:00 (rows 0)"),
+])
+def test_column_errors(data, message):
+    with pytest.raises(ValueError) as error:
+        bulk_frame(data)
+    assert str(error.value) == message
+
+
+def test_error_lists_first_rows_only():
+    rows = BULK_REPORTED_ROWS + 5
+    with pytest.raises(ValueError) as error:
+        bulk_frame(columns(rows, latitude=[100] * rows))
+    shown = ', '.join(str(row) for row in range(BULK_REPORTED_ROWS))
+    assert str(error.value) == f"latitude must be in -90..90 (rows {shown} and 5 more)"
+
+
+@pytest.mark.parametrize('body', ['[1, 2]', '{"routeId": "1"}'])
+def test_decode_rejects_non_columnar_json(body):
+    with pytest.raises(ValueError, match='equal-length column arrays'):
+        decode_columns(body.encode(), 'json')
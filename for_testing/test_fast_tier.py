@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+import pytest
+
+from model_loader import FAST_TERMS, HourlyLinearModel, load_fast_model, reference_batch
+
+
+def test_hourly_linear_predict_shape_and_clamp():
+    coefficients = np.zeros((24, len(FAST_TERMS)))
+    coefficients[:, 0] = 1.0   # scheduled_travel_time
+    coefficients[8, 4] = -100  # в 8 часов прогноз уходит в минус
+    model = HourlyLinearModel(coefficients, None, 'test')
+    features = np.array([
+        [5, 30, 1.0, 0, 7],
+        [5, 30, 1.0, 0, 8],
+        [12, 0, 2.0, 6, 23],
+    ], dtype=np.float32)
+    predicted = model.predict(features)
+    assert predicted.shape == (3,)
+    assert predicted.dtype == np.float32
+    assert predicted.tolist() == [5.0, 0.0, 12.0]
+    assert model.predict(reference_batch(100)).shape == (100,)
+
+
+def test_hourly_linear_rejects_wrong_coefficient_shape():
+    with pytest.raises(ValueError, match='24 x'):
+        HourlyLinearModel(np.zeros((23, len(FAST_TERMS))), None, 'test')
+    with pytest.raises(ValueError, match='24 x'):
+        HourlyLinearModel(np.zeros((24, len(FAST_TERMS) + 1)), None, 'test')
+
+
+def test_load_fast_model_checks_terms(tmp_path):
+    path = tmp_path / 'fast.json'
+    path.write_text(json.dumps({"terms": FAST_TERMS[:-1], "coefficients": []}))
+    with pytest.raises(ValueError, match='terms'):
+        load_fast_model(str(path))
+    assert load_fast_model(str(tmp_path / 'missing.json')) is None
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from feature_pipeline import Pipeline, load_frame, save_frame
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    paths = {}
+    for name, rows in (('avl_2023-01', 3), ('avl_2023-01-b', 4)):
+        paths[name] = tmp_path / f"{name}.csv"
+        pd.DataFrame({'trip_id': range(rows), 'value': np.arange(rows) * 1.5}).to_csv(paths[name], index=False)
+    return {name: str(path) for name, path in paths.items()}
+
+
+def run(cache_dir, inputs, calls):
+    pipeline = Pipeline(str(cache_dir))
+
+    def read(path):
+        calls.append(os.path.basename(path))
+        return pd.read_csv(path)
+
+    first = pipeline.stage('avl_2023-01', read, [inputs['avl_2023-01']])
+    second = pipeline.stage('avl_2023-01-b', read, [inputs['avl_2023-01-b']])
+    total = pipeline.stage('total', lambda a, b: pd.DataFrame({'rows': [len(a) + len(b)]}), upstream=[first, second])
+    return pipeline, total
+
+
+def test_unchanged_inputs_are_read_from_cache(tmp_path, inputs):
+    calls = []
+    run(tmp_path / 'cache', inputs, calls)
+    pipeline, total = run(tmp_path / 'cache', inputs, calls)
+    assert calls == ['avl_2023-01.csv', 'avl_2023-01-b.csv']
+    assert [row["status"] for row in pipeline.report] == ['cached'] * 3
+    assert total['rows'].tolist() == [7]
+
+
+def test_changed_input_recomputes_stage_and_dependents_and_removes_only_its_stale_entry(tmp_path, inputs):
+    cache = tmp_path / 'cache'
+    calls = []
+    before, _ = run(cache, inputs, calls)
+    pd.DataFrame({'trip_id': [0], 'value': [9.0]}).to_csv(inputs['avl_2023-01'], index=False)
+
+    calls.clear()
+    after, total = run(cache, inputs, calls)
+    assert calls == ['avl_2023-01.csv']
+    assert [row["status"] for row in after.report] == ['computed', 'cached', 'computed']
+    assert total['rows'].tolist() == [5]
+    # Старая запись avl_2023-01 удалена, запись avl_2023-01-b с похожим именем - нет
+    entries = sorted(os.listdir(cache))
+    assert entries == sorted(os.path.basename(path) for path in after.paths.values())
+    assert os.path.basename(before.paths['avl_2023-01']) not in entries
+    assert before.paths['avl_2023-01-b'] == after.paths['avl_2023-01-b']
+
+
+def test_disabled_cache_always_computes(tmp_path, inputs):
+    pipeline = Pipeline(str(tmp_path / 'cache'), use_cache=False)
+    pipeline.stage('avl_2023-01', pd.read_csv, [inputs['avl_2023-01']])
+    assert pipeline.report[0]["status"] == 'computed'
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_frame_round_trip_keeps_types(tmp_path):
+    df = pd.DataFrame({
+        'id': np.array([1, 2, 3], dtype=np.int16),
+        'name': pd.Series(['a', 'b', 'a']).astype('category'),
+        'value': [0.5, np.nan, 2.0],
+    })
+    save_frame(df, str(tmp_path / 'frame'))
+    loaded = load_frame(str(tmp_path / 'frame'))
+    pd.testing.assert_frame_equal(loaded, df)
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from features import times_to_minutes
+
+
+def strptime_minutes(value):
+    # Образец: разбор, которым раньше пользовалась загрузка
+    for fmt in ('%H:%M:%S', '%H:%M'):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return parsed.hour * 60 + parsed.minute
+    return np.nan
+
+
+EDGE_CASES = [
+    '00:00', '0:0', '8:05', '08:5', '23:59', '23:59:59', '24:00', '12:60', '12:30:60', '12:30:61',
+    '1:2:3', '01:02:03', '', ':', '::', '12:', ':30', '12:30:', '123:00', '12:300', '12:30:000',
+    '08:00:00:00', ' 8:00', '8:00 ', '+8:00', '-8:00', '08-00', 'ab:cd', '８:00', '12:30:0',
+]
+
+
+def assert_matches_strptime(values):
+    expected = np.array([strptime_minutes(value) for value in values], dtype=np.float64)
+    got = times_to_minutes(pd.Series(values, dtype=object)).to_numpy(dtype=np.float64)
+    mismatched = ~((got == expected) | (np.isnan(got) & np.isnan(expected)))
+    assert not mismatched.any(), [(values[i], got[i], expected[i]) for i in np.flatnonzero(mismatched)[:10]]
+
+
+def test_times_to_minutes_edge_cases():
+    assert_matches_strptime(EDGE_CASES)
+
+
+def test_times_to_minutes_random_strings():
+    rng = np.random.default_rng(0)
+    alphabet = np.array(list('0123456789::: '))
+    values = [''.join(rng.choice(alphabet, rng.integers(0, 11))) for _ in range(20000)]
+    assert_matches_strptime(values)
+
+
+def test_times_to_minutes_mixed_and_numeric():
+    values = pd.Series(['08:15', 30.5, None, '25:00', 600], dtype=object)
+    got = times_to_minutes(values).tolist()
+    assert got[:2] == [495.0, 30.5]
+    assert np.isnan(got[2]) and np.isnan(got[3])
+    assert got[4] == 600.0
+    assert times_to_minutes(pd.Series([1, 2])).tolist() == [1.0, 2.0]
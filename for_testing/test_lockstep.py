@@ -0,0 +1,61 @@
+import os
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from fixture_models import LEGACY_MODEL_FILE
+
+
+def make_routes(n_routes=40, seed=0):
+    # Маршруты разной длины, в том числе через полночь
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 9, n_routes)
+    starts = rng.integers(300, 1200, n_routes).astype(float)
+    starts[-1] = 23 * 60 + 50
+    n = int(lengths.sum())
+    df = pd.DataFrame({
+        'route_id': np.repeat(np.arange(n_routes), lengths),
+        'stop_id': np.concatenate([np.arange(1, length + 1) for length in lengths]),
+        'latitude': 51.1 + rng.random(n) * 0.1,
+        'longitude': 71.4 + rng.random(n) * 0.1,
+        'scheduled_time': np.repeat(starts, lengths) + np.concatenate([np.arange(length) * 5 for length in lengths]),
+        'scheduled_travel_time': rng.integers(1, 10, n).astype(float),
+        'dwell_time_in_seconds': 30,
+        'segment_length': rng.random(n) * 3,
+    })
+    return df
+
+
+def legacy_arrivals(df, model):
+    # Старый цикл: model.predict на каждую остановку, время - datetime
+    arrivals = []
+    for _, route_stops in df.groupby('route_id'):
+        first_stop = route_stops.iloc[0]
+        start_time = datetime.now().replace(hour=int(first_stop['scheduled_time'] // 60),
+                                            minute=int(first_stop['scheduled_time'] % 60), second=0, microsecond=0)
+        for idx, row in route_stops.iterrows():
+            if idx == 0:
+                predicted_travel_time = 0
+            else:
+                features = pd.DataFrame([{
+                    'scheduled_travel_time': row['scheduled_travel_time'],
+                    'dwell_time_in_seconds': row['dwell_time_in_seconds'],
+                    'segment_length': row['segment_length'],
+                    'day_of_week': start_time.weekday(),
+                    'hour_of_day': start_time.hour,
+                }])
+                predicted_travel_time = model.predict(features)[0]
+            arrival_time = start_time + timedelta(minutes=float(predicted_travel_time))
+            arrivals.append(arrival_time.strftime("%H:%M"))
+            start_time = arrival_time + timedelta(seconds=float(row['dwell_time_in_seconds']))
+    return arrivals
+
+
+def test_lockstep_matches_legacy_per_stop_loop(app, fixture_models):
+    df = make_routes()
+    legacy_model = joblib.load(os.path.join(os.path.dirname(fixture_models['MODEL_PATH']), LEGACY_MODEL_FILE))
+    routes = app.process_data_with_predictions(df.copy(), app.prediction_base_date())
+    assert [route.id for route in routes] == [str(route_id) for route_id in sorted(df['route_id'].unique())]
+    assert [label for route in routes for label in route.arrival_labels()] == legacy_arrivals(df, legacy_model)
@@ -0,0 +1,45 @@
+import re
+
+from metrics import Counter, Gauge, Histogram, Registry
+
+# Строка образца в текстовом формате Prometheus 0.0.4
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="(\\.|[^"\\])*",?)*\})? '
+                    r'(-?[0-9.e+-]+|[+-]Inf|NaN)$')
+
+
+def test_render_is_prometheus_text_format():
+    registry = Registry()
+    calls = registry.register(Counter('model_calls_total', 'Model calls', ('tier',)))
+    stored = registry.register(Gauge('routes_stored', 'Routes in the store', function=lambda: 3))
+    latency = registry.register(Histogram('latency_seconds', 'Latency', ('path',), buckets=(0.1, 1)))
+    calls.inc(tier='full')
+    calls.inc(2, tier='fast')
+    latency.observe(0.05, path='/a"b')
+    latency.observe(5, path='/a"b')
+
+    text = registry.render()
+    assert text.endswith('\n')
+    lines = text.splitlines()
+    for line in lines:
+        assert line.startswith('# HELP ') or line.startswith('# TYPE ') or SAMPLE.match(line), line
+    assert '# TYPE model_calls_total counter' in lines
+    assert 'model_calls_total{tier="full"} 1.0' in lines
+    assert 'model_calls_total{tier="fast"} 2.0' in lines
+    assert '# TYPE routes_stored gauge' in lines
+    assert 'routes_stored 3.0' in lines
+    assert stored.render()[-1] == 'routes_stored 3.0'
+
+
+def test_histogram_buckets_are_cumulative_with_inf():
+    latency = Histogram('latency_seconds', 'Latency', ('path',), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        latency.observe(value, path='/a"b')
+    lines = latency.render()
+    assert lines[:2] == ['# HELP latency_seconds Latency', '# TYPE latency_seconds histogram']
+    assert lines[2:] == [
+        'latency_seconds_bucket{path="/a\\"b",le="0.1"} 1',
+        'latency_seconds_bucket{path="/a\\"b",le="1.0"} 3',
+        'latency_seconds_bucket{path="/a\\"b",le="+Inf"} 4',
+        'latency_seconds_sum{path="/a\\"b"} 6.05',
+        'latency_seconds_count{path="/a\\"b"} 4',
+    ]
@@ -0,0 +1,106 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import FIXTURE_LENGTHS
+from fixture_models import MODEL_DIR, build_fixture_models
+from model_loader import ModelRegistry
+
+STOPS_PATH = os.path.join(MODEL_DIR, 'data', 'stops_data.csv')
+
+
+def test_loading_a_model_keeps_xgboost_sklearn_api(fixture_models):
+    # Отдельный процесс: xgboost должен импортироваться впервые при загрузке модели
+    code = (
+        "import numpy as np\n"
+        "from model_loader import load_model\n"
+        f"load_model({fixture_models['MODEL_PATH']!r})\n"
+        "import xgboost\n"
+        "model = xgboost.XGBRegressor(n_estimators=2).fit(np.zeros((4, 2)), np.arange(4))\n"
+        "print(model.predict(np.zeros((1, 2))).shape)\n"
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=MODEL_DIR, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONWARNINGS='ignore'))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '(1,)'
+
+
+@pytest.fixture(scope='module')
+def second_model(tmp_path_factory):
+    # Та же архитектура, другие данные - другая версия
+    return build_fixture_models(str(tmp_path_factory.mktemp('second')), rows=2000, seed=1,
+                                lengths=FIXTURE_LENGTHS)['MODEL_PATH']
+
+
+def test_registry_reload_and_rollback(fixture_models, second_model, tmp_path):
+    registry = ModelRegistry(5, fixture_models['MODEL_PATH'])
+    swaps = []
+    registry.on_swap(swaps.append)
+    first = registry.get()
+
+    # Та же версия - без подмены
+    assert registry.reload() is first and swaps == []
+    second = registry.reload(second_model)
+    assert second.version != first.version
+    assert (registry.current, registry.previous) == (second, first)
+    assert registry.rollback() is first
+    assert registry.previous is second
+    assert swaps == [second, first]
+
+    broken = tmp_path / 'broken.ubj'
+    broken.write_bytes(b'not a model')
+    with pytest.raises(Exception):
+        registry.reload(str(broken))
+    assert registry.current is first
+
+
+def test_rollback_needs_previous_version(fixture_models):
+    with pytest.raises(ValueError, match='No previous model version'):
+        ModelRegistry(5, fixture_models['MODEL_PATH']).rollback()
+
+
+def wait_for_rescore(app):
+    # Пересчёт идёт в однопоточном rescore_executor: пустая задача за ним
+    app.rescore_executor.submit(lambda: None).result(timeout=30)
+
+
+def test_admin_reload_rescores_stored_routes_and_rollback_restores(app, second_model, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', 'secret')
+    monkeypatch.setattr(app, 'MODELS_DIR', os.path.dirname(second_model))
+    # Смена модели перестраивает таблицу сегментов - во временный файл
+    monkeypatch.setattr(app.prediction, 'segment_table', app.prediction.segment_table)
+    monkeypatch.setattr(app.prediction, 'SEGMENT_TABLE_PATH', str(tmp_path / 'segment_table.npy'))
+    monkeypatch.setattr(app.prediction, 'SEGMENT_TABLE_STOPS', STOPS_PATH)
+    client = TestClient(app.app)
+    headers = {"X-Admin-Token": "secret"}
+    stops = [{"name": f"S{i}", "latitude": 51.16 + i * 0.01, "longitude": 71.47, "scheduled_time": f"08:{i * 5:02d}"}
+             for i in range(4)]
+    created = client.post('/api/routes/create?tier=full', json={"name": "R", "stops": stops}).json()["route"]
+    original = app.route_store.get(created["id"])
+    first_version = original.model_version
+
+    assert client.post('/api/admin/model/reload', params={"path": os.path.basename(second_model)}).status_code == 403
+    assert 'Model path must be inside' in client.post('/api/admin/model/reload', params={"path": '../x.ubj'},
+                                                      headers=headers).json()["error"]
+
+    reloaded = client.post('/api/admin/model/reload', params={"path": os.path.basename(second_model)},
+                           headers=headers).json()
+    try:
+        assert reloaded["success"] and reloaded["model"]["version"] != first_version
+        assert app.prediction.segment_table.model_version == reloaded["model"]["version"]
+        wait_for_rescore(app)
+        rescored = app.route_store.get(created["id"])
+        assert rescored.model_version == reloaded["model"]["version"]
+        expected = app.rescore_routes([original], app.get_model())[0]
+        assert rescored.arrival_us.tolist() == expected.arrival_us.tolist()
+        assert client.get('/api/admin/model').json()["previous"]["version"] == first_version
+    finally:
+        rolled_back = client.post('/api/admin/model/rollback', headers=headers).json()
+        wait_for_rescore(app)
+    assert rolled_back["model"]["version"] == first_version
+    restored = app.route_store.get(created["id"])
+    assert restored.model_version == first_version
+    assert restored.arrival_us.tolist() == original.arrival_us.tolist()
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from prediction_cache import PredictionCache
+
+FEATURES = ['scheduled_travel_time', 'dwell_time_in_seconds', 'segment_length', 'day_of_week', 'hour_of_day']
+
+
+class CountingModel:
+    def __init__(self, offset=0.0):
+        self.offset = offset
+        self.rows = []
+
+    def predict(self, features):
+        self.rows.append(len(features))
+        return (features[:, 0] * 2 + features[:, 2] + self.offset).astype(np.float32)
+
+
+def segments(*lengths):
+    return np.array([[5, 30, length, 2, 8] for length in lengths], dtype=np.float32)
+
+
+def test_repeated_segments_hit_the_cache():
+    cache = PredictionCache(FEATURES)
+    model = CountingModel()
+    features = segments(1.0, 1.5, 1.0, 1.0)
+    np.testing.assert_array_equal(cache.predict(model, features), model.predict(features))
+    model.rows.clear()
+
+    np.testing.assert_array_equal(cache.predict(model, segments(1.5, 2.0)), [11.5, 12.0])
+    assert model.rows == [1]  # только новый сегмент
+    stats = cache.stats()
+    # Повторы ещё не посчитанного сегмента в одном вызове - тоже промахи
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 4 + 1, 3)
+
+
+def test_other_model_object_invalidates_entries():
+    cache = PredictionCache(FEATURES)
+    old, new = CountingModel(), CountingModel(offset=100)
+    cache.predict(old, segments(1.0))
+    # Тот же сегмент у новой модели считается заново, а не берётся из кэша
+    assert cache.predict(new, segments(1.0)).tolist() == [111.0]
+    assert new.rows == [1]
+    assert cache.stats()["invalidations"] == 1
+    assert cache.predict(old, segments(1.0)).tolist() == [11.0]
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_lru_eviction():
+    cache = PredictionCache(FEATURES, max_size=2)
+    model = CountingModel()
+    cache.predict(model, segments(1.0, 2.0))
+    cache.predict(model, segments(1.0))       # 1.0 - самый свежий
+    cache.predict(model, segments(3.0))       # вытесняет 2.0
+    model.rows.clear()
+    cache.predict(model, segments(1.0, 3.0, 2.0))
+    assert model.rows == [1]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_quantization_shares_entries_between_close_segments():
+    cache = PredictionCache(FEATURES, quantization={'segment_length': 0.1})
+    model = CountingModel()
+    values = cache.predict(model, segments(1.01, 0.98))
+    assert model.rows == [1]
+    np.testing.assert_allclose(values, [11.0, 11.0])
+
+
+def test_disabled_cache_calls_the_model():
+    cache = PredictionCache(FEATURES, max_size=0)
+    model = CountingModel()
+    cache.predict(model, segments(1.0, 1.0))
+    assert model.rows == [2] and cache.stats()["size"] == 0
+
+
+def test_unknown_quantization_feature():
+    with pytest.raises(ValueError, match='Unknown features in quantization: speed'):
+        PredictionCache(FEATURES, quantization={'speed': 1})
+
+
+def test_take_counts_resets_for_worker_merge():
+    cache = PredictionCache(FEATURES)
+    model = CountingModel()
+    cache.predict(model, segments(1.0))
+    cache.predict(model, segments(1.0))
+    counts = cache.take_counts()
+    assert counts == {"hits": 1, "misses": 1, "evictions": 0, "invalidations": 0}
+    assert cache.stats()["hits"] == 0
+    cache.add_counts(counts)
+    assert cache.stats()["hitRate"] == 0.5
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from route_edits import edit_route, route_diff
+
+STOPS = [
+    ("A", 51.160, 71.470, "08:00"),
+    ("B", 51.165, 71.480, "08:06"),
+    ("C", 51.172, 71.486, "08:12"),
+    ("D", 51.180, 71.490, "08:19"),
+    ("E", 51.186, 71.501, "08:25"),
+]
+
+
+def route_create(app, stops):
+    return app.RouteCreate(name="R", stops=[
+        app.StopCreate(name=name, latitude=lat, longitude=lon, scheduled_time=time) for name, lat, lon, time in stops
+    ])
+
+
+@pytest.fixture
+def route(app):
+    return app.predict_created_route(route_create(app, STOPS), 'r1')
+
+
+def recreated(app, stops):
+    # Тот же маршрут, посчитанный заново целиком
+    return app.predict_created_route(route_create(app, stops), 'r1')
+
+
+@pytest.mark.parametrize('edit, stops, first', [
+    ({"op": "retime", "position": 2, "scheduled_time": "08:15"},
+     STOPS[:2] + [("C", 51.172, 71.486, "08:15")] + STOPS[3:], 2),
+    ({"op": "insert", "position": 2,
+      "stop": {"name": "X", "latitude": 51.168, "longitude": 71.483, "scheduled_time": "08:09"}},
+     STOPS[:2] + [("X", 51.168, 71.483, "08:09")] + STOPS[2:], 2),
+    ({"op": "remove", "position": 2}, STOPS[:2] + STOPS[3:], 2),
+    ({"op": "retime", "position": 0, "scheduled_time": "07:55"},
+     [("A", 51.160, 71.470, "07:55")] + STOPS[1:], 0),
+    ({"op": "move", "position": 3, "to": 1}, [STOPS[0], STOPS[3], STOPS[1], STOPS[2], STOPS[4]], 1),
+])
+def test_edit_repredicts_downstream_like_a_new_route(app, route, edit, stops, first):
+    edited, edited_first = app.predict_edited_route(route, app.StopEdit(**edit))
+    assert edited_first == first
+    # Префикс до правки не пересчитывается
+    np.testing.assert_array_equal(edited.arrival_us[:first], route.arrival_us[:first])
+    expected = recreated(app, stops)
+    np.testing.assert_allclose(edited.segment_features, expected.segment_features, rtol=1e-9)
+    np.testing.assert_array_equal(edited.arrival_us, expected.arrival_us)
+    assert edited.stop_names == [name for name, *_ in stops]
+
+
+def test_edit_route_touches_only_changed_segments(route):
+    edited, first = edit_route(route, 'retime', 3, scheduled_minutes=8 * 60 + 21)
+    assert first == 3
+    # Меняются время в пути сегментов в остановку 3 и из неё
+    changed = np.flatnonzero((edited.segment_features != route.segment_features).any(axis=1)).tolist()
+    assert changed == [3, 4]
+    assert edited.segment_features[3, 0] == 9 and edited.segment_features[4, 0] == 4
+
+
+def test_insert_assigns_next_stop_id(route, app):
+    stop = app.StopCreate(name="X", latitude=51.19, longitude=71.51, scheduled_time="08:30")
+    edited, first = edit_route(route, 'insert', 5, stop=stop, scheduled_minutes=8 * 60 + 30)
+    assert first == 5
+    assert edited.stop_ids == ['1', '2', '3', '4', '5', '6']
+
+
+@pytest.mark.parametrize('op, position, kwargs, message', [
+    ('remove', 5, {}, 'position must be in 0..4'),
+    ('retime', 1, {}, 'retime needs scheduled_time'),
+    ('insert', 1, {}, 'insert needs a stop with scheduled_time'),
+    ('move', 1, {"to": 7}, 'to must be in 0..4'),
+    ('retime', 1, {"scheduled_minutes": np.nan}, 'scheduled_time must be HH:MM or HH:MM:SS'),
+    ('rename', 1, {}, 'Unknown edit operation: rename'),
+])
+def test_edit_route_errors(route, op, position, kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        edit_route(route, op, position, **kwargs)
+
+
+def test_remove_last_stop_is_rejected(app):
+    single = recreated(app, STOPS[:1])
+    with pytest.raises(ValueError, match='at least one stop'):
+        edit_route(single, 'remove', 0)
+
+
+def test_route_diff_lists_changed_stops_segments_and_removed(app, route):
+    edited, first = app.predict_edited_route(route, app.StopEdit(op='remove', position=2))
+    diff = route_diff(route, edited, first)
+    assert diff["stopCount"] == 4
+    assert diff["removed"] == ['3']
+    assert [stop["position"] for stop in diff["stops"]][0] == 2
+    assert diff["stops"][0]["id"] == '4'
+    assert all(stop["position"] >= first for stop in diff["stops"])
+    assert diff["segments"][0] == {"position": 1, "from": '2', "to": '4', "travelTime": edited.travel_times()[1]}
+
+
+def test_route_diff_is_empty_without_changes(route):
+    diff = route_diff(route, route, 0)
+    assert diff["stops"] == [] and diff["segments"] == [] and diff["removed"] == []
+
+
+def test_patch_endpoint_updates_stored_route(app):
+    client = TestClient(app.app)
+    stops = [{"name": name, "latitude": lat, "longitude": lon, "scheduled_time": time}
+             for name, lat, lon, time in STOPS]
+    created = client.post('/api/routes/create', json={"name": "R", "stops": stops}).json()["route"]
+
+    diff = client.patch(f"/api/routes/{created['id']}",
+                        json={"op": "retime", "position": 3, "scheduled_time": "08:30"}).json()
+    assert diff["success"] and diff["stopCount"] == 5
+    assert [stop["position"] for stop in diff["stops"]] == [3, 4]
+    stored = app.route_store.get(created["id"])
+    assert stored.schedule()[3] == 8 * 60 + 30
+    assert stored.arrival_labels()[3:] == [stop["predictedArrivalTime"] for stop in diff["stops"]]
+
+    removed = client.patch(f"/api/routes/{created['id']}", json={"op": "remove", "position": 0}).json()
+    assert removed["removed"] == ['1'] and removed["stopCount"] == 4
+    assert len(app.route_store.get(created["id"])) == 4
+
+    error = client.patch("/api/routes/missing", json={"op": "remove", "position": 0}).json()
+    assert error == {"error": "Route missing not found"}
@@ -0,0 +1,101 @@
+import asyncio
+import io
+import threading
+
+import pytest
+
+from route_events import EventHub
+from workers import PredictionPool
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def event_types(chunk):
+    return [line.split(': ', 1)[1] for line in chunk.decode().splitlines() if line.startswith('event: ')]
+
+
+def test_publish_without_clients_skips_encoding():
+    hub = EventHub()
+    hub.publish('route.created', lambda: pytest.fail('encoded without clients'))
+    assert len(hub) == 0
+
+
+def test_subscriber_gets_events_in_order_from_any_thread():
+    async def scenario():
+        hub = EventHub()
+        client = hub.subscribe()
+        hub.publish('route.created', lambda: {"routes": []})
+        thread = threading.Thread(target=hub.publish, args=('route.deleted', lambda: {"ids": ['1']}))
+        thread.start()
+        thread.join()
+        chunk = await client.next(1)
+        hub.unsubscribe(client)
+        return chunk, len(hub)
+
+    chunk, clients = run(scenario())
+    assert event_types(chunk) == ['route.created', 'route.deleted']
+    assert b'id: 1\n' in chunk and b'data: {"ids":["1"]}' in chunk
+    assert clients == 0
+
+
+def test_slow_client_gets_resync_instead_of_unbounded_queue():
+    async def scenario():
+        hub = EventHub(client_buffer_bytes=200)
+        client = hub.subscribe()
+        for _ in range(10):
+            hub.publish('route.created', lambda: {"routes": ['x' * 50]})
+        return await client.next(1), client.overflows
+
+    chunk, overflows = run(scenario())
+    assert overflows > 0
+    assert 'resync' in event_types(chunk)
+    assert len(chunk) <= 200
+
+
+@pytest.mark.parametrize('history, last_event_id, expected', [
+    (10, '1', ['upload.progress', 'upload.progress']),
+    (10, '3', []),
+    (2, '0', ['resync']),
+    (10, 'garbage', ['upload.progress'] * 3),
+])
+def test_reconnect_replays_missed_events_or_resyncs(history, last_event_id, expected):
+    async def scenario():
+        hub = EventHub(history=history)
+        first = hub.subscribe()
+        for n in range(3):
+            hub.publish('upload.progress', lambda n=n: {"processed": n})
+        client = hub.subscribe(last_event_id)
+        chunk = await client.next(0.01)
+        hub.unsubscribe(first)
+        return chunk
+
+    chunk = run(scenario())
+    assert (event_types(chunk) if chunk else []) == expected
+
+
+def test_client_limit():
+    async def scenario():
+        hub = EventHub(max_clients=1)
+        hub.subscribe()
+        with pytest.raises(ValueError, match='Too many event stream clients'):
+            hub.subscribe()
+
+    run(scenario())
+
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+def test_upload_progress_is_reported_in_the_parent(app, kind, monkeypatch):
+    monkeypatch.setattr(app, 'UPLOAD_PROGRESS_ROUTES', 2)
+    rows = ''.join(f"{route},{stop},{51.16 + stop * 0.01},71.47,08:0{stop}\n" for route in range(5) for stop in range(2))
+    source = b"route_id,stop_id,latitude,longitude,scheduled_time\n" + rows.encode()
+    pool = PredictionPool(kind, workers=1)
+    progress = []
+    try:
+        result = run(pool.run(app.predict_uploaded_file, io.BytesIO(source) if kind == 'thread' else source,
+                              'upload.csv', 'full', progress=lambda *args: progress.append(args)))
+    finally:
+        pool.shutdown()
+    assert len(result["routes"]) == 5
+    assert progress == [(0, 5), (2, 5), (4, 5), (5, 5)]
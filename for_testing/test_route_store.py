@@ -0,0 +1,139 @@
+import asyncio
+import json
+import sqlite3
+import threading
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from route_model import Route
+from route_responses import RouteListCache
+from route_store import RouteStore
+
+
+def make_route(route_id):
+    return Route(route_id, f"Route {route_id}", ['1', '2'], ['a', 'b'], [[51.16, 71.47], [51.17, 71.48]],
+                 [0, 60 * 10**6])
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RouteStore(str(tmp_path / 'routes.db'))
+    yield store
+    store.close()
+
+
+def test_concurrent_reserve_and_add_get_distinct_ids(store):
+    # Как create_route: все потоки начинают с одного и того же времени
+    barrier = threading.Barrier(8)
+    ids, errors = [], []
+
+    def create():
+        barrier.wait()
+        route_id = store.reserve_id('1700000000')
+        try:
+            store.add(make_route(route_id))
+            ids.append(route_id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            store.release_id(route_id)
+
+    threads = [threading.Thread(target=create) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert sorted(ids) == [str(1700000000 + i) for i in range(8)]
+    assert len(store) == 8
+    # Следующий после release - за последним сохранённым
+    assert store.reserve_id('1700000000') == '1700000008'
+
+
+def test_add_never_overwrites_existing_route(store):
+    store.add(make_route('1'))
+    duplicate = make_route('1')
+    duplicate.name = 'Other'
+    with pytest.raises(sqlite3.IntegrityError):
+        store.add(duplicate)
+    assert store.get('1').name == 'Route 1'
+    assert RouteStore(store.path).get('1').name == 'Route 1'
+
+
+def test_concurrent_create_requests_store_every_route(app):
+    stops = [{"name": "a", "latitude": 51.16, "longitude": 71.47, "scheduled_time": "08:00"},
+             {"name": "b", "latitude": 51.17, "longitude": 71.48, "scheduled_time": "08:05"}]
+
+    async def create_all():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await asyncio.gather(*[
+                client.post('/api/routes/create', json={"name": f"R{i}", "stops": stops}) for i in range(5)
+            ])
+
+    before = len(app.route_store)
+    routes = [response.json()["route"] for response in asyncio.run(create_all())]
+    assert len({route["id"] for route in routes}) == 5
+    assert len(app.route_store) == before + 5
+    assert {app.route_store.get(route["id"]).name for route in routes} == {f"R{i}" for i in range(5)}
+
+
+def test_staged_replacement_swaps_in_on_commit(store):
+    store.add_many([make_route('old')])
+    events = []
+    store.on_change(lambda kind, items: events.append((kind, items)))
+
+    staged = store.stage_replacement()
+    assert staged.add_many([make_route('1'), make_route('2')]) == []
+    assert staged.add_many([make_route('2'), make_route('3')]) == ['2']
+    # До commit хранилище отдаёт прежние маршруты
+    assert [route.id for route in store.list()] == ['old']
+
+    assert staged.commit() == 3
+    assert [route.id for route in store.list()] == ['1', '2', '3']
+    assert [route.id for route in RouteStore(store.path).list()] == ['1', '2', '3']
+    assert events == [('replaced', 3)]
+    staged.discard()
+
+
+def test_discarded_replacement_leaves_store_unchanged(store):
+    store.add_many([make_route('old')])
+    staged = store.stage_replacement()
+    staged.add_many([make_route('1')])
+    staged.discard()
+    assert [route.id for route in store.list()] == ['old']
+    tables = store._conn.execute("SELECT name FROM sqlite_temp_master WHERE name LIKE 'staged%'").fetchall()
+    assert tables == []
+
+
+def test_failed_stream_upload_keeps_stored_routes(app):
+    client = TestClient(app.app)
+    header = 'route_id,stop_id,latitude,longitude,scheduled_time\n'
+    good = ''.join(f"{route},{stop},51.1{stop},71.4{stop},08:{stop}0\n" for route in range(3) for stop in range(3))
+    assert len(client.post('/api/upload', files={'file': ('a.csv', header + good)}).json()["routes"]) == 3
+
+    bad = good.replace('2,0,51.10,71.40,08:00', '2,0,51.10,71.40,25:00')
+    response = client.post('/api/upload?stream=true&chunk_rows=3', files={'file': ('a.csv', header + bad)})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert response.status_code == 200
+    assert [line.get("id") for line in lines[:2]] == ['0', '1']
+    assert 'error' in lines[-1]
+    assert sorted(route.id for route in app.route_store.list()) == ['0', '1', '2']
+    assert all(len(route) == 3 for route in app.route_store.list())
+
+
+def test_route_list_cursor_of_deleted_route_resumes_at_next_id(store):
+    for route_id in ('9', '10', '11', '12'):
+        store.add(make_route(route_id))
+    cache = RouteListCache(store)
+    page = json.loads(cache.render(fields=('id',), limit=2)[0])
+    assert page == {"routes": [{"id": "9"}, {"id": "10"}], "nextCursor": "10"}
+
+    store.delete('10')
+    page = json.loads(cache.render(fields=('id',), cursor='10', limit=2)[0])
+    assert page == {"routes": [{"id": "11"}, {"id": "12"}], "nextCursor": None}
+    # Курсор после последнего маршрута - пустая страница, а не ошибка
+    assert json.loads(cache.render(fields=('id',), cursor='13')[0]) == {"routes": [], "nextCursor": None}
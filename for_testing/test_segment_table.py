@@ -0,0 +1,62 @@
+import numpy as np
+
+from conftest import FIXTURE_LENGTHS
+from model_loader import load_model
+from segment_table import SegmentTable
+
+
+def test_segment_table_keeps_model_version(fixture_models, tmp_path):
+    model = load_model(fixture_models['MODEL_PATH'])
+    table = SegmentTable.build(model, FIXTURE_LENGTHS)
+    assert table.model_version == model.version
+    table.save(str(tmp_path / 'table.npy'))
+    loaded = SegmentTable.load(str(tmp_path / 'table.npy'))
+    assert loaded.model_version == model.version
+
+    features = np.array([[5, 30, 1.0, 2, 8], [5, 30, 1.5, 2, 8]], dtype=np.float32)
+    values, hit = loaded.lookup(features)
+    assert hit.tolist() == [True, False]
+    assert values[0] == model.predict(features[:1])[0]
+
+
+def test_predict_segments_uses_table_only_for_its_model(app, fixture_models):
+    prediction = app.prediction
+    model = app.get_model()
+    table = prediction.segment_table
+    assert table is not None and table.model_version == model.version
+    features = np.array([[5, 30, 1.0, 2, 8], [5, 30, 1.5, 2, 8]], dtype=np.float32)
+
+    table.hits = table.misses = 0
+    np.testing.assert_allclose(prediction.predict_segments(model, features), model.predict(features))
+    assert (table.hits, table.misses) == (1, 1)
+
+    # Таблица, построенная другой версией модели, не используется
+    stale = SegmentTable(table.values, table.lengths, table.dwell_values, 'other-version')
+    prediction.segment_table = stale
+    try:
+        np.testing.assert_allclose(prediction.predict_segments(model, features), model.predict(features))
+        assert (stale.hits, stale.misses) == (0, 0)
+    finally:
+        prediction.segment_table = table
+
+
+def test_for_model_rebuilds_missing_or_stale_table(fixture_models, tmp_path, monkeypatch):
+    model = load_model(fixture_models['MODEL_PATH'])
+    path = str(tmp_path / 'table.npy')
+    stops = tmp_path / 'stops.csv'
+    stops.write_text("latitude,longitude\n51.16,71.47\n51.17,71.47\n")
+
+    built = SegmentTable.for_model(model, path, str(stops))
+    assert built.model_version == model.version and built.path == path
+    assert len(built.lengths) == 2  # 0 и сегмент между двумя остановками
+
+    # Таблица той же версии берётся с диска без пересборки
+    monkeypatch.setattr(SegmentTable, 'build', None)
+    assert SegmentTable.for_model(model, path, str(stops)).model_version == model.version
+    monkeypatch.undo()
+
+    SegmentTable(built.values, built.lengths, built.dwell_values, 'other-version').save(path)
+    assert SegmentTable.load(path).model_version == 'other-version'
+    assert SegmentTable.for_model(model, path, str(stops)).model_version == model.version
+    assert SegmentTable.for_model(model, '', str(stops)) is None
+
@@ -0,0 +1,98 @@
+import math
+
+import numpy as np
+import pytest
+
+from route_model import Route
+from route_store import RouteStore
+from stop_index import METERS_PER_DEGREE, StopRegistry
+
+TOLERANCE = 10
+REFERENCE = (['R1'], ['Reference'], np.array([[7.2925, 80.635]]))
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / 'routes.db')
+
+
+@pytest.fixture
+def registry(db):
+    registry = StopRegistry(db, reference=REFERENCE)
+    yield registry
+    registry.close()
+
+
+def boundary_latitude(near):
+    # Граница ячеек сетки ключей рядом с near
+    cell_deg = TOLERANCE / METERS_PER_DEGREE
+    return math.floor(near / cell_deg) * cell_deg
+
+
+def snap(registry, points):
+    return registry.snap(np.array(points), [f"S{i}" for i in range(len(points))], TOLERANCE)
+
+
+def test_reference_stops_win(registry):
+    ids, coordinates, matched = snap(registry, [[7.29252, 80.63501], [51.16, 71.47]])
+    assert ids[0] == 'R1' and matched[0]
+    assert coordinates[0].tolist() == [7.2925, 80.635]
+    assert ids[1].startswith('q') and not matched[1]
+    assert coordinates[1].tolist() == [51.16, 71.47]
+
+
+def test_close_points_across_a_cell_boundary_share_an_id(registry):
+    lat = boundary_latitude(51.16)
+    # ~2 м друг от друга, но в разных ячейках
+    points = [[lat - 1e-5, 71.47], [lat + 1e-5, 71.47], [lat - 1e-5, 71.47]]
+    ids, coordinates, _ = snap(registry, points)
+    assert ids[0] == ids[1] == ids[2]
+    assert coordinates[1].tolist() == points[0]
+
+
+def test_points_join_the_nearest_stop_within_tolerance(registry):
+    far = 15 / METERS_PER_DEGREE  # дальше допуска
+    ids, _, _ = snap(registry, [[51.16, 71.47], [51.16 + far, 71.47], [51.16 + far * 0.45, 71.47]])
+    assert ids[0] != ids[1]
+    assert ids[2] == ids[0]
+
+
+def test_repeated_batch_gets_the_same_ids(registry, db):
+    rng = np.random.default_rng(0)
+    points = [51.16, 71.47] + rng.normal(0, 0.0003, (500, 2))
+    first = snap(registry, points)[0]
+    again = snap(registry, points)[0]
+    assert first.tolist() == again.tolist()
+    # И в другом процессе (новый объект над той же базой)
+    other = StopRegistry(db, reference=REFERENCE)
+    assert snap(other, points)[0].tolist() == first.tolist()
+    other.close()
+
+
+def test_no_registration_keeps_coordinates(db):
+    registry = StopRegistry(None, reference=REFERENCE, register=False)
+    ids, coordinates, matched = snap(registry, [[51.16, 71.47], [7.2925, 80.635]])
+    assert ids.tolist() == [None, 'R1']
+    assert coordinates[0].tolist() == [51.16, 71.47]
+    assert matched.tolist() == [False, True]
+
+
+def test_prune_removes_stops_of_deleted_routes(registry, db):
+    store = RouteStore(db)
+    store.on_change(lambda kind, items: registry.prune() if kind in ('deleted', 'reset', 'updated') else None)
+    routes = []
+    for n, lat in enumerate((51.16, 51.20)):
+        points = [[lat, 71.47], [lat + 0.01, 71.48]]
+        ids = snap(registry, points)[0].tolist()
+        routes.append(Route(str(n), 'R', ['1', '2'], ['a', 'b'], points, [0, 60 * 10**6], canonical_ids=ids))
+    store.add_many(routes)
+    assert len(registry._ids) == 4
+
+    store.delete('0')
+    snap(registry, [[7.2925, 80.635]])  # перечитывает реестр после prune
+    assert sorted(registry._ids) == sorted(routes[1].canonical_ids)
+
+    store.replace_all([])
+    snap(registry, [[7.2925, 80.635]])
+    assert registry._ids == []
+    store.close()
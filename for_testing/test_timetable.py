@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from route_model import MINUTE_US
+from timetable import TIMETABLE_MAX_DEPARTURES, departure_grid
+
+STOPS = [{"name": f"S{i}", "latitude": 51.16 + i * 0.01, "longitude": 71.47 + i * 0.005,
+          "scheduled_time": f"08:{i * 6:02d}"} for i in range(5)]
+
+
+@pytest.fixture(scope='module')
+def client(app):
+    return TestClient(app.app)
+
+
+@pytest.fixture(scope='module')
+def route_id(client):
+    return client.post('/api/routes/create?tier=full', json={"name": "T", "stops": STOPS}).json()["route"]["id"]
+
+
+def test_departure_grid():
+    assert (departure_grid('05:00', '06:00', 20) // MINUTE_US).tolist() == [300, 320, 340]
+    assert len(departure_grid('00:00', '24:00', 1)) == TIMETABLE_MAX_DEPARTURES
+
+
+@pytest.mark.parametrize('start, end, every, message', [
+    ('06:00', '05:00', 5, 'end must be after start'),
+    ('5 am', '06:00', 5, "Invalid time '5 am'"),
+    ('05:00', '06:00', 0, 'every must be at least 1 minute'),
+])
+def test_departure_grid_errors(start, end, every, message):
+    with pytest.raises(ValueError, match=message):
+        departure_grid(start, end, every)
+
+
+def test_json_timetable_matches_lockstep_per_departure(app, client, route_id):
+    body = client.get(f'/api/routes/{route_id}/timetable', params={"start": "06:00", "end": "07:00", "every": 30}).json()
+    route = app.route_store.get(route_id)
+    assert body["routeId"] == route_id and body["stops"] == route.stop_ids
+    assert body["departures"] == ['06:00', '06:30']
+    # Каждая строка - тот же маршрут, пересчитанный со своим отправлением
+    for departure, arrivals in zip((6 * 60, 6 * 60 + 30), body["arrivals"]):
+        single = app.predict_routes_lockstep(
+            app.get_model(), np.array([departure * MINUTE_US]), np.array([len(route)]), route.segment_features,
+            route.skip_prediction, app.prediction_base_date())
+        assert arrivals == [f"{us // 3600_000_000 % 24:02d}:{us // MINUTE_US % 60:02d}" for us in single.tolist()]
+
+
+def test_csv_and_large_json_are_streamed(app, client, route_id, monkeypatch):
+    params = {"start": "05:00", "end": "24:00", "every": 1}
+    small = client.get(f'/api/routes/{route_id}/timetable', params=params).json()
+
+    rows = list(csv.reader(io.StringIO(client.get(f'/api/routes/{route_id}/timetable',
+                                                  params={**params, "format": "csv"}).text)))
+    assert rows[0] == ['departure'] + small["stops"]
+    assert [row[0] for row in rows[1:]] == small["departures"]
+    assert [row[1:] for row in rows[1:]] == small["arrivals"]
+
+    # Выше порога JSON идёт потоком, документ тот же
+    monkeypatch.setattr(app, 'TIMETABLE_JSON_STREAM_CELLS', 10)
+    streamed = client.get(f'/api/routes/{route_id}/timetable', params=params)
+    assert 'content-length' not in streamed.headers
+    assert json.loads(streamed.text) == small
+
+    binary = client.get(f'/api/routes/{route_id}/timetable', params={**params, "format": "binary"})
+    shape = tuple(int(n) for n in binary.headers['x-timetable-shape'].split(','))
+    seconds = np.frombuffer(binary.content, dtype='<i4').reshape(shape)
+    assert shape == (len(small["departures"]), len(STOPS))
+    assert seconds[0, 0] == 5 * 3600
+
+
+def test_timetable_errors(client, route_id):
+    assert client.get('/api/routes/missing/timetable').json() == {"error": "Route missing not found"}
+    error = client.get(f'/api/routes/{route_id}/timetable', params={"start": "07:00", "end": "06:00"}).json()
+    assert error == {"error": "Failed to build timetable: end must be after start"}
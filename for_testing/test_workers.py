@@ -0,0 +1,56 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+from metrics import STAGE_SECONDS, start_profile
+from workers import PredictionPool, PredictionPoolFull
+
+
+def upload(routes=3, stops=4):
+    return pd.DataFrame({
+        'route_id': [route for route in range(routes) for _ in range(stops)],
+        'stop_id': list(range(1, stops + 1)) * routes,
+        'latitude': [51.16 + stop * 0.01 for _ in range(routes) for stop in range(stops)],
+        'longitude': [71.47 + stop * 0.01 for _ in range(routes) for stop in range(stops)],
+        'scheduled_time': [f"08:{stop * 5:02d}" for _ in range(routes) for stop in range(stops)],
+    })
+
+
+def stage_count(name):
+    return STAGE_SECONDS._values.get((name,), [None, 0.0, 0])[2]
+
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+def test_worker_metrics_reach_the_parent(app, kind):
+    prediction = app.prediction
+    pool = PredictionPool(kind, workers=1, take_stats=prediction.take_worker_stats,
+                          merge_stats=prediction.merge_worker_stats)
+    df = prediction.prepare_upload_features(upload())
+    table = prediction.segment_table
+
+    async def run_twice():
+        timings = start_profile()
+        for _ in range(2):
+            routes = await pool.run(prediction.process_data_with_predictions, df)
+        return routes, timings
+
+    predicts = stage_count('predict')
+    lookups = table.hits + table.misses
+    try:
+        routes, timings = asyncio.run(run_twice())
+    finally:
+        pool.shutdown()
+    assert [route.id for route in routes] == ['0', '1', '2']
+    # 4 позиции остановок и 11 сегментов (без первой строки файла) на расчёт -
+    # в родителе ровно столько же, сколько посчитали воркеры
+    assert stage_count('predict') - predicts == 2 * 4
+    assert table.hits + table.misses - lookups == 2 * 11
+    assert timings['predict'] > 0
+
+
+def test_full_pool_rejects_work():
+    pool = PredictionPool('thread', workers=1, queue_size=0)
+    pool.reserve()
+    with pytest.raises(PredictionPoolFull):
+        pool.reserve()
@@ -50,6 +50,8 @@ type UploadResponse = {
 }
 
 const API_BASE = 'http://localhost:8000'
+// Сколько ждать подписку на /api/events перед загрузкой
+const EVENTS_OPEN_TIMEOUT_MS = 3000
 
 export default function BusAnalysisInterface() {
   const [routes, setRoutes] = useState<Route[]>([])
@@ -57,6 +59,7 @@ export default function BusAnalysisInterface() {
   const [file, setFile] = useState<File | null>(null)
   const [isLoading, setIsLoading] = useState(false)
   const [error, setError] = useState<string | null>(null)
+  const [progress, setProgress] = useState<{ processed: number, total: number | null } | null>(null)
 
   useEffect(() => {
     fetchRoutes()
@@ -94,8 +97,28 @@ export default function BusAnalysisInterface() {
     const formData = new FormData()
     formData.append('file', file)
 
+    // Прогресс обработки приходит событиями upload.progress с нашим uploadId
+    const uploadId = crypto.randomUUID()
+    const events = new EventSource(`${API_BASE}/api/events`)
+    events.addEventListener('upload.progress', (event: MessageEvent) => {
+      const data = JSON.parse(event.data)
+      if (data.uploadId === uploadId) {
+        setProgress({ processed: data.processed, total: data.total })
+      }
+    })
+    // Загрузка стартует после открытия подписки, иначе первые события
+    // прогресса придут раньше неё и потеряются. Если /api/events недоступен,
+    // файл загружается без прогресса.
+    await new Promise<void>((resolve) => {
+      const timeout = setTimeout(resolve, EVENTS_OPEN_TIMEOUT_MS)
+      events.onopen = events.onerror = () => {
+        clearTimeout(timeout)
+        resolve()
+      }
+    })
+
     try {
-      const response = await fetch(`${API_BASE}/api/upload`, {
+      const response = await fetch(`${API_BASE}/api/upload?upload_id=${uploadId}`, {
         method: 'POST',
         body: formData,
       })
@@ -117,6 +140,8 @@ export default function BusAnalysisInterface() {
       console.error('Error uploading file:', error)
       setError('Failed to upload file. Please try again.')
     } finally {
+      events.close()
+      setProgress(null)
       setIsLoading(false)
     }
   }
@@ -158,6 +183,11 @@ export default function BusAnalysisInterface() {
                 >
                   {isLoading ? 'Uploading...' : 'Upload and Process'}
                 </Button>
+                {progress && (
+                  <p className="text-sm text-muted-foreground">
+                    Processed {progress.processed}{progress.total !== null && ` of ${progress.total}`} routes
+                  </p>
+                )}
                 {error && (
                   <p className="text-sm text-red-500 bg-red-50 p-2 rounded">
                     {error}
@@ -42,37 +42,76 @@ type RouteData = {
   segments: RouteSegment[]
 }
 
+// В событиях /api/events сегменты ссылаются на id остановок
+type CompactRoute = Omit<RouteData, 'segments'> & {
+  segments?: { from: string, to: string, travelTime: number }[]
+}
+
+const withSegments = (route: CompactRoute | RouteData): RouteData => {
+  const byId = new Map(route.stops.map(stop => [stop.id, stop]))
+  const segments = route.segments?.map(segment => ({
+    from: typeof segment.from === 'string' ? byId.get(segment.from)! : segment.from,
+    to: typeof segment.to === 'string' ? byId.get(segment.to)! : segment.to,
+    travelTime: segment.travelTime
+  }))
+  return {
+    ...route,
+    segments: segments || route.stops.slice(0, -1).map((stop, index) => ({
+      from: {
+        id: stop.id,
+        name: stop.name,
+        coordinates: stop.coordinates,
+        predictedArrivalTime: stop.predictedArrivalTime
+      },
+      to: {
+        id: route.stops[index + 1].id,
+        name: route.stops[index + 1].name,
+        coordinates: route.stops[index + 1].coordinates,
+        predictedArrivalTime: route.stops[index + 1].predictedArrivalTime
+      },
+      travelTime: 5
+    }))
+  }
+}
+
 export default function RoutesPage() {
   const [routes, setRoutes] = useState<RouteData[]>([])
   const [selectedRoute, setSelectedRoute] = useState<RouteData | null>(null)
 
   useEffect(() => {
     fetchRoutes()
+
+    // Изменения маршрутов с сервера; resync - события потеряны, перечитать список
+    const events = new EventSource(`${API_BASE}/api/events`)
+    const upsert = (event: MessageEvent) => {
+      const changed: RouteData[] = JSON.parse(event.data).routes.map(withSegments)
+      const byId = new Map(changed.map(route => [route.id, route]))
+      setRoutes(current => [
+        ...current.map(route => byId.get(route.id) || route),
+        ...changed.filter(route => !current.some(r => r.id === route.id))
+      ])
+      setSelectedRoute(current => current && (byId.get(current.id) || current))
+    }
+    events.addEventListener('route.created', upsert)
+    events.addEventListener('route.updated', upsert)
+    events.addEventListener('route.deleted', (event: MessageEvent) => {
+      const ids: string[] = JSON.parse(event.data).ids
+      setRoutes(current => current.filter(route => !ids.includes(route.id)))
+      setSelectedRoute(current => current && ids.includes(current.id) ? null : current)
+    })
+    events.addEventListener('route.reset', () => {
+      setRoutes([])
+      setSelectedRoute(null)
+    })
+    events.addEventListener('resync', () => fetchRoutes())
+    return () => events.close()
   }, [])
 
   const fetchRoutes = async () => {
     try {
       const response = await fetch(`${API_BASE}/api/routes`)
       const data = await response.json()
-      const routesWithSegments = (data.routes || []).map((route: RouteData) => ({
-        ...route,
-        segments: route.segments || route.stops.slice(0, -1).map((stop, index) => ({
-          from: {
-            id: stop.id,
-            name: stop.name,
-            coordinates: stop.coordinates,
-            predictedArrivalTime: stop.predictedArrivalTime
-          },
-          to: {
-            id: route.stops[index + 1].id,
-            name: route.stops[index + 1].name,
-            coordinates: route.stops[index + 1].coordinates,
-            predictedArrivalTime: route.stops[index + 1].predictedArrivalTime
-          },
-          travelTime: 5
-        }))
-      }))
-      setRoutes(routesWithSegments)
+      setRoutes((data.routes || []).map(withSegments))
     } catch (error) {
       console.error('Error fetching routes:', error)
     }
@@ -101,7 +140,7 @@ export default function RoutesPage() {
       await fetch(`${API_BASE}/api/routes/${routeId}`, {
         method: 'DELETE'
       })
-      setRoutes(routes.filter(r => r.id !== routeId))
+      setRoutes(current => current.filter(r => r.id !== routeId))
       if (selectedRoute?.id === routeId) {
         setSelectedRoute(null)
       }
@@ -1,13 +1,37 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Literal, Optional
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-import joblib
 import os
+import json
+import io
+import asyncio
+import hmac
 from pydantic import BaseModel
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from metrics import REGISTRY, ERRORS, MODEL_TIER_REQUESTS, REQUEST_SECONDS, Gauge, server_timing, stage, start_profile
+from features import time_to_minutes, segment_lengths, scheduled_travel_times
+from model_loader import warm_up
+import prediction
+from prediction import (STOP_SNAP_METERS, get_model, model_features, model_registry, prediction_cache,
+                        predict_routes_lockstep, prediction_base_date, prepare_upload_features,
+                        process_data_with_predictions, rescore_routes, route_start_us, snap_stops, stop_registry)
+from bulk_routes import BULK_MEDIA_TYPES, body_format, bulk_columns, bulk_frame, decode_columns, encode_bulk_response
+from route_edits import edit_route, route_diff
+from route_events import RESYNC, EventHub
+from route_store import RouteStore
+from timetable import (TIMETABLE_JSON_STREAM_CELLS, departure_grid, timetable_json, iter_timetable_json,
+                       iter_timetable_csv, iter_timetable_binary)
+from route_responses import ROUTE_FIELDS, RouteListCache, etag_matches
+from workers import PredictionPool, PredictionPoolFull
 
 app = FastAPI()
 
@@ -19,121 +43,361 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-routes_data = []
+# Маршруты хранятся в SQLite (ROUTES_DB), загружаются лениво при первом запросе
+route_store = RouteStore.from_env()
+route_list_cache = RouteListCache(route_store)
+
+# События для /api/events: изменения маршрутов и прогресс загрузок.
+# EVENTS_CLIENT_BUFFER_BYTES - предел очереди одного клиента, EVENTS_MAX_CLIENTS
+route_events = EventHub(client_buffer_bytes=int(os.environ.get('EVENTS_CLIENT_BUFFER_BYTES', 1 << 20)),
+                        max_clients=int(os.environ.get('EVENTS_MAX_CLIENTS', 100)))
+EVENTS_KEEPALIVE_SECONDS = 15
+EVENT_BATCH_ROUTES = 100  # маршрутов в одном событии route.created / route.updated
+
+def publish_route_changes(kind, items):
+    if kind == 'deleted':
+        route_events.publish('route.deleted', lambda: {"ids": items})
+        return
+    if kind == 'replaced':
+        # Потоковая загрузка заменила все маршруты (items - их число), самих
+        # маршрутов в памяти нет: клиенты перечитывают /api/routes
+        route_events.publish(RESYNC, lambda: {"reason": "replaced", "count": items})
+        return
+    if kind == 'reset':
+        # Загрузка заменила все маршруты: клиент очищает список, новые придут как route.created
+        route_events.publish('route.reset', lambda: {"count": len(items)})
+        kind = 'created'
+    for start in range(0, len(items), EVENT_BATCH_ROUTES):
+        batch = items[start:start + EVENT_BATCH_ROUTES]
+        route_events.publish(f'route.{kind}', lambda batch=batch: {"routes": [route.to_compact() for route in batch]})
+
+route_store.on_change(publish_route_changes)
+
+def publish_upload_progress(upload_id, processed, total, done=False, error=None):
+    # total = None, пока число маршрутов неизвестно (потоковая загрузка)
+    def data():
+        progress = {"uploadId": upload_id, "processed": processed, "total": total, "done": done}
+        if error is not None:
+            progress["error"] = error
+        return progress
+    if upload_id is not None:
+        route_events.publish('upload.progress', data)
+
+# Пул для CPU-задач: PREDICTION_POOL=thread|process, PREDICTION_WORKERS, PREDICTION_QUEUE_SIZE
+prediction_pool = PredictionPool.from_env(take_stats=prediction.take_worker_stats,
+                                          merge_stats=prediction.merge_worker_stats)
+
+@app.exception_handler(PredictionPoolFull)
+async def prediction_pool_full_handler(request: Request, exc: PredictionPoolFull):
+    return JSONResponse(status_code=503, content={"error": str(exc)}, headers={"Retry-After": "1"})
+
+@app.on_event("shutdown")
+def shutdown_prediction_pool():
+    prediction_pool.shutdown()
+    route_store.close()
+    stop_registry.close()
+
+@app.middleware("http")
+async def measure_request(request: Request, call_next):
+    # X-Profile: 1 - вернуть разбивку по этапам в заголовке Server-Timing
+    timings = start_profile() if request.headers.get('x-profile') else None
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get('route')
+    REQUEST_SECONDS.observe(elapsed, method=request.method,
+                            path=route.path if route is not None else 'unmatched',
+                            status=response.status_code)
+    if timings is not None:
+        timings['total'] = elapsed
+        response.headers['Server-Timing'] = server_timing(timings)
+    return response
+
+def encode_json(content):
+    with stage('json_encode'):
+        return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def json_response(content, headers=None):
+    return Response(content=encode_json(content), media_type="application/json", headers=headers)
+
+# Уровень модели на запрос: full - XGBoost, fast - почасовая линейная
+# модель, auto - fast, когда очередь пула предсказаний заполнена хотя бы
+# на FAST_TIER_LOAD (доля от workers + queue_size), иначе full.
+ModelTier = Literal['full', 'fast', 'auto']
+FAST_TIER_LOAD = float(os.environ.get('FAST_TIER_LOAD', 0.5))
+
+def choose_tier(tier):
+    if tier == 'auto':
+        tier = 'fast' if prediction_pool.pending >= FAST_TIER_LOAD * prediction_pool.capacity else 'full'
+    if tier == 'fast' and model_registry.get_fast() is None:
+        tier = 'full'
+    MODEL_TIER_REQUESTS.inc(tier=tier)
+    return tier
+
+REGISTRY.register(Gauge('routes_stored', 'Routes in the route store', function=lambda: len(route_store)))
+REGISTRY.register(Gauge('prediction_cache_entries', 'Entries in the prediction cache',
+                        function=lambda: prediction_cache.stats()['size']))
+REGISTRY.register(Gauge('event_stream_clients', 'Clients connected to /api/events',
+                        function=lambda: len(route_events)))
+REGISTRY.register(Gauge('segment_table_hit_ratio', 'Share of segments answered by the lookup table',
+                        function=lambda: prediction.segment_table.stats()['hitRate'] if prediction.segment_table else 0))
+
+@app.on_event("startup")
+def load_and_warm_up_model():
+    # Сервер сообщает о готовности только после загрузки модели и прогрева
+    warm_up(get_model(), len(model_features))
+    model_registry.get_fast()
+    prediction.reload_segment_table(get_model())
+    # MODEL_WATCH_INTERVAL=5 - перезагружать модель при изменении файла
+    watch_interval = float(os.environ.get('MODEL_WATCH_INTERVAL', 0))
+    if watch_interval > 0:
+        model_registry.watch(watch_interval)
+
+def prune_stops(kind, items):
+    # Остановки, на которые больше не ссылается ни один маршрут, - из реестра
+    if STOP_SNAP_METERS > 0 and kind in ('deleted', 'reset', 'replaced', 'updated'):
+        stop_registry.prune()
+
+route_store.on_change(prune_stops)
+
+@app.get("/api/stops/nearest")
+async def get_nearest_stops(lat: float, lon: float, limit: int = Query(10, ge=1, le=100),
+                            radius: float = Query(1000, gt=0, le=20000)):
+    # Ближайшие известные остановки для карты, radius в метрах
+    stops = await run_in_threadpool(stop_registry.nearest, lat, lon, limit, radius)
+    return {"stops": stops}
+
+DEFAULT_ROUTES_RESPONSE = {
+    "routes": [{
+        "id": "1",
+        "name": "Default Route",
+        "stops": [
+            {
+                "id": "1",
+                "name": "Stop 1",
+                "coordinates": [51.1605, 71.4704],
+                "predictedArrivalTime": "10:00"
+            },
+            {
+                "id": "2",
+                "name": "Stop 2",
+                "coordinates": [51.1705, 71.4804],
+                "predictedArrivalTime": "10:15"
+            }
+        ],
+        "segments": [
+            {
+                "from": {
+                    "id": "1",
+                    "name": "Stop 1",
+                    "coordinates": [51.1605, 71.4704]
+                },
+                "to": {
+                    "id": "2",
+                    "name": "Stop 2",
+                    "coordinates": [51.1705, 71.4804]
+                },
+                "travelTime": 15
+            }
+        ]
+    }]
+}
 
-# Load trained model
-model_path = 'data/bus_travel_time_model.pkl'  # Ensure this path points to your trained model
-if not os.path.exists(model_path):
-    print(f"Model file not found at {model_path}. Please ensure the model is trained and saved.")
-    exit(1)
+def render_route_list(fields, cursor, limit, compact):
+    # (body, etag) или None, если маршрутов нет
+    if route_list_cache.is_empty():
+        return None
+    with stage('json_encode'):
+        return route_list_cache.render(fields, cursor, limit, compact)
 
-model = joblib.load(model_path)
-model_features = [
-    'scheduled_travel_time', 'dwell_time_in_seconds',
-    'segment_length', 'day_of_week', 'hour_of_day'
+@app.get("/api/routes")
+async def get_routes(request: Request, fields: Optional[str] = None,
+                     cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1),
+                     compact: bool = False):
+    # fields=id,name отдаёт только указанные поля маршрута
+    if fields is not None:
+        fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+        unknown = [field for field in fields if field not in ROUTE_FIELDS]
+        if unknown:
+            return {"error": f"Unknown fields: {', '.join(unknown)}"}
+
+    # После смены ревизии кэш сериализует все маршруты заново - не в event loop
+    rendered = await run_in_threadpool(render_route_list, fields, cursor, limit, compact)
+    if rendered is None:
+        return DEFAULT_ROUTES_RESPONSE
+    body, etag = rendered
+
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+UPLOAD_REQUIRED_COLUMNS = [
+    'route_id', 'stop_id', 'latitude', 'longitude',
+    'scheduled_time'
 ]
+UPLOAD_CHUNK_ROWS = 50000
+
+def missing_upload_columns(df):
+    return [col for col in UPLOAD_REQUIRED_COLUMNS if col not in df.columns]
+
+def iter_upload_chunks(file, filename, chunk_rows):
+    if filename.endswith('.csv'):
+        reader = pd.read_csv(file, chunksize=chunk_rows)
+        while True:
+            with stage('parse'):
+                chunk = next(reader, None)
+            if chunk is None:
+                return
+            yield chunk
+    else:
+        # pd.read_json не умеет читать JSON-массив по частям: JSON-файл
+        # читается целиком, ограниченная память потоковой загрузки - только у CSV
+        with stage('parse'):
+            df = pd.read_json(file)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+
+def route_to_json(route, compact=False):
+    # compact: сегменты ссылаются на id остановок вместо их копий
+    return route.to_compact() if compact else route.to_dict()
+
+def stream_route_predictions(chunks, compact=False, upload_id=None, tier='full'):
+    # Строки одного маршрута должны идти подряд: маршрут отдаётся, как только
+    # в файле начинается следующий, поэтому в памяти держится только
+    # текущий чанк и хвост последнего маршрута. Готовые маршруты копятся в
+    # SQLite (StagedRoutes) и заменяют сохранённые, только если файл
+    # обработан целиком; при ошибке хранилище остаётся прежним.
+    staged = route_store.stage_replacement()
+    pending = None
+
+    def emit(ready):
+        routes = process_data_with_predictions(prepare_upload_features(ready.copy()), tier=tier)
+        # Маршрут, уже встреченный раньше в файле, не сохраняется
+        split = set(staged.add_many(routes))
+        publish_upload_progress(upload_id, staged.count, None)
+        for route in routes:
+            if route.id not in split:
+                yield json.dumps(route_to_json(route, compact)) + "\n"
+        for route_id in split:
+            yield json.dumps({"error": f"Route {route_id} is split across the file, rows must be grouped by route_id"}) + "\n"
 
-def time_to_minutes(t):
-    if pd.isna(t):
-        return np.nan
-    if isinstance(t, str):
-        try:
-            x = datetime.strptime(t, '%H:%M:%S')
-        except ValueError:
-            try:
-                x = datetime.strptime(t, '%H:%M')
-            except ValueError:
-                return np.nan
-        return x.hour * 60 + x.minute
-    return t  # Already in minutes
+    try:
+        for chunk in chunks:
+            missing_columns = missing_upload_columns(chunk)
+            if missing_columns:
+                message = f"Missing required columns: {', '.join(missing_columns)}"
+                publish_upload_progress(upload_id, staged.count, None, done=True, error=message)
+                yield json.dumps({"error": message}) + "\n"
+                return
+            if pending is not None:
+                chunk = pd.concat([pending, chunk])
+            is_last_route = (chunk['route_id'] == chunk['route_id'].iloc[-1]).to_numpy()
+            pending = chunk[is_last_route]
+            yield from emit(chunk[~is_last_route])
+        if pending is not None:
+            yield from emit(pending)
+        staged.commit()
+        publish_upload_progress(upload_id, staged.count, staged.count, done=True)
+    except Exception as e:
+        print(f"Error details: {e}")
+        ERRORS.inc(endpoint='/api/upload')
+        publish_upload_progress(upload_id, staged.count, None, done=True, error=str(e))
+        yield json.dumps({"error": f"An error occurred: {str(e)}"}) + "\n"
+    finally:
+        staged.discard()
+
+UPLOAD_PROGRESS_ROUTES = 1000
+
+def process_with_progress(df, progress=None, tier='full'):
+    # Маршруты считаются пачками по UPLOAD_PROGRESS_ROUTES в порядке route_id,
+    # после каждой пачки - progress(посчитано, всего)
+    codes = df.groupby('route_id', sort=True).ngroup().to_numpy()
+    total = int(codes.max()) + 1 if len(codes) else 0
+    if progress is None or total <= UPLOAD_PROGRESS_ROUTES:
+        return process_data_with_predictions(df, tier=tier)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(0, total + UPLOAD_PROGRESS_ROUTES, UPLOAD_PROGRESS_ROUTES))
+    routes = []
+    progress(0, total)
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        routes.extend(process_data_with_predictions(df.iloc[order[start:end]], tier=tier))
+        progress(len(routes), total)
+    return routes
 
-@app.get("/api/routes")
-async def get_routes():
-    if not routes_data:
+def predict_uploaded_file(source, filename, tier='full', progress=None):
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with stage('parse'):
+        if filename.endswith('.csv'):
+            df = pd.read_csv(source)
+        else:
+            df = pd.read_json(source)
+
+    missing_columns = missing_upload_columns(df)
+    if missing_columns:
         return {
-            "routes": [{
-                "id": "1",
-                "name": "Default Route",
-                "stops": [
-                    {
-                        "id": "1",
-                        "name": "Stop 1",
-                        "coordinates": [51.1605, 71.4704],
-                        "predictedArrivalTime": "10:00"
-                    },
-                    {
-                        "id": "2",
-                        "name": "Stop 2",
-                        "coordinates": [51.1705, 71.4804],
-                        "predictedArrivalTime": "10:15"
-                    }
-                ],
-                "segments": [
-                    {
-                        "from": {
-                            "id": "1",
-                            "name": "Stop 1",
-                            "coordinates": [51.1605, 71.4704]
-                        },
-                        "to": {
-                            "id": "2",
-                            "name": "Stop 2",
-                            "coordinates": [51.1705, 71.4804]
-                        },
-                        "travelTime": 15
-                    }
-                ]
-            }]
+            "error": f"Missing required columns: {', '.join(missing_columns)}"
         }
-    return {"routes": routes_data}
+
+    return {"routes": process_with_progress(prepare_upload_features(df), progress, tier)}
+
+def store_uploaded_routes(routes, compact):
+    route_store.replace_all(routes)
+    # По маршруту за вызов json.dumps: один вызов на весь ответ держал бы GIL
+    # (и event loop) всё время кодирования
+    with stage('json_encode'):
+        parts = [json.dumps(route_to_json(route, compact), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                 for route in routes]
+        return b'{"routes":[' + b','.join(parts) + b']}'
 
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(response: Response, file: UploadFile = File(...), stream: bool = False,
+                      chunk_rows: int = UPLOAD_CHUNK_ROWS, compact: bool = False,
+                      upload_id: Optional[str] = None, tier: ModelTier = 'full'):
+    # upload_id - id для событий upload.progress в /api/events, по умолчанию
+    # генерируется и возвращается в заголовке X-Upload-Id.
+    # Загрузке точность важнее задержки, по умолчанию tier=full.
+    upload_id = upload_id or uuid.uuid4().hex
     try:
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file.file)
-        elif file.filename.endswith('.json'):
-            df = pd.read_json(file.file)
-        else:
+        tier = choose_tier(tier)
+        if not file.filename.endswith(('.csv', '.json')):
             return {"error": "Only CSV and JSON files are supported"}
 
-        # Конвертируем scheduled_time в минуты
-        if 'scheduled_time' in df.columns:
-            df['scheduled_time'] = df['scheduled_time'].apply(time_to_minutes)
-
-        required_columns = [
-            'route_id', 'stop_id', 'latitude', 'longitude',
-            'scheduled_time'
-        ]
-        missing_columns = [
-            col for col in required_columns if col not in df.columns
-        ]
-        if missing_columns:
-            return {
-                "error": f"Missing required columns: {', '.join(missing_columns)}"
-            }
-
-        # Добавляем вычисление segment_length
-        df['segment_length'] = df.apply(
-            lambda row: calculate_distance(
-                row['latitude'], 
-                row['longitude'],
-                df.shift(1)['latitude'].iloc[0] if pd.notna(df.shift(1)['latitude'].iloc[0]) else row['latitude'],
-                df.shift(1)['longitude'].iloc[0] if pd.notna(df.shift(1)['longitude'].iloc[0]) else row['longitude']
-            ),
-            axis=1
-        )
-        
-        # Добавляем фиксированное значение dwell_time_in_seconds
-        df['dwell_time_in_seconds'] = 30  # среднее время остановки
-
-        routes = process_data_with_predictions(df)
-        global routes_data
-        routes_data = routes
-
-        return {"routes": routes_data}
+        if stream:
+            # NDJSON: по одной строке на маршрут, сразу после предсказания.
+            # Сохранённые маршруты заменяются в конце, если файл обработан
+            # без ошибок. Память ограничена чанком только для CSV: JSON
+            # читается целиком.
+            prediction_pool.reserve()
+            chunks = iter_upload_chunks(file.file, file.filename, max(chunk_rows, 1))
+            return StreamingResponse(
+                prediction_pool.stream(stream_route_predictions(chunks, compact, upload_id, tier)),
+                media_type="application/x-ndjson",
+                headers={"X-Model-Version": get_model(tier).version, "X-Model-Tier": tier, "X-Upload-Id": upload_id}
+            )
+
+        # В процесс-пул нельзя передать открытый файл, только его содержимое
+        source = file.file if prediction_pool.kind == 'thread' else await file.read()
+        # upload.progress публикуется в этом процессе и с PREDICTION_POOL=process
+        result = await prediction_pool.run(predict_uploaded_file, source, file.filename, tier,
+                                           progress=partial(publish_upload_progress, upload_id))
+        if "error" in result:
+            publish_upload_progress(upload_id, 0, None, done=True, error=result["error"])
+            return result
+
+        # Запись в хранилище и кодирование ответа - тоже вне event loop
+        body = await run_in_threadpool(store_uploaded_routes, result["routes"], compact)
+        publish_upload_progress(upload_id, len(result["routes"]), len(result["routes"]), done=True)
+        headers = {"X-Upload-Id": upload_id, "X-Model-Tier": tier}
+        if result["routes"]:
+            headers["X-Model-Version"] = result["routes"][0].model_version
+        return Response(content=body, media_type="application/json", headers=headers)
+    except PredictionPoolFull:
+        raise
     except Exception as e:
         print(f"Error details: {e}")
+        ERRORS.inc(endpoint='/api/upload')
+        publish_upload_progress(upload_id, 0, None, done=True, error=str(e))
         return {"error": f"An error occurred: {str(e)}"}
     
     
@@ -141,86 +405,18 @@ async def upload_file(file: UploadFile = File(...)):
 
 def predict_travel_time(row, start_time):
     # Подготовка данных для предсказания
-    features = pd.DataFrame([{
-        'scheduled_travel_time': row['scheduled_travel_time'],
-        'dwell_time_in_seconds': row['dwell_time_in_seconds'],
-        'segment_length': row['segment_length'],
-        'day_of_week': start_time.weekday(),
-        'hour_of_day': start_time.hour
-    }])
+    features = np.array([[
+        row['scheduled_travel_time'],
+        row['dwell_time_in_seconds'],
+        row['segment_length'],
+        start_time.weekday(),
+        start_time.hour
+    ]], dtype=np.float32)
 
     # Используем модель для предсказания времени в пути
-    predicted_travel_time = model.predict(features)[0]  # Model output in minutes
+    predicted_travel_time = get_model().predict(features)[0]  # Model output in minutes
     return float(predicted_travel_time) 
 
-def process_data_with_predictions(df):
-    routes = []
-    
-    # Группируем данные по маршрутам
-    for route_id, route_stops in df.groupby('route_id'):
-        stops = []
-        segments = []
-        prev_stop = None
-        prev_arrival_time = None
-
-        # Initialize start_time based on scheduled time of the first stop
-        first_stop = route_stops.iloc[0]
-        scheduled_time_minutes = first_stop['scheduled_time']
-        start_time = datetime.now().replace(
-            hour=int(scheduled_time_minutes // 60),
-            minute=int(scheduled_time_minutes % 60),
-            second=0, microsecond=0
-        )
-
-        for idx, row in route_stops.iterrows():
-            # Если это первая остановка, предсказанное время в пути равно 0
-            if idx == 0:
-                predicted_travel_time = 0
-            else:
-                # Подготовка данных для предсказания
-                features = pd.DataFrame([{
-                    'scheduled_travel_time': row['scheduled_travel_time'],
-                    'dwell_time_in_seconds': row['dwell_time_in_seconds'],
-                    'segment_length': row['segment_length'],
-                    'day_of_week': start_time.weekday(),
-                    'hour_of_day': start_time.hour
-                }])
-
-                predicted_travel_time = model.predict(features)[0]
-
-            arrival_time = start_time + timedelta(minutes=float(predicted_travel_time))
-            
-            stop = {
-                "id": str(row['stop_id']),
-                "name": row.get('address', f"Stop {row['stop_id']}"),
-                "coordinates": [float(row['latitude']), float(row['longitude'])],
-                "predictedArrivalTime": arrival_time.strftime("%H:%M")
-            }
-
-            if prev_stop and prev_arrival_time:
-                travel_time = (arrival_time - prev_arrival_time).total_seconds() / 60
-                segment = {
-                    "from": prev_stop,
-                    "to": stop,
-                    "travelTime": round(travel_time, 2)
-                }
-                segments.append(segment)
-
-            stops.append(stop)
-            prev_stop = stop
-            prev_arrival_time = arrival_time
-            start_time = arrival_time + timedelta(seconds=float(row['dwell_time_in_seconds']))
-
-        route = {
-            "id": str(route_id),
-            "name": f"Route {route_id}",
-            "stops": stops,
-            "segments": segments
-        }
-        routes.append(route)
-
-    return routes
-
 # Добавим новые модели данных
 class StopCreate(BaseModel):
     name: str
@@ -233,72 +429,397 @@ class RouteCreate(BaseModel):
     stops: List[StopCreate]
 
 # Добавим новые эндпоинты
-@app.post("/api/routes/create")
-async def create_route(route: RouteCreate):
-    try:
-        global routes_data
-        route_id = str(int(time.time()))
-        
-        # Преобразуем данные в формат DataFrame
-        stops_data = []
-        for idx, stop in enumerate(route.stops):
-            stops_data.append({
-                'route_id': route_id,
-                'stop_id': idx + 1,
-                'latitude': stop.latitude,
-                'longitude': stop.longitude,
-                'scheduled_time': time_to_minutes(stop.scheduled_time),
-                'address': stop.name
-            })
-        
-        new_route_df = pd.DataFrame(stops_data)
-        
-        # Добавляем необходимые колонки
-        new_route_df['dwell_time_in_seconds'] = 30
-        
+def predict_created_route(route, route_id, tier='full'):
+    # Преобразуем данные в формат DataFrame
+    stops_data = []
+    for idx, stop in enumerate(route.stops):
+        stops_data.append({
+            'route_id': route_id,
+            'stop_id': idx + 1,
+            'latitude': stop.latitude,
+            'longitude': stop.longitude,
+            'scheduled_time': time_to_minutes(stop.scheduled_time),
+            'address': stop.name
+        })
+    
+    new_route_df = pd.DataFrame(stops_data)
+    
+    # Добавляем необходимые колонки
+    new_route_df['dwell_time_in_seconds'] = 30
+    new_route_df = snap_stops(new_route_df)
+    
+    with stage('segment_length'):
         # Вычисляем длину сегментов
-        new_route_df['segment_length'] = new_route_df.apply(
-            lambda row: calculate_distance(
-                row['latitude'], 
-                row['longitude'],
-                new_route_df.shift(1)['latitude'].iloc[0] if pd.notna(new_route_df.shift(1)['latitude'].iloc[0]) else row['latitude'],
-                new_route_df.shift(1)['longitude'].iloc[0] if pd.notna(new_route_df.shift(1)['longitude'].iloc[0]) else row['longitude']
-            ),
-            axis=1
-        )
+        new_route_df['segment_length'] = segment_lengths(new_route_df)
 
         # Вычисляем scheduled_travel_time как разницу между временем текущей и предыдущей остановки
-        new_route_df['scheduled_travel_time'] = new_route_df['scheduled_time'].diff()
-        # Для первой остановки ставим 0
-        new_route_df.loc[0, 'scheduled_travel_time'] = 0
-        
-        # Заполняем пропущенные значения средним временем
-        mean_travel_time = new_route_df['scheduled_travel_time'].mean()
-        new_route_df['scheduled_travel_time'] = new_route_df['scheduled_travel_time'].fillna(mean_travel_time)
-
-        # Обработаем маршрут и добавим предсказания
-        processed_route = process_data_with_predictions(new_route_df)[0]
-        processed_route['name'] = route.name
-        routes_data.append(processed_route)
-        
-        return {"success": True, "route": processed_route}
+        new_route_df['scheduled_travel_time'] = scheduled_travel_times(new_route_df)
+    
+    # Заполняем пропущенные значения средним временем
+    mean_travel_time = new_route_df['scheduled_travel_time'].mean()
+    new_route_df['scheduled_travel_time'] = new_route_df['scheduled_travel_time'].fillna(mean_travel_time)
+
+    # Обработаем маршрут и добавим предсказания
+    processed_route = process_data_with_predictions(new_route_df, tier=tier)[0]
+    processed_route.name = route.name
+    return processed_route
+
+@app.post("/api/routes/create")
+async def create_route(route: RouteCreate, response: Response, compact: bool = False, tier: ModelTier = 'auto'):
+    # Интерактивное рисование маршрута: по умолчанию tier=auto
+    try:
+        tier = choose_tier(tier)
+        # Вызовы хранилища - в потоках: SQLite и блокировка хранилища (её
+        # держит, например, сохранение большой загрузки) не блокируют event loop
+        route_id = await run_in_threadpool(route_store.reserve_id, str(int(time.time())))
+        try:
+            processed_route = await prediction_pool.run(predict_created_route, route, route_id, tier)
+            await run_in_threadpool(route_store.add, processed_route)
+        finally:
+            await run_in_threadpool(route_store.release_id, route_id)
+        if tier == 'fast':
+            schedule_rescore()
+
+        with stage('json_encode'):
+            route_json = route_to_json(processed_route, compact)
+        return json_response({"success": True, "route": route_json},
+                             {"X-Model-Version": processed_route.model_version, "X-Model-Tier": tier})
+    except PredictionPoolFull:
+        raise
     except Exception as e:
         print(f"Error creating route: {str(e)}")  # Добавляем детальный вывод ошибки
+        ERRORS.inc(endpoint='/api/routes/create')
         return {"error": f"Failed to create route: {str(e)}"}
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    # Простой расчет расстояния между координатами (можно улучшить)
-    from math import sqrt
-    return sqrt((lat2 - lat1)**2 + (lon2 - lon1)**2) * 111  # приблизительно в км
+def predict_bulk_routes(body, fmt, keep_routes, tier='full'):
+    # Разбор, проверка, предсказание и кодирование ответа - целиком в пуле.
+    # Возвращает (маршруты для сохранения или None, тело ответа, версия модели)
+    with stage('parse'):
+        columns = decode_columns(body, fmt)
+    with stage('validate'):
+        df, route_names = bulk_frame(columns)
+    order = pd.unique(df['route_id'])
+
+    df['dwell_time_in_seconds'] = 30
+    df = snap_stops(df)
+    with stage('segment_length'):
+        df['segment_length'] = segment_lengths(df)
+        df['scheduled_travel_time'] = scheduled_travel_times(df)
+
+    by_id = {route.id: route for route in process_data_with_predictions(df, tier=tier)}
+    routes = [by_id[route_id] for route_id in order]
+    for route in routes:
+        route.name = route_names.get(route.id, route.name)
+    model_version = routes[0].model_version
+    with stage('encode'):
+        content = encode_bulk_response(bulk_columns(routes), fmt, model_version, len(routes), keep_routes)
+    return (routes if keep_routes else None), content, model_version
+
+def store_bulk_routes(routes):
+    # Пустой список, если маршруты сохранены, иначе id уже существующих
+    existing = [route.id for route in routes if route_store.get(route.id) is not None]
+    if not existing:
+        route_store.add_many(routes)
+    return existing
+
+@app.post("/api/routes/bulk")
+async def predict_routes_bulk(request: Request, store: bool = False, tier: ModelTier = 'full'):
+    # Тело - колонки routeId, latitude, longitude, scheduledTime и
+    # необязательные name, routeName (строка на остановку) в JSON, msgpack
+    # (application/msgpack) или Arrow IPC stream
+    # (application/vnd.apache.arrow.stream); ответ в том же формате.
+    # store=true - сохранить маршруты под их routeId.
+    try:
+        fmt = body_format(request.headers.get('content-type'))
+        body = await request.body()
+        tier = choose_tier(tier)
+        routes, content, model_version = await prediction_pool.run(predict_bulk_routes, body, fmt, store, tier)
+        if store:
+            existing = await run_in_threadpool(store_bulk_routes, routes)
+            if existing:
+                return {"error": f"Routes already exist: {', '.join(existing[:10])}"}
+            if tier == 'fast':
+                schedule_rescore()
+        return Response(content=content, media_type=BULK_MEDIA_TYPES[fmt],
+                        headers={"X-Model-Version": model_version, "X-Model-Tier": tier})
+    except PredictionPoolFull:
+        raise
+    except Exception as e:
+        print(f"Error predicting bulk routes: {e}")
+        ERRORS.inc(endpoint='/api/routes/bulk')
+        return {"error": f"Failed to predict routes: {str(e)}"}
+
+class StopEdit(BaseModel):
+    op: Literal['insert', 'move', 'retime', 'remove']
+    position: int
+    to: Optional[int] = None  # для move
+    stop: Optional[StopCreate] = None  # для insert
+    scheduled_time: Optional[str] = None  # для retime, при move - необязательно
+
+def predict_edited_route(route, edit, tier='full'):
+    # Пересчёт прибытия только с первой затронутой правкой остановки. Если
+    # маршрут считала другая версия модели, пересчитывается весь маршрут.
+    if edit.stop is not None:
+        scheduled_time = edit.stop.scheduled_time
+    else:
+        scheduled_time = edit.scheduled_time
+    scheduled_minutes = time_to_minutes(scheduled_time) if scheduled_time is not None else None
+
+    stop, canonical_id = edit.stop, None
+    if edit.op == 'insert' and stop is not None and STOP_SNAP_METERS > 0:
+        ids, coordinates, _ = stop_registry.snap([[stop.latitude, stop.longitude]], [stop.name], STOP_SNAP_METERS)
+        latitude, longitude = coordinates[0].tolist()
+        stop = StopCreate(name=stop.name, latitude=latitude, longitude=longitude,
+                          scheduled_time=stop.scheduled_time)
+        canonical_id = ids[0]
+    edited, first = edit_route(route, edit.op, edit.position, edit.to, stop, scheduled_minutes, canonical_id)
+
+    model = get_model(tier)
+    if edited.model_version != model.version:
+        first = 0
+    if first >= len(edited):
+        return edited, first
+
+    start_us = edited.start_us
+    if first == 0:
+        start_us = int(route_start_us(edited.schedule()[:1])[0])
+        clock = start_us
+    else:
+        clock = edited.arrival_us[first - 1] + int(np.rint(edited.segment_features[first - 1, 1] * 10**6))
+    suffix = predict_routes_lockstep(
+        model, np.array([clock], dtype=np.int64), np.array([len(edited) - first]),
+        edited.segment_features[first:], edited.skip_prediction[first:], prediction_base_date()
+    )
+    edited = edited.with_arrivals(np.concatenate([edited.arrival_us[:first], suffix]), model.version)
+    edited.start_us = start_us
+    return edited, first
+
+@app.patch("/api/routes/{route_id}")
+async def edit_route_stop(route_id: str, edit: StopEdit, tier: ModelTier = 'auto'):
+    # Вставка, перенос, смена времени или удаление одной остановки.
+    # В ответе только изменившиеся остановки и сегменты.
+    try:
+        route = await run_in_threadpool(route_store.get, route_id)
+        if route is None:
+            return {"error": f"Route {route_id} not found"}
+        tier = choose_tier(tier)
+        edited, first = await prediction_pool.run(predict_edited_route, route, edit, tier)
+        if not await run_in_threadpool(route_store.update, edited):
+            return {"error": f"Route {route_id} not found"}
+        if tier == 'fast':
+            schedule_rescore()
+        return json_response({"success": True, **route_diff(route, edited, first)},
+                             {"X-Model-Version": edited.model_version, "X-Model-Tier": tier})
+    except PredictionPoolFull:
+        raise
+    except Exception as e:
+        print(f"Error editing route: {e}")
+        ERRORS.inc(endpoint='/api/routes/{route_id}')
+        return {"error": f"Failed to edit route: {str(e)}"}
+
+def predict_timetable(route, departures_us, tier='full'):
+    # Все отправления идут по маршруту вместе: каждое - отдельный "маршрут"
+    # в lockstep, модель вызывается один раз на позицию остановки
+    if not route.can_rescore():
+        raise ValueError(f"Route {route.id} was stored without segment features, recreate it first")
+    model = get_model(tier)
+    n_departures = len(departures_us)
+    arrival_us = predict_routes_lockstep(
+        model, departures_us, np.full(n_departures, len(route)),
+        np.tile(route.segment_features, (n_departures, 1)), np.tile(route.skip_prediction, n_departures),
+        prediction_base_date()
+    )
+    return arrival_us.reshape(n_departures, len(route)), model.version
+
+@app.get("/api/routes/{route_id}/timetable")
+async def get_route_timetable(route_id: str, start: str = "05:00", end: str = "24:00",
+                              every: int = Query(5, ge=1), format: Literal['json', 'csv', 'binary'] = 'json',
+                              tier: ModelTier = 'full'):
+    # Прибытие на все остановки для каждого отправления из сетки [start, end).
+    # csv и binary отдаются потоком; binary - int32 секунды от полуночи,
+    # матрица отправления x остановки построчно. json больше
+    # TIMETABLE_JSON_STREAM_CELLS ячеек - тоже потоком. Матрица прибытия
+    # (int64, не больше TIMETABLE_MAX_DEPARTURES = 1440 отправлений на число
+    # остановок) считается целиком в памяти, кодируется - по кускам.
+    try:
+        route = await run_in_threadpool(route_store.get, route_id)
+        if route is None:
+            return {"error": f"Route {route_id} not found"}
+        departures_us = departure_grid(start, end, every)
+        tier = choose_tier(tier)
+        arrivals_us, version = await prediction_pool.run(predict_timetable, route, departures_us, tier)
+        headers = {"X-Model-Version": version, "X-Model-Tier": tier}
+        if format == 'csv':
+            return StreamingResponse(iter_timetable_csv(route, departures_us, arrivals_us),
+                                     media_type="text/csv", headers=headers)
+        if format == 'binary':
+            headers["X-Timetable-Shape"] = f"{arrivals_us.shape[0]},{arrivals_us.shape[1]}"
+            headers["X-Timetable-Dtype"] = "<i4"
+            return StreamingResponse(iter_timetable_binary(arrivals_us),
+                                     media_type="application/octet-stream", headers=headers)
+        if arrivals_us.size > TIMETABLE_JSON_STREAM_CELLS:
+            return StreamingResponse(iter_timetable_json(route, departures_us, arrivals_us, version),
+                                     media_type="application/json", headers=headers)
+        with stage('json_encode'):
+            content = timetable_json(route, departures_us, arrivals_us, version)
+        return json_response(content, headers)
+    except PredictionPoolFull:
+        raise
+    except Exception as e:
+        print(f"Error building timetable: {e}")
+        ERRORS.inc(endpoint='/api/routes/{route_id}/timetable')
+        return {"error": f"Failed to build timetable: {str(e)}"}
+
+# Маршруты, посчитанные прошлой версией модели, пересчитываются в фоне
+# пачками, чтобы не блокировать запросы одним большим проходом
+RESCORE_BATCH_SIZE = 200
+rescore_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rescore')
+
+def rescore_stale_routes():
+    while True:
+        revision, routes = route_store.snapshot()
+        model = get_model()
+        stale = [route for route in routes
+                 if route.can_rescore() and route.model_version != model.version]
+        if not stale:
+            return
+        for start in range(0, len(stale), RESCORE_BATCH_SIZE):
+            if get_model() is not model:
+                break  # модель снова сменилась - начинаем заново
+            rescored = rescore_routes(stale[start:start + RESCORE_BATCH_SIZE], model)
+            revision = route_store.update_many(rescored, revision)
+            if revision is None:
+                break  # набор маршрутов изменился - берём свежий снимок
+        else:
+            return
+
+# Маршруты, посчитанные быстрым уровнем, тоже "устарели": после ответа они
+# в фоне пересчитываются основной моделью (и приходят в /api/events как
+# route.updated). В очереди не больше одного такого прохода.
+rescore_pending = threading.Event()
+
+def run_scheduled_rescore():
+    rescore_pending.clear()
+    rescore_stale_routes()
+
+def schedule_rescore():
+    if not rescore_pending.is_set():
+        rescore_pending.set()
+        rescore_executor.submit(run_scheduled_rescore)
+
+def on_model_swap(new_model):
+    prediction.reload_segment_table(new_model)
+    prediction_pool.restart()
+    rescore_executor.submit(rescore_stale_routes)
+
+model_registry.on_swap(on_model_swap)
+
+# Админские эндпоинты, меняющие модель: с заголовком X-Admin-Token, равным
+# ADMIN_TOKEN, а без ADMIN_TOKEN - только с localhost. Файл для reload -
+# только .ubj/.json внутри MODELS_DIR (по умолчанию data/): .pkl грузится
+# через pickle, то есть может выполнить произвольный код.
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+MODELS_DIR = os.environ.get('MODELS_DIR', 'data')
+RELOADABLE_MODEL_EXTENSIONS = ('.ubj', '.json')
+LOCAL_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+def admin_denied(request):
+    # Ответ 403 или None, если запрос разрешён
+    if ADMIN_TOKEN:
+        allowed = hmac.compare_digest(request.headers.get('x-admin-token', ''), ADMIN_TOKEN)
+    else:
+        allowed = request.client is not None and request.client.host in LOCAL_HOSTS
+    if allowed:
+        return None
+    return JSONResponse(status_code=403, content={"error": "Admin endpoints need X-Admin-Token or a local client"})
+
+def resolve_model_path(path):
+    models_dir = os.path.realpath(MODELS_DIR)
+    resolved = os.path.realpath(os.path.join(models_dir, path))
+    if os.path.commonpath([models_dir, resolved]) != models_dir:
+        raise ValueError(f"Model path must be inside {MODELS_DIR}")
+    if not resolved.endswith(RELOADABLE_MODEL_EXTENSIONS):
+        raise ValueError(f"Only {', '.join(RELOADABLE_MODEL_EXTENSIONS)} models can be loaded through the API")
+    return resolved
+
+@app.get("/api/admin/model")
+async def get_model_info():
+    return model_registry.info()
+
+@app.post("/api/admin/model/reload")
+async def reload_model(request: Request, path: Optional[str] = None):
+    # Загрузка, проверка на эталонном наборе и прогрев - в отдельном потоке.
+    # path - относительно MODELS_DIR
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    try:
+        if path is not None:
+            path = resolve_model_path(path)
+        loop = asyncio.get_running_loop()
+        new_model = await loop.run_in_executor(None, model_registry.reload, path)
+        return {"success": True, "model": new_model.info()}
+    except Exception as e:
+        print(f"Error reloading model: {e}")
+        ERRORS.inc(endpoint='/api/admin/model/reload')
+        return {"error": f"Failed to reload model: {str(e)}"}
+
+@app.post("/api/admin/model/rollback")
+async def rollback_model(request: Request):
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    try:
+        return {"success": True, "model": model_registry.rollback().info()}
+    except Exception as e:
+        print(f"Error rolling back model: {e}")
+        ERRORS.inc(endpoint='/api/admin/model/rollback')
+        return {"error": f"Failed to roll back model: {str(e)}"}
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    # С PREDICTION_POOL=process счётчики приходят из воркеров вместе с
+    # результатами задач, а size - записи кэша этого процесса (у каждого
+    # воркера свой кэш)
+    stats = prediction_cache.stats()
+    stats["segmentTable"] = prediction.segment_table.stats() if prediction.segment_table else None
+    return stats
+
+@app.get("/api/events")
+async def stream_events(request: Request):
+    # Server-sent events: route.created / route.updated (компактные маршруты),
+    # route.deleted (id), route.reset, upload.progress и resync - сигнал
+    # перечитать /api/routes, если клиент отстал или пропустил события.
+    # EventSource сам переподключается и присылает Last-Event-ID.
+    try:
+        subscription = route_events.subscribe(request.headers.get('last-event-id'))
+    except ValueError as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+
+    async def events():
+        try:
+            yield b"retry: 3000\n\n"
+            while not await request.is_disconnected():
+                chunk = await subscription.next(EVENTS_KEEPALIVE_SECONDS)
+                yield chunk if chunk is not None else b": keepalive\n\n"
+        finally:
+            route_events.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.delete("/api/routes/{route_id}")
 async def delete_route(route_id: str):
     try:
-        global routes_data
-        routes_data = [route for route in routes_data if route["id"] != route_id]
+        await run_in_threadpool(route_store.delete, route_id)
         return {"success": True}
     except Exception as e:
         print(f"Error deleting route: {e}")
+        ERRORS.inc(endpoint='/api/routes/{route_id}')
         return {"error": f"Failed to delete route: {str(e)}"}
 
 if __name__ == "__main__":
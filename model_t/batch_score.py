@@ -0,0 +1,243 @@
+# Пакетный прогон истории: рейс из trips_data.csv с его прибытиями из
+# dwell_sorted.csv - маршрут, который проходит ту же подготовку признаков и
+# lockstep-предсказание, что и загрузка через /api/upload
+# (prepare_upload_features, process_data_with_predictions), с днём недели
+# по дате рейса. Прибытия читаются кусками по целым рейсам (строки рейса
+# должны идти подряд), куски считаются в пуле процессов, результат куска -
+# отдельная колоночная часть в --output (формат кэша feature_pipeline).
+# Остановки привязываются только к --stops, без базы маршрутов сервера:
+# прогон не зависит от загруженных маршрутов и ничего в неё не пишет.
+# Повторный запуск пропускает готовые части. Запуск из model_t/:
+#   python batch_score.py --workers 4 --output data/scores
+#   python batch_score.py --output data/scores --summary-only
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+import prediction  # noqa: E402
+from prediction import get_model, prepare_upload_features, process_data_with_predictions  # noqa: E402
+from feature_pipeline import arrival_features, downcast, load_frame, load_stops, save_frame  # noqa: E402
+from features import times_to_minutes  # noqa: E402
+from route_model import MINUTE_US  # noqa: E402
+from stop_index import StopRegistry, known_stops  # noqa: E402
+
+DEFAULT_CHUNK_ROWS = 200000
+MANIFEST = 'manifest.json'
+DAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def load_trip_dates(path):
+    # trip_id, start_time (минуты) и дата рейса
+    trips = pd.read_csv(path, usecols=lambda column: column in ('trip_id', 'date', 'start_time'))
+    trips['start_time'] = times_to_minutes(trips['start_time'])
+    trips['date'] = pd.to_datetime(trips['date'], errors='coerce')
+    return trips.dropna(subset=['start_time', 'date'])
+
+
+def iter_trip_chunks(path, chunk_rows):
+    # Куски прибытий по целым рейсам: хвост последнего рейса куска
+    # переносится в следующий
+    pending = None
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, dtype={'bus_stop': str}):
+        if pending is not None:
+            chunk = pd.concat([pending, chunk])
+        is_last_trip = (chunk['trip_id'] == chunk['trip_id'].iloc[-1]).to_numpy()
+        pending = chunk[is_last_trip]
+        if not is_last_trip.all():
+            yield chunk[~is_last_trip]
+    if pending is not None and len(pending):
+        yield pending
+
+
+def part_path(output, part):
+    return os.path.join(output, f"part-{part:06d}")
+
+
+def score_chunk(part, arrivals, stops, trips, output):
+    # Считает кусок и пишет его часть; возвращает (номер части, строк)
+    arrivals = arrivals[arrivals['trip_id'].isin(trips['trip_id'])]
+    arrivals = arrival_features(arrivals, stops, trips[['trip_id', 'start_time']])
+    # У прибытий может быть своя колонка date, день недели берётся по рейсу
+    arrivals = arrivals.merge(trips[['trip_id', 'date']].rename(columns={'date': 'trip_date'}),
+                              on='trip_id', how='left')
+    # Индекс - позиция остановки в рейсе, как у bulk_frame: для первой
+    # остановки каждого рейса время в пути не предсказывается
+    upload = pd.DataFrame({
+        'route_id': arrivals['trip_id'].to_numpy(),
+        'stop_id': arrivals['stop_id'].astype(str).to_numpy(),
+        'latitude': arrivals['latitude'].to_numpy(dtype=np.float64),
+        'longitude': arrivals['longitude'].to_numpy(dtype=np.float64),
+        'scheduled_time': arrivals['scheduled_time'].to_numpy(dtype=np.float64),
+    }, index=arrivals.groupby('trip_id', sort=False).cumcount().to_numpy())
+
+    # process_data_with_predictions отдаёт маршруты по возрастанию route_id,
+    # строки маршрута - в исходном порядке
+    predicted = np.full(len(upload), np.nan)
+    for date, rows in arrivals.groupby('trip_date').indices.items():
+        routes = process_data_with_predictions(prepare_upload_features(upload.iloc[rows].copy()),
+                                               date.to_pydatetime())
+        order = rows[np.argsort(upload['route_id'].to_numpy()[rows], kind='stable')]
+        predicted[order] = np.concatenate([route.arrival_us for route in routes]) / MINUTE_US
+
+    scores = pd.DataFrame({
+        'trip_id': arrivals['trip_id'].to_numpy(),
+        'route_id': arrivals['route_id'].to_numpy() if 'route_id' in arrivals.columns else 0,
+        'stop_id': upload['stop_id'].to_numpy(),
+        'day_of_week': arrivals['trip_date'].dt.dayofweek.to_numpy(),
+        'hour_of_day': (arrivals['scheduled_time'].to_numpy() // 60 % 24).astype(np.int64),
+        'scheduled_time': arrivals['scheduled_time'].to_numpy(dtype=np.float64),
+        'actual_arrival': arrivals['arrival_time'].to_numpy(dtype=np.float64),
+        'predicted_arrival': predicted,
+    })
+    # Время в пути от предыдущей остановки рейса, у первой остановки - NaN
+    by_trip = scores.groupby('trip_id', sort=False)
+    scores['actual_travel_time'] = by_trip['actual_arrival'].diff()
+    scores['predicted_travel_time'] = by_trip['predicted_arrival'].diff()
+    save_frame(downcast(scores), part_path(output, part))
+    return part, len(scores)
+
+
+def use_reference_stops(path):
+    # Привязка остановок только к справочнику path и без регистрации новых;
+    # до fork, процессы наследуют. Возвращает источник привязки для манифеста
+    prediction.stop_registry = StopRegistry(None, reference=known_stops(path), register=False)
+    return {"source": path if prediction.STOP_SNAP_METERS > 0 else None, "meters": prediction.STOP_SNAP_METERS}
+
+
+def input_manifest(paths, chunk_rows, model_version, stop_snapping):
+    # Готовые части годятся, только если входы, размер кусков, модель и
+    # привязка остановок те же
+    return {
+        "inputs": {path: [os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in paths},
+        "chunkRows": chunk_rows,
+        "modelVersion": model_version,
+        "stopSnapping": stop_snapping,
+    }
+
+
+def run(args):
+    model = get_model()
+    stop_snapping = use_reference_stops(args.stops)
+    manifest = input_manifest([args.arrivals, args.trips, args.stops], args.chunk_rows, model.version,
+                              stop_snapping)
+    manifest_path = os.path.join(args.output, MANIFEST)
+    if os.path.exists(manifest_path) and not args.restart:
+        with open(manifest_path) as f:
+            if json.load(f) != manifest:
+                raise ValueError(f"{args.output} holds scores for other inputs or another model, "
+                                 f"use --restart to discard them")
+    if args.restart:
+        shutil.rmtree(args.output, ignore_errors=True)
+    os.makedirs(args.output, exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    trips = load_trip_dates(args.trips)
+    stops = load_stops(args.stops)
+    started = time.perf_counter()
+    scored = skipped = rows = 0
+    # fork: процессы наследуют импортированный prediction и уже загруженную модель
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('fork')) as executor:
+        pending = set()
+
+        def collect(return_when):
+            nonlocal pending, scored, rows
+            done, pending = wait(pending, return_when=return_when)
+            for future in done:
+                part, part_rows = future.result()
+                scored += 1
+                rows += part_rows
+                print(f"  part {part:6d}  {part_rows:>9} rows  {rows / (time.perf_counter() - started):9.0f} rows/s")
+
+        for part, chunk in enumerate(iter_trip_chunks(args.arrivals, args.chunk_rows)):
+            if os.path.exists(os.path.join(part_path(args.output, part), 'meta.json')):
+                skipped += 1
+                continue
+            # Не больше двух кусков на процесс в очереди: память ограничена
+            if len(pending) >= args.workers * 2:
+                collect(FIRST_COMPLETED)
+            pending.add(executor.submit(score_chunk, part, chunk, stops,
+                                        trips[trips['trip_id'].isin(chunk['trip_id'].unique())], args.output))
+        collect(ALL_COMPLETED)
+    print(f"Scored {scored} parts ({rows} rows) in {time.perf_counter() - started:.1f}s, "
+          f"{skipped} parts already done")
+
+
+def summarize(output):
+    # MAE по частям: суммы ошибок и счётчики по группам складываются по всем частям
+    sums = []
+    for entry in sorted(os.listdir(output)):
+        path = os.path.join(output, entry)
+        if not entry.startswith('part-') or not os.path.exists(os.path.join(path, 'meta.json')):
+            continue
+        # Часть не больше куска --chunk-rows, в памяти одна часть за раз
+        part = load_frame(path)
+        # Как при обучении: сегменты с положительным фактическим временем
+        segments = part['actual_travel_time'] > 0
+        part['travel_error'] = (part['predicted_travel_time'] - part['actual_travel_time']).abs().where(segments)
+        part['arrival_error'] = (part['predicted_arrival'] - part['actual_arrival']).abs()
+        part['all'] = 0
+        for group in ('all', 'hour_of_day', 'day_of_week', 'route_id'):
+            grouped = part.groupby(group)
+            sums.append(pd.DataFrame({
+                'group': group,
+                'key': grouped.size().index,
+                'travel_sum': grouped['travel_error'].sum().to_numpy(),
+                'travel_count': grouped['travel_error'].count().to_numpy(),
+                'arrival_sum': grouped['arrival_error'].sum().to_numpy(),
+                'arrival_count': grouped['arrival_error'].count().to_numpy(),
+            }))
+    if not sums:
+        return None
+    totals = pd.concat(sums).groupby(['group', 'key'], sort=True).sum()
+    totals['travel_mae'] = totals['travel_sum'] / totals['travel_count'].replace(0, np.nan)
+    totals['arrival_mae'] = totals['arrival_sum'] / totals['arrival_count'].replace(0, np.nan)
+    return totals
+
+
+def print_summary(totals):
+    def table(group, title, label=str):
+        print(f"{title:<10} {'segments':>10} {'travel MAE':>11} {'arrival MAE':>12}")
+        for key, row in totals.loc[group].iterrows():
+            print(f"{label(key):<10} {int(row['travel_count']):>10} {row['travel_mae']:>11.2f} "
+                  f"{row['arrival_mae']:>12.2f}")
+        print()
+
+    table('all', 'Overall', lambda key: 'all')
+    table('hour_of_day', 'Hour', lambda key: f"{int(key):02d}:00")
+    table('day_of_week', 'Day', lambda key: DAY_NAMES[int(key)] if 0 <= key < 7 else str(key))
+    table('route_id', 'Route', lambda key: f"{key:g}" if isinstance(key, float) else str(key))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Score historical trips with the serving prediction code')
+    parser.add_argument('--arrivals', default=os.path.join('data', 'dwell_sorted.csv'))
+    parser.add_argument('--trips', default=os.path.join('data', 'trips_data.csv'))
+    parser.add_argument('--stops', default=os.path.join('data', 'stops_data.csv'))
+    parser.add_argument('--output', default=os.path.join('data', 'scores'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--restart', action='store_true', help='discard parts from an earlier run')
+    parser.add_argument('--summary-only', action='store_true', help='print MAE of already scored parts')
+    args = parser.parse_args()
+
+    if not args.summary_only:
+        try:
+            run(args)
+        except (ValueError, FileNotFoundError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    totals = summarize(args.output) if os.path.isdir(args.output) else None
+    if totals is None:
+        print(f"No scored parts in {args.output}")
+        sys.exit(1)
+    print_summary(totals)
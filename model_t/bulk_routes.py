@@ -0,0 +1,167 @@
+# Пакетное предсказание (/api/routes/bulk): много маршрутов одним телом в
+# колоночном виде - строка на остановку, маршрут задаётся routeId. Тело -
+# JSON, msgpack или Arrow IPC stream, ответ в том же формате. Колонки
+# проверяются целиком массивами, без Pydantic-модели на каждую остановку;
+# здесь - разбор, проверка и кодирование, предсказание - в app.py.
+import json
+
+import numpy as np
+import pandas as pd
+
+from features import times_to_minutes
+from route_model import MINUTE_US
+from timetable import clock_labels
+
+# msgpack и pyarrow необязательны: без них работает только JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+BULK_FORMATS = {
+    'application/json': 'json',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.apache.arrow.stream': 'arrow',
+}
+BULK_MEDIA_TYPES = {
+    'json': 'application/json',
+    'msgpack': 'application/msgpack',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+BULK_REQUIRED_COLUMNS = ['routeId', 'latitude', 'longitude', 'scheduledTime']
+BULK_OPTIONAL_COLUMNS = ['name', 'routeName']
+BULK_MAX_ROWS = 500000
+BULK_REPORTED_ROWS = 10  # сколько номеров плохих строк показывать в ошибке
+
+
+def body_format(content_type):
+    media_type = (content_type or 'application/json').split(';')[0].strip().lower()
+    fmt = BULK_FORMATS.get(media_type)
+    if fmt is None:
+        raise ValueError(f"Unsupported content type {media_type}, expected one of {', '.join(BULK_FORMATS)}")
+    if fmt == 'msgpack' and msgpack is None:
+        raise ValueError("msgpack bodies need the msgpack package installed on the server")
+    if fmt == 'arrow' and pyarrow is None:
+        raise ValueError("Arrow bodies need the pyarrow package installed on the server")
+    return fmt
+
+
+def decode_columns(body, fmt):
+    # {колонка: массив значений}
+    if fmt == 'arrow':
+        table = pyarrow.ipc.open_stream(body).read_all()
+        return {name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names}
+    data = msgpack.unpackb(body) if fmt == 'msgpack' else json.loads(body)
+    if not isinstance(data, dict) or not all(isinstance(values, list) for values in data.values()):
+        raise ValueError("Body must be an object of equal-length column arrays")
+    return data
+
+
+def _check_rows(bad, column, problem):
+    rows = np.flatnonzero(bad)
+    if len(rows):
+        shown = ', '.join(str(row) for row in rows[:BULK_REPORTED_ROWS].tolist())
+        more = f" and {len(rows) - BULK_REPORTED_ROWS} more" if len(rows) > BULK_REPORTED_ROWS else ""
+        raise ValueError(f"{column} {problem} (rows {shown}{more})")
+
+
+def _coordinates(values, column, limit):
+    try:
+        values = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(f"{column} must be numbers")
+    _check_rows(~np.isfinite(values) | (np.abs(values) > limit), column, f"must be in -{limit}..{limit}")
+    return values
+
+
+def bulk_frame(columns):
+    # (DataFrame в формате загрузки, имена маршрутов). Индекс - позиция
+    # остановки в маршруте: у первой 0, её время в пути не предсказывается,
+    # как в /api/routes/create.
+    missing = [column for column in BULK_REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    lengths = {len(columns[column]) for column in BULK_REQUIRED_COLUMNS + BULK_OPTIONAL_COLUMNS if column in columns}
+    if len(lengths) != 1:
+        raise ValueError("All columns must have the same length")
+    rows = lengths.pop()
+    if not 0 < rows <= BULK_MAX_ROWS:
+        raise ValueError(f"A bulk request needs 1..{BULK_MAX_ROWS} stops, got {rows}")
+
+    route_ids = pd.Series(columns['routeId'], dtype=object)
+    _check_rows(route_ids.isna().to_numpy(), 'routeId', "must not be empty")
+    route_ids = route_ids.astype(str)
+    position = route_ids.groupby(route_ids, sort=False).cumcount().to_numpy()
+
+    latitude = _coordinates(columns['latitude'], 'latitude', 90)
+    longitude = _coordinates(columns['longitude'], 'longitude', 180)
+    scheduled = times_to_minutes(pd.Series(columns['scheduledTime'])).to_numpy(dtype=np.float64)
+    _check_rows(np.isnan(scheduled) | (scheduled < 0), 'scheduledTime', "must be HH:MM or HH:MM:SS")
+    _check_rows((position == 0) & (scheduled >= 24 * 60), 'scheduledTime', "of a first stop must be before 24:00")
+
+    stop_numbers = position + 1
+    names = pd.Series(columns['name'], dtype=object) if 'name' in columns else pd.Series([None] * rows)
+    names = names.where(names.notna(), pd.Series([f"Stop {number}" for number in stop_numbers.tolist()]))
+
+    route_names = {}
+    if 'routeName' in columns:
+        given = pd.Series(columns['routeName'], dtype=object)
+        first = given.notna() & ~route_ids.duplicated()
+        route_names = dict(zip(route_ids[first].tolist(), given[first].astype(str).tolist()))
+
+    df = pd.DataFrame({
+        'route_id': route_ids.to_numpy(),
+        'stop_id': stop_numbers,
+        'latitude': latitude,
+        'longitude': longitude,
+        'scheduled_time': scheduled,
+        'address': names.astype(str).to_numpy(),
+    }, index=position)
+    return df, route_names
+
+
+def bulk_columns(routes):
+    # Колонки ответа: строка на остановку, маршруты подряд
+    lengths = np.array([len(route) for route in routes])
+    arrival_us = np.concatenate([route.arrival_us for route in routes])
+    first = np.zeros(len(arrival_us), dtype=bool)
+    first[np.cumsum(lengths)[:-1]] = True
+    first[0] = True
+    travel = np.diff(arrival_us, prepend=arrival_us[:1]) / MINUTE_US
+    travel[first] = 0
+    coordinates = np.concatenate([route.coordinates for route in routes])
+    columns = {
+        'routeId': np.repeat(np.array([route.id for route in routes], dtype=object), lengths),
+        'stopId': np.array([stop_id for route in routes for stop_id in route.stop_ids], dtype=object),
+        'name': np.array([name for route in routes for name in route.stop_names], dtype=object),
+        'latitude': coordinates[:, 0],
+        'longitude': coordinates[:, 1],
+        'predictedArrivalTime': clock_labels(arrival_us).astype(object),
+        'arrivalSeconds': arrival_us // 10**6,
+        'travelTime': np.round(travel, 2),
+    }
+    if all(route.canonical_ids is not None for route in routes):
+        columns['canonicalId'] = np.array([stop_id for route in routes for stop_id in route.canonical_ids],
+                                          dtype=object)
+    return columns
+
+
+def encode_bulk_response(columns, fmt, model_version, route_count, stored):
+    meta = {"success": True, "routeCount": route_count, "stored": stored, "modelVersion": model_version}
+    if fmt == 'arrow':
+        table = pyarrow.table(columns)
+        table = table.replace_schema_metadata({key: json.dumps(value) for key, value in meta.items()})
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    payload = {**meta, "columns": {name: values.tolist() for name, values in columns.items()}}
+    if fmt == 'msgpack':
+        return msgpack.packb(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
@@ -0,0 +1,61 @@
+# Быстрый уровень модели (HourlyLinearModel в model_loader.py): линейная
+# модель на каждый час суток. Обучается по кускам выборки: куски только
+# добавляют X^T X и X^T y своего часа, поэтому выборка целиком в памяти не
+# нужна. Час с малым числом строк стягивается к общей модели по всем часам.
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_loader import FAST_TERMS, fast_design  # noqa: E402
+
+HOURS = 24
+# Вес общей модели в решении для часа, в "строках": час с сотней строк
+# уже заметно отходит от общей модели
+PRIOR_ROWS = 100.0
+
+
+def fit_hourly_linear(chunks, prior_rows=PRIOR_ROWS):
+    # chunks - пары (признаки в порядке FEATURE_COLUMNS, целевая переменная).
+    # Возвращает (коэффициенты 24 x FAST_TERMS, строк в обучении)
+    terms = len(FAST_TERMS)
+    xtx = np.zeros((HOURS, terms, terms))
+    xty = np.zeros((HOURS, terms))
+    rows = np.zeros(HOURS, dtype=np.int64)
+    for features, target in chunks:
+        design, hours = fast_design(features)
+        target = np.asarray(target, dtype=np.float64)
+        for hour in np.unique(hours).tolist():
+            mask = hours == hour
+            xtx[hour] += design[mask].T @ design[mask]
+            xty[hour] += design[mask].T @ target[mask]
+            rows[hour] += mask.sum()
+    if not rows.sum():
+        raise ValueError("No training rows for the fast model tier")
+
+    # Общая модель; небольшая регуляризация на случай вырожденных признаков
+    # (например, одинаковое время стоянки во всей выборке)
+    total = xtx.sum(axis=0)
+    ridge = 1e-6 * np.trace(total) / terms * np.eye(terms)
+    pooled = np.linalg.solve(total + ridge, xty.sum(axis=0))
+    # Для часа: min |y - Xb|^2 + (b - pooled)^T P (b - pooled), где P -
+    # prior_rows "средних" строк выборки (диагональ X^T X на строку)
+    prior = prior_rows * np.diag(np.diag(total) / rows.sum())
+    coefficients = np.array([
+        np.linalg.solve(xtx[hour] + prior + ridge, xty[hour] + prior @ pooled) for hour in range(HOURS)
+    ])
+    return coefficients, int(rows.sum())
+
+
+def save_fast_model(coefficients, path, train_rows):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            "kind": "hourly_linear",
+            "terms": FAST_TERMS,
+            "coefficients": coefficients.tolist(),
+            "trainRows": train_rows,
+        }, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,324 @@
+# Подготовка обучающей выборки для train.py по этапам. Результат каждого
+# этапа сохраняется в колоночном виде (по .npy на колонку) в .feature_cache/
+# под ключом из хэшей входных файлов и ключей предыдущих этапов, поэтому
+# повторный запуск пропускает этапы, входы которых не менялись.
+import glob
+import hashlib
+import json
+import os
+import re
+import resource
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from features import times_to_minutes, segment_lengths, scheduled_travel_times  # noqa: E402
+
+CACHE_DIR = '.feature_cache'
+# Меняется при изменении логики этапов, чтобы старый кэш не подхватывался
+PIPELINE_VERSION = 1
+# Ключ кэша этапа - blake2b входов, 16 hex-символов в имени каталога
+STAGE_KEY_BYTES = 8
+
+TRIP_COLUMNS = ['trip_id', 'start_time', 'end_time']
+STOP_COLUMNS = ['stop_id', 'route_id', 'direction', 'latitude', 'longitude']
+FEATURE_COLUMNS = ['scheduled_travel_time', 'dwell_time_in_seconds', 'segment_length', 'day_of_week', 'hour_of_day']
+TARGET_COLUMN = 'actual_travel_time'
+
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=12)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def downcast(df):
+    # Целые - в самый узкий тип, строки - в category. float64 не трогаем:
+    # это признаки модели, от них зависит результат обучения.
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_integer_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            df[column] = pd.to_numeric(values, downcast='integer')
+        elif values.dtype == object or pd.api.types.is_string_dtype(values):
+            df[column] = values.astype('category')
+    return df
+
+
+def save_frame(df, path):
+    # Колонка - отдельный .npy, category - коды и список категорий в meta.json
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    meta = {"columns": [], "index": None}
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        entry = {"name": column, "file": f"{i}.npy"}
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            entry["categories"] = values.cat.categories.tolist()
+            values = values.cat.codes
+        np.save(os.path.join(tmp_path, entry["file"]), values.to_numpy(), allow_pickle=False)
+        meta["columns"].append(entry)
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        meta["index"] = "index.npy"
+        np.save(os.path.join(tmp_path, "index.npy"), df.index.to_numpy(), allow_pickle=False)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def load_frame(path, mmap_mode=None):
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    columns = {}
+    for entry in meta["columns"]:
+        values = np.load(os.path.join(path, entry["file"]), mmap_mode=mmap_mode, allow_pickle=False)
+        if "categories" in entry:
+            values = pd.Categorical.from_codes(values, categories=entry["categories"])
+        columns[entry["name"]] = values
+    index = np.load(os.path.join(path, meta["index"])) if meta["index"] else None
+    return pd.DataFrame(columns, index=index)
+
+
+def load_columns(path, names, mmap_mode='r'):
+    # Числовые колонки сохранённого этапа без DataFrame, по умолчанию
+    # отображёнными в память: читаются только нужные куски строк
+    with open(os.path.join(path, 'meta.json')) as f:
+        files = {entry["name"]: entry["file"] for entry in json.load(f)["columns"]}
+    return {name: np.load(os.path.join(path, files[name]), mmap_mode=mmap_mode, allow_pickle=False)
+            for name in names}
+
+
+class Pipeline:
+    # Этап - функция от файлов и результатов других этапов, возвращающая
+    # DataFrame. Ключ кэша этапа зависит от имени, версии, хэшей файлов и
+    # ключей этапов-зависимостей.
+
+    def __init__(self, cache_dir=CACHE_DIR, use_cache=True):
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self.report = []
+        self.paths = {}
+        self._keys = {}
+        self._hashes = {}
+
+    def _file_hash(self, path):
+        if path not in self._hashes:
+            self._hashes[path] = file_hash(path)
+        return self._hashes[path]
+
+    def stage(self, name, fn, files=(), upstream=()):
+        key_source = json.dumps({
+            "stage": name,
+            "version": PIPELINE_VERSION,
+            "files": [self._file_hash(path) for path in files],
+            "upstream": [self._keys[id(frame)] for frame in upstream],
+        })
+        key = hashlib.blake2b(key_source.encode(), digest_size=STAGE_KEY_BYTES).hexdigest()
+        path = os.path.join(self.cache_dir, f"{name}-{key}")
+
+        start = time.perf_counter()
+        peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if self.use_cache and os.path.exists(os.path.join(path, 'meta.json')):
+            frame = load_frame(path)
+            status = 'cached'
+        else:
+            frame = downcast(fn(*files, *upstream))
+            status = 'computed'
+            if self.use_cache:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # Старые версии этого этапа больше не нужны. Только точное
+                # "<этап>-<ключ>": у avl_2023-01 не удалить кэш avl_2023-01-b
+                stale = re.compile(re.escape(name) + r'-[0-9a-f]{%d}' % (2 * STAGE_KEY_BYTES))
+                for entry in os.listdir(self.cache_dir):
+                    if stale.fullmatch(entry) and entry != os.path.basename(path):
+                        shutil.rmtree(os.path.join(self.cache_dir, entry), ignore_errors=True)
+                save_frame(frame, path)
+        self._keys[id(frame)] = key
+        self.paths[name] = path
+        self.report.append({
+            "stage": name,
+            "status": status,
+            "seconds": time.perf_counter() - start,
+            "rows": len(frame),
+            "frameMiB": frame.memory_usage(deep=True).sum() / 2**20,
+            # ru_maxrss в КиБ на Linux: насколько этап поднял пик памяти процесса
+            "peakRssGrowthMiB": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak_before) / 1024,
+        })
+        return frame
+
+    def print_report(self):
+        for row in self.report:
+            print(f"  {row['stage']:<20} {row['status']:<8} {row['seconds']:7.2f}s  {row['rows']:>9} rows  "
+                  f"frame {row['frameMiB']:7.1f} MiB  peak RSS +{row['peakRssGrowthMiB']:.1f} MiB")
+
+
+def load_trips(path):
+    trips = pd.read_csv(path, usecols=lambda column: column in TRIP_COLUMNS)
+    for column in ('start_time', 'end_time'):
+        if column in trips.columns:
+            trips[column] = times_to_minutes(trips[column])
+    return trips
+
+
+def load_stops(path):
+    stops = pd.read_csv(path, usecols=lambda column: column in STOP_COLUMNS, dtype={'stop_id': str})
+    stops['stop_id'] = stops['stop_id'].astype(str).str.strip()
+    return stops
+
+
+def load_arrivals(path, stops, trips):
+    return arrival_features(pd.read_csv(path), stops, trips)
+
+
+def arrival_features(arrivals, stops, trips):
+    # Прибытия рейсов с координатами остановок, плановым и фактическим
+    # временем; используется и batch_score.py для кусков истории
+    for column in ('arrival_time', 'departure_time'):
+        if column in arrivals.columns:
+            arrivals[column] = times_to_minutes(arrivals[column])
+
+    # Fill missing values in arrivals
+    arrivals.fillna(0, inplace=True)
+
+    # Ensure 'stop_sequence' exists in arrivals
+    if 'stop_sequence' not in arrivals.columns:
+        arrivals['stop_sequence'] = arrivals.groupby('trip_id').cumcount() + 1
+
+    # Ensure 'stop_id' exists in arrivals
+    if 'stop_id' not in arrivals.columns:
+        if 'bus_stop' not in arrivals.columns or 'stop_id' not in stops.columns:
+            raise ValueError("'stop_id' not found in 'stops' or 'bus_stop' not found in 'arrivals'.")
+        # Остановки сопоставляются по общему словарю кодов, а не по строкам
+        bus_stop = arrivals['bus_stop'].astype(str).str.strip()
+        stop_id = stops['stop_id'].astype(str)
+        categories = pd.Index(pd.unique(pd.concat([bus_stop, stop_id], ignore_index=True)))
+        arrivals['bus_stop'] = pd.Categorical(bus_stop, categories=categories)
+        stop_table = stops[[column for column in STOP_COLUMNS if column in stops.columns]].copy()
+        stop_table['stop_id'] = pd.Categorical(stop_id, categories=categories)
+        arrivals = arrivals.merge(stop_table, left_on='bus_stop', right_on='stop_id',
+                                  how='left', suffixes=('', '_stop'))
+        if arrivals['stop_id'].isnull().any():
+            missing_stops = arrivals[arrivals['stop_id'].isnull()]
+            print("Error: Missing 'stop_id' after merging for the following stops:")
+            print(missing_stops[['trip_id', 'bus_stop']])
+            arrivals = arrivals[~arrivals['stop_id'].isnull()]
+
+    # Merge 'start_time' from trips into arrivals
+    if 'start_time' not in arrivals.columns:
+        if 'trip_id' not in arrivals.columns or 'start_time' not in trips.columns:
+            raise ValueError("Cannot merge 'start_time' into 'arrivals'.")
+        arrivals = arrivals.merge(trips[['trip_id', 'start_time']], on='trip_id', how='left')
+
+    # Compute 'scheduled_time' for each stop
+    if 'scheduled_time' not in arrivals.columns:
+        fixed_interval = 5  # Adjust as needed based on actual schedule
+        arrivals['scheduled_time'] = arrivals['start_time'] + (arrivals['stop_sequence'] - 1) * fixed_interval
+
+    # Compute 'scheduled_travel_time' between stops
+    if 'scheduled_travel_time' not in arrivals.columns:
+        arrivals['scheduled_travel_time'] = scheduled_travel_times(arrivals, by='trip_id').fillna(0)
+
+    if 'latitude' in arrivals.columns and 'longitude' in arrivals.columns:
+        # Как в app.py: гаверсинус между соседними остановками рейса
+        arrivals['segment_length'] = segment_lengths(arrivals, by='trip_id')
+
+    # Фактическое время в пути до остановки от предыдущей
+    arrivals['actual_travel_time'] = arrivals.groupby('trip_id', observed=True)['arrival_time'].diff().fillna(0)
+    return arrivals
+
+
+def build_training_set(arrivals):
+    # Сегмент начинается в текущей остановке рейса и заканчивается в следующей
+    required_cols = ['trip_id', 'stop_id', 'scheduled_travel_time', 'scheduled_time']
+    missing_cols = [col for col in required_cols if col not in arrivals.columns]
+    if missing_cols:
+        raise ValueError(f"Missing columns in 'arrivals': {missing_cols}")
+
+    by_trip = arrivals.groupby('trip_id', observed=True)
+    segments = arrivals[['trip_id', 'stop_id', 'scheduled_travel_time', 'scheduled_time']].copy()
+    segments['end_stop_id'] = by_trip['stop_id'].shift(-1)
+    segments['end_scheduled_time'] = by_trip['scheduled_time'].shift(-1)
+
+    # Drop rows where 'end_stop_id' is NaN (last stop in each trip)
+    segments = segments.dropna(subset=['end_stop_id'])
+
+    # Compute 'scheduled_travel_time' for segments
+    segments['scheduled_travel_time'] = segments['end_scheduled_time'] - segments['scheduled_time']
+
+    if 'length' in segments.columns:
+        segments['segment_length'] = segments['length']
+    elif 'latitude' in arrivals.columns and 'longitude' in arrivals.columns:
+        segments['segment_length'] = by_trip['segment_length'].shift(-1)
+    else:
+        # As a placeholder, assign default segment lengths
+        segments['segment_length'] = 1.0  # Replace with actual data if available
+
+    # Время в пути до следующей остановки: сопоставление по (рейс, остановка)
+    # через общий словарь кодов остановок
+    end_stop = segments['end_stop_id'].astype(str)
+    stop = arrivals['stop_id'].astype(str)
+    categories = pd.Index(pd.unique(pd.concat([end_stop, stop], ignore_index=True)))
+    segments['end_stop_code'] = pd.Categorical(end_stop, categories=categories).codes
+    travel = pd.DataFrame({
+        'trip_id': arrivals['trip_id'].to_numpy(),
+        'end_stop_code': pd.Categorical(stop, categories=categories).codes,
+        'actual_travel_time': arrivals['actual_travel_time'].to_numpy(),
+    })
+    segments = segments.merge(travel, on=['trip_id', 'end_stop_code'], how='left')
+
+    # Remove negative or zero travel times
+    segments = segments[segments['actual_travel_time'] > 0]
+
+    # Prepare features for the model
+    features = pd.DataFrame()
+    features['scheduled_travel_time'] = segments['scheduled_travel_time']
+    features['dwell_time_in_seconds'] = arrivals['dwell_time_in_seconds'].values[:len(segments)]
+    features['segment_length'] = segments['segment_length']
+    if 'date' in arrivals.columns:
+        features['day_of_week'] = pd.to_datetime(arrivals['date']).dt.dayofweek.values[:len(segments)]
+    else:
+        features['day_of_week'] = 0  # Default value if 'date' is missing
+    features['hour_of_day'] = segments['scheduled_time'] // 60  # Hour of day
+    features[TARGET_COLUMN] = segments['actual_travel_time']
+
+    # Remove any NaN or infinite values
+    return features.replace([np.inf, -np.inf], np.nan).dropna()
+
+
+def prepare_training_data(data_dir='.', cache_dir=None, use_cache=True):
+    # (features, target) для train.py и отчёт по этапам
+    pipeline = Pipeline(cache_dir or os.path.join(data_dir, CACHE_DIR), use_cache)
+    trips = pipeline.stage('trips', load_trips, [os.path.join(data_dir, 'trips_data.csv')])
+    stops = pipeline.stage('stops', load_stops, [os.path.join(data_dir, 'stops_data.csv')])
+    arrivals = pipeline.stage('arrivals', load_arrivals, [os.path.join(data_dir, 'dwell_sorted.csv')],
+                              [stops, trips])
+    training = pipeline.stage('training_set', build_training_set, upstream=[arrivals])
+    features = training[FEATURE_COLUMNS]
+    return features, training[TARGET_COLUMN], pipeline
+
+
+def prepare_training_partitions(data_dir='.', arrivals_pattern='dwell_sorted.csv', cache_dir=None):
+    # Для обучения по частям (out_of_core.py): каждый файл прибытий, например
+    # месяц истории AVL, проходит этапы отдельно, в памяти одновременно
+    # только одна часть. Возвращает пути к кэшу training_set по частям.
+    pipeline = Pipeline(cache_dir or os.path.join(data_dir, CACHE_DIR))
+    arrival_files = sorted(glob.glob(os.path.join(data_dir, arrivals_pattern)))
+    if not arrival_files:
+        raise ValueError(f"No arrival files match {arrivals_pattern!r} in {data_dir}")
+    trips = pipeline.stage('trips', load_trips, [os.path.join(data_dir, 'trips_data.csv')])
+    stops = pipeline.stage('stops', load_stops, [os.path.join(data_dir, 'stops_data.csv')])
+    paths = []
+    for path in arrival_files:
+        part = os.path.splitext(os.path.basename(path))[0]
+        arrivals = pipeline.stage(f'arrivals.{part}', load_arrivals, [path], [stops, trips])
+        training = pipeline.stage(f'training_set.{part}', build_training_set, upstream=[arrivals])
+        paths.append(pipeline.paths[f'training_set.{part}'])
+        del arrivals, training
+    return paths, pipeline
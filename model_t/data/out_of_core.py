@@ -0,0 +1,177 @@
+# Обучение на истории, которая не помещается в память. Обучающая выборка
+# читается из колоночного кэша feature_pipeline (отображённые в память .npy)
+# кусками по chunk_rows строк и передаётся в XGBoost через DataIter:
+# QuantileDMatrix хранит только квантованные признаки, ExtMemQuantileDMatrix
+# (--external-memory) вдобавок держит страницы в файлах на диске.
+import itertools
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+import xgboost
+
+from feature_pipeline import FEATURE_COLUMNS, TARGET_COLUMN, load_columns
+
+DEFAULT_PARAMS = {
+    "objective": "reg:squarederror",
+    "tree_method": "hist",
+    "learning_rate": 0.1,
+    "max_depth": 5,
+    "eval_metric": "mae",
+}
+DEFAULT_ROUNDS = 100
+DEFAULT_CHUNK_ROWS = 1 << 20
+TEST_FRACTION = 0.2
+SPLIT_SEED = 42
+# Сетка перебора для --sweep, поверх DEFAULT_PARAMS
+SWEEP_GRID = {
+    "max_depth": [4, 6, 8],
+    "learning_rate": [0.05, 0.1],
+    "min_child_weight": [1, 5],
+}
+
+
+def test_rows(start, count, seed=SPLIT_SEED):
+    # Маска тестовых строк по глобальному номеру строки (хэш splitmix64):
+    # разбиение не зависит от размера кусков и одинаково во всех процессах
+    with np.errstate(over='ignore'):
+        x = np.arange(start, start + count, dtype=np.uint64) + np.uint64(seed)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)) < np.uint64(TEST_FRACTION * (1 << 53))
+
+
+def iter_split(paths, split='train', chunk_rows=DEFAULT_CHUNK_ROWS):
+    # Куски (признаки, целевая) обучающей (split='train') или тестовой
+    # ('test') части выборки по всем частям истории подряд
+    offset = 0
+    for path in paths:
+        source = load_columns(path, FEATURE_COLUMNS + [TARGET_COLUMN])
+        rows = len(source[TARGET_COLUMN])
+        for start in range(0, rows, chunk_rows):
+            stop = min(start + chunk_rows, rows)
+            keep = test_rows(offset + start, stop - start) == (split == 'test')
+            if keep.any():
+                features = np.column_stack([source[column][start:stop] for column in FEATURE_COLUMNS])
+                yield features[keep], np.asarray(source[TARGET_COLUMN][start:stop])[keep]
+        offset += rows
+
+
+def chunks_mae(predict, chunks):
+    # MAE функции predict(признаки) по кускам (признаки, целевая)
+    total, rows = 0.0, 0
+    for features, target in chunks:
+        total += np.abs(np.asarray(predict(features), dtype=np.float64) - target).sum()
+        rows += len(target)
+    return total / rows if rows else float('nan')
+
+
+class TrainingChunks(xgboost.DataIter):
+    # iter_split для XGBoost: reset начинает проход заново
+
+    def __init__(self, paths, split='train', chunk_rows=DEFAULT_CHUNK_ROWS, cache_prefix=None):
+        self.paths = paths
+        self.split = split
+        self.chunk_rows = chunk_rows
+        self._chunks = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def reset(self):
+        self._chunks = None
+
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = iter_split(self.paths, self.split, self.chunk_rows)
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        input_data(data=chunk[0], label=chunk[1], feature_names=FEATURE_COLUMNS)
+        return True
+
+
+def build_matrices(paths, chunk_rows=DEFAULT_CHUNK_ROWS, external_memory=False, cache_dir='.', nthread=None):
+    # (train, test); тестовая матрица квантуется по границам обучающей
+    if external_memory:
+        train = xgboost.ExtMemQuantileDMatrix(
+            TrainingChunks(paths, 'train', chunk_rows, os.path.join(cache_dir, f'xgb-train-{os.getpid()}')),
+            nthread=nthread)
+        test = xgboost.ExtMemQuantileDMatrix(
+            TrainingChunks(paths, 'test', chunk_rows, os.path.join(cache_dir, f'xgb-test-{os.getpid()}')),
+            nthread=nthread, ref=train)
+    else:
+        train = xgboost.QuantileDMatrix(TrainingChunks(paths, 'train', chunk_rows), nthread=nthread)
+        test = xgboost.QuantileDMatrix(TrainingChunks(paths, 'test', chunk_rows), nthread=nthread, ref=train)
+    return train, test
+
+
+def train_config(config, paths, rounds=DEFAULT_ROUNDS, early_stopping_rounds=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                 external_memory=False, cache_dir='.', nthread=None):
+    # Обучение одной конфигурации: (Booster, строка отчёта). При ранней
+    # остановке в модели остаются деревья до лучшей итерации включительно.
+    start = time.perf_counter()
+    peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    nthread = nthread or os.cpu_count() or 1
+    train, test = build_matrices(paths, chunk_rows, external_memory, cache_dir, nthread)
+    history = {}
+    booster = xgboost.train({**DEFAULT_PARAMS, **config, "nthread": nthread}, train, rounds,
+                            evals=[(test, 'test')], early_stopping_rounds=early_stopping_rounds,
+                            evals_result=history, verbose_eval=False)
+    mae = history['test']['mae']
+    best = int(np.argmin(mae)) if early_stopping_rounds else len(mae) - 1
+    if best + 1 < booster.num_boosted_rounds():
+        booster = booster[:best + 1]
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return booster, {
+        "config": config,
+        "rounds": best + 1,
+        "mae": mae[best],
+        "trainRows": train.num_row(),
+        "testRows": test.num_row(),
+        "seconds": time.perf_counter() - start,
+        # ru_maxrss в КиБ на Linux
+        "peakRssMiB": peak / 1024,
+        "peakRssGrowthMiB": (peak - peak_before) / 1024,
+    }
+
+
+def sweep_configs(grid=None):
+    grid = grid or SWEEP_GRID
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+def _train_in_worker(config, paths, rounds, early_stopping_rounds, chunk_rows, external_memory, cache_dir, nthread):
+    booster, report = train_config(config, paths, rounds, early_stopping_rounds, chunk_rows, external_memory,
+                                   cache_dir, nthread)
+    return bytes(booster.save_raw('ubj')), report
+
+
+def sweep(configs, paths, workers=None, rounds=1000, early_stopping_rounds=20, chunk_rows=DEFAULT_CHUNK_ROWS,
+          external_memory=False, cache_dir='.'):
+    # Конфигурации обучаются параллельно в отдельных процессах, ядра делятся
+    # поровну. Процесс на одну конфигурацию (maxtasksperchild=1), поэтому
+    # пик RSS в отчёте - пик именно этой конфигурации. fork, а не spawn:
+    # train.py - скрипт без __main__-защиты, spawn выполнил бы его заново;
+    # до перебора родитель не запускает потоки XGBoost.
+    workers = workers or min(len(configs), os.cpu_count() or 1)
+    nthread = max(1, (os.cpu_count() or 1) // workers)
+    with multiprocessing.get_context('fork').Pool(workers, maxtasksperchild=1) as pool:
+        results = pool.starmap(_train_in_worker, [
+            (config, paths, rounds, early_stopping_rounds, chunk_rows, external_memory, cache_dir, nthread)
+            for config in configs
+        ], chunksize=1)
+    reports = [report for _, report in results]
+    best = min(range(len(results)), key=lambda i: reports[i]["mae"])
+    booster = xgboost.Booster()
+    booster.load_model(bytearray(results[best][0]))
+    return booster, reports, best
+
+
+def print_reports(reports, best=None):
+    for i, row in enumerate(reports):
+        config = ' '.join(f"{name}={value}" for name, value in row["config"].items()) or 'default'
+        marker = '*' if i == best else ' '
+        print(f" {marker}{config:<52} rounds {row['rounds']:>4}  MAE {row['mae']:.4f}  {row['seconds']:7.1f}s  "
+              f"peak RSS {row['peakRssMiB']:.0f} MiB (+{row['peakRssGrowthMiB']:.0f})")
@@ -3,234 +3,150 @@ import numpy as np
 from sklearn.model_selection import train_test_split
 from xgboost import XGBRegressor
 from sklearn.metrics import mean_absolute_error
-from datetime import datetime
 import joblib
+import argparse
+import os
 import sys
-from math import radians, sin, cos, sqrt, atan2
 
-# Load the data
-trips = pd.read_csv('trips_data.csv')
-stops = pd.read_csv('stops_data.csv')
-arrivals = pd.read_csv('dwell_sorted.csv')
-segments = pd.read_csv('run_data.csv')
+# Общий модуль признаков лежит в model_t/, рядом с app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from features import times_to_minutes, segment_lengths
+from out_of_core import (DEFAULT_CHUNK_ROWS, DEFAULT_ROUNDS, chunks_mae, iter_split, print_reports, sweep,
+                         sweep_configs, test_rows, train_config)
+from fast_tier import fit_hourly_linear, save_fast_model
+from model_loader import HourlyLinearModel
+from feature_pipeline import prepare_training_data, prepare_training_partitions
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--no-cache', action='store_true', help='recompute all data preparation stages')
+parser.add_argument('--out-of-core', action='store_true',
+                    help='stream the training set from the feature cache in chunks instead of loading it')
+parser.add_argument('--external-memory', action='store_true',
+                    help='with --out-of-core: keep quantized pages on disk (ExtMemQuantileDMatrix)')
+parser.add_argument('--arrivals', default='dwell_sorted.csv',
+                    help='with --out-of-core: glob of arrival files, one partition each')
+parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+parser.add_argument('--sweep', action='store_true',
+                    help='process-parallel hyperparameter sweep with early stopping (implies --out-of-core)')
+parser.add_argument('--sweep-workers', type=int)
+parser.add_argument('--rounds', type=int, help=f'boosting rounds, {DEFAULT_ROUNDS} or 1000 with --sweep')
+parser.add_argument('--early-stopping-rounds', type=int, help='off by default, 20 with --sweep')
+args = parser.parse_args()
 
-# Print columns for debugging
-print("Columns in trips DataFrame:", trips.columns.tolist())
-print("Columns in stops DataFrame:", stops.columns.tolist())
-print("Columns in arrivals DataFrame:", arrivals.columns.tolist())
-print("Columns in segments DataFrame:", segments.columns.tolist())
-
-# Convert time to minutes from start of the day
-def time_to_minutes(t):
-    if pd.isna(t):
-        return np.nan
-    if isinstance(t, str):
-        try:
-            x = datetime.strptime(t, '%H:%M:%S')
-        except ValueError:
-            try:
-                x = datetime.strptime(t, '%H:%M')
-            except ValueError:
-                return np.nan
-        return x.hour * 60 + x.minute
-    return t  # Already in minutes
-
-# Apply time conversion where necessary
-for df, cols in [(trips, ['start_time', 'end_time']), (arrivals, ['arrival_time', 'departure_time']), (segments, ['start_time', 'end_time'])]:
-    for col in cols:
-        if col in df.columns:
-            df[col] = df[col].apply(time_to_minutes)
-
-# Fill missing values in arrivals
-arrivals.fillna(0, inplace=True)
-
-# Ensure 'stop_sequence' exists in arrivals
-if 'stop_sequence' not in arrivals.columns:
-    arrivals['stop_sequence'] = arrivals.groupby('trip_id').cumcount() + 1
-
-# Ensure 'stop_id' exists in arrivals
-if 'stop_id' not in arrivals.columns:
-    if 'bus_stop' in arrivals.columns and 'stop_id' in stops.columns:
-        # Standardize the 'bus_stop' and 'stop_id' columns for consistent merging
-        arrivals['bus_stop'] = arrivals['bus_stop'].astype(str).str.strip()
-        stops['stop_id'] = stops['stop_id'].astype(str).str.strip()
-        # Merge on 'bus_stop' from arrivals and 'stop_id' from stops
-        arrivals = arrivals.merge(
-            stops[['stop_id', 'route_id', 'direction', 'latitude', 'longitude']],
-            left_on='bus_stop',
-            right_on='stop_id',
-            how='left',
-            suffixes=('', '_stop')
-        )
-        if arrivals['stop_id'].isnull().any():
-            missing_stops = arrivals[arrivals['stop_id'].isnull()]
-            print("Error: Missing 'stop_id' after merging for the following stops:")
-            print(missing_stops[['trip_id', 'bus_stop']])
-            # Decide how to handle these rows
-            arrivals = arrivals[~arrivals['stop_id'].isnull()]
-    else:
-        print("Error: 'stop_id' not found in 'stops' or 'bus_stop' not found in 'arrivals'.")
+model_path = 'bus_travel_time_model.pkl'
+# Нативный формат XGBoost: app.py грузит его без scikit-learn и pickle
+native_model_path = 'bus_travel_time_model.ubj'
+# Быстрый уровень для интерактивных запросов (см. fast_tier.py)
+fast_model_path = 'bus_travel_time_fast.json'
+
+if args.out_of_core or args.sweep:
+    # Выборка по частям в кэше, в XGBoost - кусками через QuantileDMatrix (см. out_of_core.py)
+    if args.no_cache:
+        print("Error: --out-of-core reads the training set from the feature cache, drop --no-cache.")
         sys.exit(1)
-
-# Merge 'start_time' from trips into arrivals
-if 'start_time' not in arrivals.columns:
-    if 'trip_id' in arrivals.columns and 'start_time' in trips.columns:
-        arrivals = arrivals.merge(trips[['trip_id', 'start_time']], on='trip_id', how='left')
-    else:
-        print("Error: Cannot merge 'start_time' into 'arrivals'.")
+    try:
+        partitions, pipeline = prepare_training_partitions(arrivals_pattern=args.arrivals)
+    except ValueError as e:
+        print(f"Error: {e}")
         sys.exit(1)
-
-# Compute 'scheduled_time' for each stop
-if 'scheduled_time' not in arrivals.columns:
-    fixed_interval = 5  # Adjust as needed based on actual schedule
-    arrivals['scheduled_time'] = arrivals['start_time'] + (arrivals['stop_sequence'] - 1) * fixed_interval
-
-# Compute 'scheduled_travel_time' between stops
-if 'scheduled_travel_time' not in arrivals.columns:
-    arrivals['scheduled_travel_time'] = arrivals.groupby('trip_id')['scheduled_time'].diff().fillna(0)
-
-# Create segments DataFrame
-required_cols = ['trip_id', 'stop_id', 'scheduled_travel_time', 'scheduled_time']
-missing_cols = [col for col in required_cols if col not in arrivals.columns]
-if missing_cols:
-    print(f"Error: Missing columns in 'arrivals': {missing_cols}")
-    sys.exit(1)
-
-segments = arrivals[['trip_id', 'stop_id', 'scheduled_travel_time', 'scheduled_time']].copy()
-segments['end_stop_id'] = segments.groupby('trip_id')['stop_id'].shift(-1)
-segments['end_scheduled_time'] = segments.groupby('trip_id')['scheduled_time'].shift(-1)
-segments['end_scheduled_travel_time'] = segments.groupby('trip_id')['scheduled_travel_time'].shift(-1)
-
-# Drop rows where 'end_stop_id' is NaN (last stop in each trip)
-segments = segments.dropna(subset=['end_stop_id'])
-
-# Convert stop IDs to appropriate data types
-segments['start_stop_id'] = segments['stop_id'].astype(str)
-segments['end_stop_id'] = segments['end_stop_id'].astype(str)
-
-# Rename columns
-segments.rename(columns={
-    'scheduled_travel_time': 'scheduled_start_time'
-}, inplace=True)
-
-# Compute 'scheduled_travel_time' for segments
-segments['scheduled_travel_time'] = segments['end_scheduled_time'] - segments['scheduled_time']
-
-# Ensure 'scheduled_time' is present in segments
-if 'scheduled_time' not in segments.columns:
-    print("Error: 'scheduled_time' is missing from 'segments' after processing.")
-    sys.exit(1)
-
-# If 'segment_length' is not in segments, set a default or merge from another DataFrame
-if 'segment_length' not in segments.columns:
-    if 'length' in segments.columns:
-        segments['segment_length'] = segments['length']
+    print("Data preparation stages:")
+    pipeline.print_report()
+
+    options = dict(chunk_rows=args.chunk_rows, external_memory=args.external_memory, cache_dir=pipeline.cache_dir)
+    if args.sweep:
+        configs = sweep_configs()
+        print(f"Sweeping {len(configs)} configurations:")
+        booster, reports, best = sweep(configs, partitions, workers=args.sweep_workers, rounds=args.rounds or 1000,
+                                       early_stopping_rounds=args.early_stopping_rounds or 20, **options)
     else:
-        # As a placeholder, assign default segment lengths
-        segments['segment_length'] = 1.0  # Replace with actual data if available
-
-# Compute the target variable - actual travel time between stops
-arrivals['actual_travel_time'] = arrivals.groupby('trip_id')['arrival_time'].diff().fillna(0)
-
-# Merge 'actual_travel_time' into segments
-segments = segments.merge(
-    arrivals[['trip_id', 'stop_id', 'actual_travel_time']],
-    left_on=['trip_id', 'end_stop_id'],
-    right_on=['trip_id', 'stop_id'],
-    how='left',
-    suffixes=('', '_arrival')
-)
-
-# Print columns to debug
-print("Columns in 'segments' after merge:", segments.columns.tolist())
-
-# Remove unnecessary columns
-if 'stop_id_arrival' in segments.columns:
-    segments.drop(columns=['stop_id_arrival'], inplace=True)
-
-# Remove negative or zero travel times
-segments = segments[segments['actual_travel_time'] > 0]
-
-# Prepare features for the model
-features = pd.DataFrame()
-features['scheduled_travel_time'] = segments['scheduled_travel_time']
-features['dwell_time_in_seconds'] = arrivals['dwell_time_in_seconds'].values[:len(segments)]
-features['segment_length'] = segments['segment_length']
-if 'date' in arrivals.columns:
-    features['day_of_week'] = pd.to_datetime(arrivals['date']).dt.dayofweek.values[:len(segments)]
+        booster, report = train_config({}, partitions, rounds=args.rounds or DEFAULT_ROUNDS,
+                                       early_stopping_rounds=args.early_stopping_rounds, **options)
+        reports, best = [report], 0
+    print_reports(reports, best)
+    print(f"Mean Absolute Error: {reports[best]['mae']}")
+
+    # Быстрый уровень - по тем же кускам обучающей части
+    coefficients, fast_rows = fit_hourly_linear(iter_split(partitions, 'train', args.chunk_rows))
+    fast_model = HourlyLinearModel(coefficients, fast_model_path, None)
+    print(f"Fast tier Mean Absolute Error: {chunks_mae(fast_model.predict, iter_split(partitions, 'test'))}")
+    save_fast_model(coefficients, fast_model_path, fast_rows)
+    model = None
 else:
-    features['day_of_week'] = 0  # Default value if 'date' is missing
-features['hour_of_day'] = segments['scheduled_time'] // 60  # Hour of day
-
-# Target variable
-target = segments['actual_travel_time']
-
-# Remove any NaN or infinite values
-features = features.replace([np.inf, -np.inf], np.nan).dropna()
-target = target.loc[features.index]
-
-# Ensure that features and target have the same length
-if len(features) != len(target):
-    print("Error: Mismatch in length between features and target.")
-    sys.exit(1)
+    # Подготовка данных по этапам с кэшем в .feature_cache/ (см. feature_pipeline.py).
+    # run_data.csv не читается: его сегменты всё равно пересобирались из arrivals.
+    try:
+        features, target, pipeline = prepare_training_data(use_cache=not args.no_cache)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print("Data preparation stages:")
+    pipeline.print_report()
 
-# Split the data into training and test sets
-X_train, X_test, y_train, y_test = train_test_split(
-    features, target, test_size=0.2, random_state=42
-)
+    # Ensure that features and target have the same length
+    if len(features) != len(target):
+        print("Error: Mismatch in length between features and target.")
+        sys.exit(1)
 
-# Model training
-model = XGBRegressor(n_estimators=100, learning_rate=0.1, max_depth=5)
-model.fit(X_train, y_train)
+    # Split the data into training and test sets: тот же разбиение по
+    # номеру строки, что и при --out-of-core и в for_testing/bench_tiers.py
+    is_test = test_rows(0, len(features))
+    X_train, X_test = features[~is_test], features[is_test]
+    y_train, y_test = target[~is_test], target[is_test]
 
-# Model evaluation
-y_pred = model.predict(X_test)
-mae = mean_absolute_error(y_test, y_pred)
-print(f"Mean Absolute Error: {mae}")
+    # Model training
+    model = XGBRegressor(n_estimators=args.rounds or DEFAULT_ROUNDS, learning_rate=0.1, max_depth=5)
+    model.fit(X_train, y_train)
 
-# Save the model
-model_path = 'bus_travel_time_model.pkl'
+    # Model evaluation
+    y_pred = model.predict(X_test)
+    mae = mean_absolute_error(y_test, y_pred)
+    print(f"Mean Absolute Error: {mae}")
+
+    coefficients, fast_rows = fit_hourly_linear([(X_train.to_numpy(), y_train.to_numpy())])
+    fast_model = HourlyLinearModel(coefficients, fast_model_path, None)
+    print(f"Fast tier Mean Absolute Error: {chunks_mae(fast_model.predict, [(X_test.to_numpy(), y_test.to_numpy())])}")
+    save_fast_model(coefficients, fast_model_path, fast_rows)
+    booster = model.get_booster()
+
+# Save the model. Порядок записи: быстрый уровень (выше), таблица
+# сегментов, .pkl и последним - .ubj, подменой временного файла. Сервер с
+# MODEL_WATCH_INTERVAL перечитывает модель, когда меняется .ubj, и к этому
+# моменту таблица и быстрый уровень для новой версии уже на диске.
+from model_loader import load_model
+from segment_table import SegmentTable, known_segment_lengths
+tmp_native_model_path = 'bus_travel_time_model.tmp.ubj'
+booster.save_model(tmp_native_model_path)
+# Версия модели - хэш файла, после переименования она та же
+segment_table = SegmentTable.build(load_model(tmp_native_model_path),
+                                   known_segment_lengths(pd.read_csv('stops_data.csv')))
+segment_table.save('segment_table.npy')
+print(f"Segment table {segment_table.values.shape} saved to: segment_table.npy")
+if model is None:
+    model = XGBRegressor()
+    model.load_model(tmp_native_model_path)
 joblib.dump(model, model_path)
+os.replace(tmp_native_model_path, native_model_path)
 
 print("Model training completed.")
-print(f"Model saved to: {model_path}")
+print(f"Model saved to: {model_path}, {native_model_path}, fast tier: {fast_model_path}")
 
 # Изменяем подготовку данных
 def prepare_features(df):
     features = pd.DataFrame()
     
     # Рассчитываем расстояние между остановками
-    features['segment_length'] = calculate_distances(
-        df['latitude'], 
-        df['longitude'],
-        df['latitude'].shift(),
-        df['longitude'].shift()
+    features['segment_length'] = segment_lengths(
+        df, by='route_id' if 'route_id' in df.columns else None
     )
     
     # Время суток (час)
-    features['hour_of_day'] = df['scheduled_time'].apply(
-        lambda x: int(x.split(':')[0]) if isinstance(x, str) else x // 60
-    )
+    features['hour_of_day'] = times_to_minutes(df['scheduled_time']) // 60
     
     # День недели (можно добавить позже)
     features['day_of_week'] = 0
     
     return features
 
-def calculate_distances(lat1, lon1, lat2, lon2):
-    # Используем формулу гаверсинусов для расчета расстояния
-    R = 6371  # радиус Земли в километрах
-    
-    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
-    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
-    distance = R * c
-    
-    return distance
-
 # Основной процесс тренировки
 def train_model(data):
     features = prepare_features(data)
@@ -249,6 +165,7 @@ def train_model(data):
     
     # Сохранение модели
     joblib.dump(model, 'bus_travel_time_model.pkl')
+    model.get_booster().save_model('bus_travel_time_model.ubj')
     
     return model
 
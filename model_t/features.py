@@ -0,0 +1,113 @@
+# Общие признаки для app.py и data/train.py. Все функции работают
+# над целыми колонками, без построчного apply.
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371
+
+def time_to_minutes(t):
+    if pd.isna(t):
+        return np.nan
+    if isinstance(t, str):
+        try:
+            x = datetime.strptime(t, '%H:%M:%S')
+        except ValueError:
+            try:
+                x = datetime.strptime(t, '%H:%M')
+            except ValueError:
+                return np.nan
+        return x.hour * 60 + x.minute
+    return t  # Already in minutes
+
+def _clock_strings_to_minutes(strings):
+    # Разбор 'H:MM', 'HH:MM:SS' и т.п. целиком в NumPy: строки до 8 символов
+    # раскладываются в матрицу кодов символов, поля между ':' собираются
+    # по колонкам. Правила те же, что у datetime.strptime('%H:%M:%S' / '%H:%M').
+    lengths = strings.str.len().to_numpy()
+    codes = strings.to_numpy().astype('U8').view(np.uint32).reshape(len(strings), 8)
+
+    is_colon = codes == ord(':')
+    is_digit = (codes >= ord('0')) & (codes <= ord('9'))
+    is_pad = np.arange(8) >= lengths[:, None]
+    field = np.cumsum(is_colon, axis=1)
+
+    values = [np.zeros(len(strings), dtype=np.int32) for _ in range(3)]
+    digits = [np.zeros(len(strings), dtype=np.int8) for _ in range(3)]
+    for pos in range(8):
+        digit = codes[:, pos].astype(np.int32) - ord('0')
+        for k in range(3):
+            use = is_digit[:, pos] & (field[:, pos] == k)
+            values[k] = np.where(use, values[k] * 10 + digit, values[k])
+            digits[k] += use
+
+    n_colons = is_colon.sum(axis=1)
+    n_fields = n_colons + 1
+    valid = (
+        (lengths <= 8)
+        & (is_digit | is_colon | is_pad).all(axis=1)
+        & ((n_colons == 1) | (n_colons == 2))
+        & (digits[0] >= 1) & (digits[0] <= 2)
+        & (digits[1] >= 1) & (digits[1] <= 2)
+        & ((n_fields == 2) | ((digits[2] >= 1) & (digits[2] <= 2)))
+        & (values[0] <= 23) & (values[1] <= 59) & (values[2] <= 59)
+    )
+    minutes = np.where(valid, values[0] * 60 + values[1], np.nan)
+    # strptime принимает и не-ASCII цифры (например, '８:00') - такие редкие
+    # строки разбираются им самим
+    other = np.flatnonzero((codes > 127).any(axis=1))
+    if len(other):
+        minutes[other] = [time_to_minutes(value) for value in strings.to_numpy()[other].tolist()]
+    return minutes
+
+def times_to_minutes(values):
+    # Векторная версия time_to_minutes: строки 'HH:MM:SS' / 'HH:MM'
+    # переводятся в минуты от начала суток, числа считаются уже минутами.
+    values = pd.Series(values, copy=False)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(np.float64)
+
+    is_str = values.str.len().notna()
+    if is_str.all():
+        return pd.Series(_clock_strings_to_minutes(values), index=values.index)
+
+    minutes = pd.to_numeric(values.where(~is_str), errors='coerce').astype(np.float64)
+    if is_str.any():
+        minutes[is_str] = _clock_strings_to_minutes(values[is_str])
+    return minutes
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+    return EARTH_RADIUS_KM * c
+
+def _previous(df, column, by):
+    if by is None:
+        return df[column].shift()
+    return df.groupby(by, sort=False)[column].shift()
+
+def segment_lengths(df, by='route_id'):
+    # Расстояние (км) от предыдущей остановки того же маршрута, у первой остановки 0
+    distance = haversine_km(
+        _previous(df, 'latitude', by), _previous(df, 'longitude', by),
+        df['latitude'].astype(np.float64), df['longitude'].astype(np.float64)
+    )
+    return distance.fillna(0)
+
+def scheduled_travel_times(df, by='route_id'):
+    # Разница scheduled_time с предыдущей остановкой маршрута, у первой остановки 0.
+    # Непарсящиеся времена остаются NaN, их заполняет вызывающий код.
+    if by is None:
+        travel = df['scheduled_time'].diff()
+        first = np.arange(len(df)) == 0
+    else:
+        grouped = df.groupby(by, sort=False)
+        travel = grouped['scheduled_time'].diff()
+        first = (grouped.cumcount() == 0).to_numpy()
+    travel[first] = 0
+    return travel
@@ -0,0 +1,226 @@
+# Минимальные метрики в текстовом формате Prometheus без внешних зависимостей.
+# Замеры этапов (stage) пишутся в гистограмму и, если запрос попросил
+# профилирование, в словарь текущего запроса (через contextvars).
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = ['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in pairs]
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def take(self):
+        # Значения с прошлого take (и сброс) - для передачи из процесса-воркера
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, values):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def merge(self, values):
+        with self._lock:
+            self._values.update(values)
+
+    def render(self):
+        if self.function is not None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def merge(self, values):
+        with self._lock:
+            for key, (counts, total, count) in values.items():
+                state = self._values.get(key)
+                if state is None:
+                    state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+                state[2] += count
+
+    def render(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def take(self):
+        # Накопленное с прошлого take по всем метрикам, кроме вычисляемых
+        # (Gauge с function) - процесс-воркер пула отдаёт это родителю
+        return {metric.name: metric.take() for metric in self._metrics
+                if getattr(metric, 'function', None) is None}
+
+    def merge(self, taken):
+        metrics = {metric.name: metric for metric in self._metrics}
+        for name, values in taken.items():
+            if name in metrics and values:
+                metrics[name].merge(values)
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ('method', 'path', 'status')))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'stage_duration_seconds', 'Latency of hot-path stages', ('stage',)))
+MODEL_CALLS = REGISTRY.register(Counter(
+    'model_predict_calls_total', 'Number of model.predict calls', ('tier',)))
+MODEL_BATCH_ROWS = REGISTRY.register(Histogram(
+    'model_predict_batch_rows', 'Rows per model.predict call', ('tier',), buckets=SIZE_BUCKETS))
+MODEL_TIER_REQUESTS = REGISTRY.register(Counter(
+    'model_tier_requests_total', 'Prediction requests by the model tier they were served with', ('tier',)))
+ROWS_PROCESSED = REGISTRY.register(Counter(
+    'prediction_rows_total', 'Stop rows run through process_data_with_predictions'))
+ROWS_PER_SECOND = REGISTRY.register(Gauge(
+    'prediction_rows_per_second', 'Throughput of the last process_data_with_predictions call'))
+STOPS_SNAPPED = REGISTRY.register(Counter(
+    'stops_snapped_total', 'Incoming stops by whether they snapped to a known stop', ('result',)))
+ERRORS = REGISTRY.register(Counter(
+    'errors_total', 'Errors returned by endpoints', ('endpoint',)))
+
+_profile = ContextVar('profile', default=None)
+
+
+def start_profile():
+    timings = {}
+    _profile.set(timings)
+    return timings
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _profile.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def add_profile(timings):
+    # Замеры этапов, сделанные вне контекста запроса (в процессе-воркере)
+    profile = _profile.get()
+    if profile is not None:
+        for name, seconds in timings.items():
+            profile[name] = profile.get(name, 0.0) + seconds
+
+
+def server_timing(timings):
+    return ', '.join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items())
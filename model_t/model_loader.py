@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from metrics import MODEL_BATCH_ROWS, MODEL_CALLS
+
+# Нативный формат XGBoost грузится без pickle, .pkl - запасной вариант
+DEFAULT_MODEL_PATHS = [
+    os.path.join('data', 'bus_travel_time_model.ubj'),
+    os.path.join('data', 'bus_travel_time_model.pkl'),
+]
+# Быстрый уровень (train.py пишет его рядом с основной моделью), необязателен
+DEFAULT_FAST_MODEL_PATH = os.path.join('data', 'bus_travel_time_fast.json')
+
+
+class TravelTimeModel:
+    # Обёртка над Booster: predict принимает NumPy-матрицу признаков и
+    # считает через inplace_predict, без DataFrame и DMatrix.
+    tier = 'full'
+
+    def __init__(self, booster, path, version):
+        self.booster = booster
+        self.path = path
+        self.version = version
+        self.loaded_at = time.time()
+
+    def info(self):
+        return {"version": self.version, "tier": self.tier, "path": self.path, "loadedAt": self.loaded_at}
+
+    def predict(self, features):
+        MODEL_CALLS.inc(tier=self.tier)
+        MODEL_BATCH_ROWS.observe(len(features), tier=self.tier)
+        return self.booster.inplace_predict(np.ascontiguousarray(features, dtype=np.float32))
+
+
+# Члены линейной модели быстрого уровня; признаки модели - в порядке
+# model_features: scheduled_travel_time, dwell_time_in_seconds,
+# segment_length, day_of_week, hour_of_day
+FAST_TERMS = ['scheduled_travel_time', 'dwell_time_in_seconds', 'segment_length', 'weekend', 'intercept']
+
+
+def fast_design(features):
+    # Матрица членов FAST_TERMS и час каждой строки
+    features = np.asarray(features, dtype=np.float64)
+    design = np.empty((len(features), len(FAST_TERMS)))
+    design[:, :3] = features[:, :3]
+    design[:, 3] = features[:, 3] >= 5
+    design[:, 4] = 1
+    return design, features[:, 4].astype(np.int64) % 24
+
+
+class HourlyLinearModel:
+    # Быстрый уровень: своя линейная модель на каждый час суток - по
+    # матрице коэффициентов 24 x FAST_TERMS, без XGBoost. Точнее всего там,
+    # где время в пути почти пропорционально плановому.
+    tier = 'fast'
+
+    def __init__(self, coefficients, path, version):
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        if self.coefficients.shape != (24, len(FAST_TERMS)):
+            raise ValueError(f"Expected 24 x {len(FAST_TERMS)} coefficients, got {self.coefficients.shape}")
+        self.path = path
+        self.version = version
+        self.loaded_at = time.time()
+
+    def info(self):
+        return {"version": self.version, "tier": self.tier, "path": self.path, "loadedAt": self.loaded_at}
+
+    def predict(self, features):
+        MODEL_CALLS.inc(tier=self.tier)
+        MODEL_BATCH_ROWS.observe(len(features), tier=self.tier)
+        design, hours = fast_design(features)
+        predicted = np.einsum('ij,ij->i', design, self.coefficients[hours])
+        # Время в пути не бывает отрицательным
+        return np.maximum(predicted, 0).astype(np.float32)
+
+
+def load_fast_model(path=None):
+    # None, если файла нет: без быстрого уровня всё считает основная модель
+    path = path or DEFAULT_FAST_MODEL_PATH
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("terms") != FAST_TERMS:
+        raise ValueError(f"{path} was trained with terms {data.get('terms')}, expected {FAST_TERMS}")
+    return HourlyLinearModel(data["coefficients"], path, model_version(path))
+
+
+def model_version(path):
+    # Версия - короткий хэш содержимого файла модели
+    digest = hashlib.blake2b(digest_size=6)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_model(path=None):
+    candidates = [path] if path else DEFAULT_MODEL_PATHS
+    for candidate in candidates:
+        if not os.path.exists(candidate):
+            continue
+        version = model_version(candidate)
+        if candidate.endswith('.pkl'):
+            import joblib
+            booster = joblib.load(candidate).get_booster()
+        else:
+            # Импорт здесь, а не в начале модуля: xgboost (и scikit-learn,
+            # который он подтягивает) грузится при первой загрузке модели
+            import xgboost
+            booster = xgboost.Booster(model_file=candidate)
+        return TravelTimeModel(booster, candidate, version)
+    raise FileNotFoundError(
+        f"Model file not found at {', '.join(candidates)}. Please ensure the model is trained and saved."
+    )
+
+
+def warm_up(model, n_features, rows=256):
+    # Первый predict платит за инициализацию потоков и буферов XGBoost
+    model.predict(np.zeros((rows, n_features), dtype=np.float32))
+
+
+def reference_batch(rows=512, seed=0):
+    # Небольшой фиксированный набор признаков для проверки новой модели
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        rng.integers(0, 30, rows),        # scheduled_travel_time
+        rng.choice([0, 30, 60, 300], rows),  # dwell_time_in_seconds
+        rng.random(rows) * 5,             # segment_length
+        rng.integers(0, 7, rows),         # day_of_week
+        rng.integers(0, 24, rows),        # hour_of_day
+    ]).astype(np.float32)
+
+
+def validate_model(model, n_features):
+    if model.tier == 'full' and model.booster.num_features() != n_features:
+        raise ValueError(f"Model expects {model.booster.num_features()} features, not {n_features}")
+    batch = reference_batch()
+    predicted = np.asarray(model.predict(batch))
+    if predicted.shape != (len(batch),):
+        raise ValueError(f"Unexpected prediction shape {predicted.shape}")
+    if not np.isfinite(predicted).all():
+        raise ValueError("Model returns non-finite predictions on the reference batch")
+    if (np.abs(predicted) > 24 * 60).any():
+        raise ValueError("Model predicts travel times longer than a day on the reference batch")
+
+
+class ModelRegistry:
+    # Текущая и предыдущая версии модели. Новая версия грузится и
+    # проверяется вне блокировки, подмена - одно присваивание под lock,
+    # поэтому запросы в работе дорабатывают на той модели, что взяли.
+    # Быстрый уровень (fast) живёт рядом, без отката: перечитывается
+    # вместе с каждой перезагрузкой основной модели.
+
+    def __init__(self, n_features, path=None, fast_path=None):
+        self.n_features = n_features
+        self.path = path
+        self.fast_path = fast_path
+        self.current = None
+        self.previous = None
+        self.fast = None
+        self._fast_loaded = False
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._on_swap = []
+        self._watcher = None
+
+    def get(self):
+        model = self.current
+        if model is None:
+            with self._lock:
+                if self.current is None:
+                    self.current = load_model(self.path)
+                model = self.current
+        return model
+
+    def get_fast(self):
+        # None, если быстрого уровня нет или он не прошёл проверку
+        if not self._fast_loaded:
+            with self._lock:
+                if not self._fast_loaded:
+                    self.fast = self._load_fast()
+                    self._fast_loaded = True
+        return self.fast
+
+    def _load_fast(self):
+        try:
+            model = load_fast_model(self.fast_path)
+            if model is not None:
+                validate_model(model, self.n_features)
+            return model
+        except Exception as e:
+            print(f"Fast model tier is disabled: {e}")
+            return None
+
+    def on_swap(self, callback):
+        self._on_swap.append(callback)
+
+    def _swap(self, model):
+        with self._lock:
+            self.previous = self.current
+            self.current = model
+        for callback in self._on_swap:
+            callback(model)
+
+    def reload(self, path=None):
+        with self._reload_lock:
+            path = path or (self.current.path if self.current else self.path)
+            # train.py пишет быстрый уровень раньше основной модели
+            self.fast, self._fast_loaded = self._load_fast(), True
+            model = load_model(path)
+            if self.current is not None and model.version == self.current.version:
+                return self.current
+            validate_model(model, self.n_features)
+            warm_up(model, self.n_features)
+            self._swap(model)
+            return model
+
+    def rollback(self):
+        with self._reload_lock:
+            if self.previous is None:
+                raise ValueError("No previous model version to roll back to")
+            self._swap(self.previous)
+            return self.current
+
+    def info(self):
+        return {
+            "current": self.current.info() if self.current else None,
+            "previous": self.previous.info() if self.previous else None,
+            "fast": self.fast.info() if self.fast else None,
+        }
+
+    def watch(self, interval):
+        # Следит за mtime файла текущей модели и перезагружает её при изменении
+        if self._watcher is not None:
+            return
+
+        def loop():
+            last_mtime = None
+            while True:
+                path = self.get().path
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if last_mtime is not None and mtime is not None and mtime != last_mtime:
+                    try:
+                        model = self.reload(path)
+                        print(f"Model reloaded from {path}, version {model.version}")
+                    except Exception as e:
+                        # Файл мог быть записан не до конца - попробуем на следующем шаге
+                        print(f"Error reloading model from {path}: {e}")
+                        time.sleep(interval)
+                        continue
+                last_mtime = mtime
+                time.sleep(interval)
+
+        self._watcher = threading.Thread(target=loop, name='model-watch', daemon=True)
+        self._watcher.start()
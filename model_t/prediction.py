@@ -0,0 +1,262 @@
+# Предсказания маршрутов: модели, кэш и таблица сегментов, привязка
+# остановок и lockstep-расчёт прибытий. Без хранилища маршрутов, событий и
+# FastAPI - модуль импортируют и app.py, и пакетный batch_score.py.
+from datetime import datetime
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import REGISTRY, ROWS_PROCESSED, ROWS_PER_SECOND, STOPS_SNAPPED, stage
+from features import times_to_minutes, segment_lengths, scheduled_travel_times
+from model_loader import ModelRegistry
+from prediction_cache import PredictionCache
+from route_model import Route, MINUTE_US, HOUR_US
+from segment_table import DEFAULT_STOPS_PATH, DEFAULT_TABLE_PATH, SegmentTable
+from stop_index import StopRegistry
+
+model_features = [
+    'scheduled_travel_time', 'dwell_time_in_seconds',
+    'segment_length', 'day_of_week', 'hour_of_day'
+]
+
+# Модель грузится при старте сервера (или при первом предсказании):
+# MODEL_PATH, по умолчанию data/bus_travel_time_model.ubj, затем .pkl.
+# Предыдущая версия остаётся в памяти для отката. Быстрый уровень -
+# FAST_MODEL_PATH, по умолчанию data/bus_travel_time_fast.json.
+model_registry = ModelRegistry(len(model_features), os.environ.get('MODEL_PATH'), os.environ.get('FAST_MODEL_PATH'))
+
+def get_model(tier='full'):
+    # Без быстрого уровня запросы fast считает основная модель
+    if tier == 'fast':
+        return model_registry.get_fast() or model_registry.get()
+    return model_registry.get()
+
+SEGMENT_FEATURES = model_features[:3]
+
+# Кэш предсказаний сегментов: PREDICTION_CACHE_SIZE, PREDICTION_CACHE_QUANTIZATION
+prediction_cache = PredictionCache.from_env(model_features)
+
+# Таблица предсказаний известных сегментов (SEGMENT_TABLE, по умолчанию
+# data/segment_table.npy), отображается в память. Работает, только пока
+# совпадает с версией текущей модели; reload_segment_table при старте и
+# смене модели перестраивает её по SEGMENT_TABLE_STOPS, если версия другая.
+SEGMENT_TABLE_PATH = os.environ.get('SEGMENT_TABLE', DEFAULT_TABLE_PATH)
+SEGMENT_TABLE_STOPS = os.environ.get('SEGMENT_TABLE_STOPS', DEFAULT_STOPS_PATH)
+segment_table = SegmentTable.from_env()
+
+def predict_segments(model, features):
+    if model.tier == 'fast':
+        # Быстрый уровень дешевле поиска в таблице и кэше, а кэш сбрасывался
+        # бы при каждой смене объекта модели
+        return model.predict(features)
+    table = segment_table
+    if table is None or table.model_version != model.version:
+        return prediction_cache.predict(model, features)
+    values, hit = table.lookup(features)
+    if not hit.all():
+        values[~hit] = prediction_cache.predict(model, features[~hit])
+    return values
+
+def reload_segment_table(model=None):
+    # Таблица для model (по умолчанию текущей): с диска, если её уже
+    # построил train.py, иначе строится здесь
+    global segment_table
+    segment_table = SegmentTable.for_model(model or model_registry.get(), SEGMENT_TABLE_PATH, SEGMENT_TABLE_STOPS)
+    return segment_table
+
+def take_worker_stats():
+    # Метрики и счётчики кэша/таблицы процесса-воркера (PREDICTION_POOL=process)
+    # с прошлого вызова: PredictionPool возвращает их вместе с результатом задачи
+    return {
+        "metrics": REGISTRY.take(),
+        "predictionCache": prediction_cache.take_counts(),
+        "segmentTable": segment_table.take_counts() if segment_table is not None else None,
+    }
+
+def merge_worker_stats(stats):
+    # В родителе: добавляет take_worker_stats воркера к своим
+    REGISTRY.merge(stats["metrics"])
+    prediction_cache.add_counts(stats["predictionCache"])
+    if segment_table is not None and stats["segmentTable"] is not None:
+        segment_table.add_counts(stats["segmentTable"])
+
+# Остановки из stops_data.csv и зарегистрированные при загрузке маршрутов
+# (StopRegistry). STOP_SNAP_METERS > 0 включает привязку: координаты в
+# пределах допуска от известной остановки заменяются её координатами (и в
+# ответе тоже), и одинаковые остановки разных маршрутов дают одинаковые
+# признаки сегментов (и общие записи в кэше/таблице предсказаний). По
+# умолчанию выключена - координаты остаются такими, как их прислали.
+STOP_SNAP_METERS = float(os.environ.get('STOP_SNAP_METERS', 0))
+stop_registry = StopRegistry.from_env()
+
+def snap_stops(df):
+    # Добавляет canonical_id и подменяет координаты привязанных остановок
+    if STOP_SNAP_METERS <= 0 or df.empty:
+        return df
+    names = df['address'] if 'address' in df.columns else 'Stop ' + df['stop_id'].astype(str)
+    canonical_ids, coordinates, snapped = stop_registry.snap(
+        df[['latitude', 'longitude']].to_numpy(dtype=np.float64), names.to_numpy(dtype=object), STOP_SNAP_METERS)
+    # Без регистрации (пакетный расчёт) у новой остановки id из маршрута
+    unregistered = pd.isna(canonical_ids)
+    if unregistered.any():
+        canonical_ids[unregistered] = (df['route_id'].astype(str) + ':' + df['stop_id'].astype(str)).to_numpy(
+            dtype=object)[unregistered]
+    df['latitude'] = coordinates[:, 0]
+    df['longitude'] = coordinates[:, 1]
+    df['canonical_id'] = canonical_ids
+    STOPS_SNAPPED.inc(int(snapped.sum()), result='snapped')
+    STOPS_SNAPPED.inc(int((~snapped).sum()), result='new')
+    return df
+
+def prepare_upload_features(df):
+    with stage('snap_stops'):
+        df = snap_stops(df)
+
+    # Конвертируем scheduled_time в минуты
+    if 'scheduled_time' in df.columns:
+        with stage('time_to_minutes'):
+            df['scheduled_time'] = times_to_minutes(df['scheduled_time'])
+
+    with stage('segment_length'):
+        # Длина сегмента от предыдущей остановки того же маршрута
+        df['segment_length'] = segment_lengths(df)
+
+        if 'scheduled_travel_time' not in df.columns:
+            df['scheduled_travel_time'] = scheduled_travel_times(df)
+            df['scheduled_travel_time'] = df['scheduled_travel_time'].fillna(df['scheduled_travel_time'].mean())
+
+    # Добавляем фиксированное значение dwell_time_in_seconds
+    df['dwell_time_in_seconds'] = 30  # среднее время остановки
+    return df
+
+DAY_US = 24 * HOUR_US
+
+def predict_routes_lockstep(model, route_starts, route_lengths, segment_features,
+                            skip_prediction, base_date):
+    # Все маршруты продвигаются на одну остановку за шаг: модель вызывается
+    # один раз на позицию остановки, а не на каждую остановку.
+    # segment_features - колонки scheduled_travel_time, dwell_time_in_seconds,
+    # segment_length. Время хранится в микросекундах от полуночи base_date.
+    n_routes = len(route_starts)
+    arrival_us = np.zeros(len(segment_features), dtype=np.int64)
+    clock_us = np.asarray(route_starts, dtype=np.int64).copy()
+    dwell_time = segment_features[:, 1]
+    base_weekday = base_date.weekday()
+    offsets = np.zeros(n_routes, dtype=np.int64)
+    offsets[1:] = np.cumsum(route_lengths)[:-1]
+
+    for pos in range(int(route_lengths.max()) if n_routes else 0):
+        active = np.flatnonzero(route_lengths > pos)
+        rows = offsets[active] + pos
+        clock = clock_us[active]
+        travel_us = np.zeros(len(rows), dtype=np.int64)
+
+        predict_mask = ~skip_prediction[rows]
+        if predict_mask.any():
+            pred_rows = rows[predict_mask]
+            pred_clock = clock[predict_mask]
+            features = np.column_stack([
+                segment_features[pred_rows],
+                (base_weekday + pred_clock // DAY_US) % 7,
+                (pred_clock // HOUR_US) % 24,
+            ]).astype(np.float32)
+            with stage('predict'):
+                predicted = predict_segments(model, features).astype(np.float64)
+            travel_us[predict_mask] = np.rint(predicted * MINUTE_US).astype(np.int64)
+
+        arrival = clock + travel_us
+        arrival_us[rows] = arrival
+        clock_us[active] = arrival + np.rint(dwell_time[rows] * 10**6).astype(np.int64)
+
+    return arrival_us
+
+def route_start_us(first_scheduled):
+    # Старт маршрута - плановое время первой остановки с точностью до минуты
+    start_hours = np.floor_divide(first_scheduled, 60)
+    start_minutes = np.floor(np.mod(first_scheduled, 60))
+    if np.isnan(first_scheduled).any() or (start_hours < 0).any() or (start_hours > 23).any():
+        raise ValueError("hour must be in 0..23")
+    return (start_hours.astype(np.int64) * HOUR_US
+            + start_minutes.astype(np.int64) * MINUTE_US)
+
+def process_data_with_predictions(df, base_date=None, tier='full'):
+    # base_date - день расчёта (день недели в признаках), по умолчанию сегодня
+    routes = []
+    if df.empty or df['route_id'].isna().all():
+        return routes
+    started = time.perf_counter()
+
+    # Группируем данные по маршрутам, сохраняя порядок строк внутри маршрута
+    grouped = df.groupby('route_id', sort=True)
+    group_codes = grouped.ngroup().to_numpy()
+    order = np.argsort(group_codes, kind='stable')
+    order = order[group_codes[order] >= 0]  # groupby пропускает route_id = NaN
+    df = df.iloc[order]
+    group_sizes = grouped.size()
+    route_ids = group_sizes.index.tolist()
+    route_lengths = group_sizes.to_numpy()
+    first_rows = np.concatenate([[0], np.cumsum(route_lengths)[:-1]])
+
+    # Initialize start_time based on scheduled time of the first stop
+    route_starts = route_start_us(df['scheduled_time'].to_numpy(dtype=np.float64)[first_rows])
+
+    model = get_model(tier)
+    segment_features = df[SEGMENT_FEATURES].to_numpy(dtype=np.float64)
+    # Для строки с индексом 0 предсказанное время в пути равно 0
+    skip_prediction = df.index.to_numpy() == 0
+    arrival_us = predict_routes_lockstep(
+        model, route_starts, route_lengths, segment_features, skip_prediction, base_date or prediction_base_date()
+    )
+
+    scheduled_minutes = df['scheduled_time'].to_numpy(dtype=np.float64)
+    canonical_ids = df['canonical_id'].tolist() if 'canonical_id' in df.columns else None
+    stop_ids = df['stop_id'].astype(str).tolist()
+    names = (df['address'].tolist() if 'address' in df.columns
+             else [f"Stop {stop_id}" for stop_id in df['stop_id'].tolist()])
+    coordinates = df[['latitude', 'longitude']].to_numpy(dtype=np.float64)
+
+    for route_id, first_row, length, start in zip(route_ids, first_rows.tolist(), route_lengths.tolist(),
+                                                  route_starts.tolist()):
+        rows = slice(first_row, first_row + length)
+        routes.append(Route(
+            str(route_id),
+            f"Route {route_id}",
+            stop_ids[rows],
+            names[rows],
+            coordinates[rows].copy(),
+            arrival_us[rows].copy(),
+            segment_features=segment_features[rows].copy(),
+            start_us=start,
+            skip_prediction=skip_prediction[rows].copy(),
+            model_version=model.version,
+            scheduled_minutes=scheduled_minutes[rows].copy(),
+            canonical_ids=canonical_ids[rows] if canonical_ids is not None else None,
+        ))
+
+    ROWS_PROCESSED.inc(len(df))
+    ROWS_PER_SECOND.set(len(df) / max(time.perf_counter() - started, 1e-9))
+    return routes
+
+def prediction_base_date():
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+def rescore_routes(routes, model):
+    # Пересчёт прибытия сохранённых маршрутов по их исходным признакам
+    if not routes:
+        return []
+    route_lengths = np.array([len(route) for route in routes])
+    arrival_us = predict_routes_lockstep(
+        model,
+        np.array([route.start_us for route in routes], dtype=np.int64),
+        route_lengths,
+        np.concatenate([route.segment_features for route in routes]),
+        np.concatenate([route.skip_prediction for route in routes]),
+        prediction_base_date(),
+    )
+    offsets = np.concatenate([[0], np.cumsum(route_lengths)])
+    return [
+        route.with_arrivals(arrival_us[offsets[i]:offsets[i + 1]].copy(), model.version)
+        for i, route in enumerate(routes)
+    ]
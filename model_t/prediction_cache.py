@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    # LRU-кэш предсказаний по сегментам. Ключ - байты строки признаков во
+    # float32 (ровно то, что видит модель), непрерывные признаки можно
+    # предварительно округлять до заданного шага. Кэш сбрасывается, когда
+    # в predict передаётся другой объект модели.
+
+    def __init__(self, feature_names, max_size=100000, quantization=None):
+        self.feature_names = list(feature_names)
+        self.max_size = max_size
+        self.quantization = dict(quantization or {})
+        unknown = set(self.quantization) - set(self.feature_names)
+        if unknown:
+            raise ValueError(f"Unknown features in quantization: {', '.join(sorted(unknown))}")
+        self._steps = np.array([self.quantization.get(name, 0) for name in self.feature_names], dtype=np.float64)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._model = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls, feature_names):
+        # PREDICTION_CACHE_SIZE=0 отключает кэш,
+        # PREDICTION_CACHE_QUANTIZATION="segment_length=0.01,scheduled_travel_time=0.5"
+        quantization = {}
+        for item in os.environ.get('PREDICTION_CACHE_QUANTIZATION', '').split(','):
+            if item.strip():
+                name, step = item.split('=')
+                quantization[name.strip()] = float(step)
+        return cls(
+            feature_names,
+            max_size=int(os.environ.get('PREDICTION_CACHE_SIZE', 100000)),
+            quantization=quantization,
+        )
+
+    def quantize(self, features):
+        features = np.asarray(features, dtype=np.float64)
+        steps = self._steps
+        if (steps > 0).any():
+            features = features.copy()
+            for col in np.flatnonzero(steps > 0):
+                features[:, col] = np.round(features[:, col] / steps[col]) * steps[col]
+        return np.ascontiguousarray(features, dtype=np.float32)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def predict(self, model, features):
+        features = self.quantize(features)
+        if self.max_size <= 0:
+            return model.predict(features)
+
+        row_type = np.dtype((np.void, features.dtype.itemsize * features.shape[1]))
+        unique_rows, inverse, counts = np.unique(
+            features.view(row_type).ravel(), return_inverse=True, return_counts=True
+        )
+        keys = [row.tobytes() for row in unique_rows]
+        values = np.empty(len(keys), dtype=np.float32)
+        missing = []
+
+        with self._lock:
+            if model is not self._model:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._model = model
+            for i, key in enumerate(keys):
+                value = self._entries.get(key)
+                if value is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    values[i] = value
+
+        n_missing_rows = int(counts[missing].sum()) if missing else 0
+        if missing:
+            unique_features = unique_rows.view(np.float32).reshape(len(keys), -1)
+            values[missing] = model.predict(unique_features[missing])
+
+        with self._lock:
+            self.hits += len(features) - n_missing_rows
+            self.misses += n_missing_rows
+            if model is self._model:
+                for i in missing:
+                    self._entries[keys[i]] = values[i]
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+        return values[inverse.ravel()]
+
+    def take_counts(self):
+        # Счётчики с прошлого вызова (и сброс) - процесс-воркер пула отдаёт их родителю
+        with self._lock:
+            counts = {"hits": self.hits, "misses": self.misses,
+                      "evictions": self.evictions, "invalidations": self.invalidations}
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+        return counts
+
+    def add_counts(self, counts):
+        with self._lock:
+            self.hits += counts["hits"]
+            self.misses += counts["misses"]
+            self.evictions += counts["evictions"]
+            self.invalidations += counts["invalidations"]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "quantization": self.quantization,
+            }
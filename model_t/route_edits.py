@@ -0,0 +1,158 @@
+# Правка одной остановки сохранённого маршрута (insert / move / retime /
+# remove). Признаки пересчитываются только у сегментов, у которых сменилась
+# предыдущая остановка или плановое время; прибытие нужно пересчитать с
+# первой такой позиции, префикс маршрута остаётся как был.
+import numpy as np
+
+from features import haversine_km
+from route_model import Route
+
+EDIT_OPS = ('insert', 'move', 'retime', 'remove')
+EDIT_DWELL_SECONDS = 30  # как у остановок из /api/routes/create
+
+
+def _check_position(position, size, name='position'):
+    if position is None or not 0 <= position < size:
+        raise ValueError(f"{name} must be in 0..{size - 1}")
+
+
+def _new_stop_id(stop_ids):
+    numeric = [int(stop_id) for stop_id in stop_ids if stop_id.isdigit()]
+    return str(max(numeric, default=len(stop_ids)) + 1)
+
+
+def edit_route(route, op, position, to=None, stop=None, scheduled_minutes=None, canonical_id=None):
+    # Возвращает маршрут после правки (прибытие в префиксе - прежнее) и
+    # первую позицию, с которой прибытие нужно пересчитать.
+    # stop - новая остановка для insert: name, latitude, longitude;
+    # scheduled_minutes - её плановое время или новое время для retime/move;
+    # canonical_id - id новой остановки в индексе остановок, если она привязана.
+    if not route.can_rescore():
+        raise ValueError(f"Route {route.id} was stored without segment features, recreate it to edit")
+    if op not in EDIT_OPS:
+        raise ValueError(f"Unknown edit operation: {op}")
+
+    size = len(route)
+    order = list(range(size))  # позиция -> индекс остановки в старом маршруте, -1 - новая
+    retimed = set()
+    if op == 'insert':
+        if stop is None or scheduled_minutes is None:
+            raise ValueError("insert needs a stop with scheduled_time")
+        _check_position(position, size + 1)
+        order.insert(position, -1)
+        retimed.add(position)
+    elif op == 'remove':
+        _check_position(position, size)
+        if size < 2:
+            raise ValueError("A route needs at least one stop")
+        order.pop(position)
+    elif op == 'move':
+        _check_position(position, size)
+        _check_position(to, size, 'to')
+        order.insert(to, order.pop(position))
+        if scheduled_minutes is not None:
+            retimed.add(to)
+    else:
+        _check_position(position, size)
+        if scheduled_minutes is None:
+            raise ValueError("retime needs scheduled_time")
+        retimed.add(position)
+    if scheduled_minutes is not None and np.isnan(scheduled_minutes):
+        raise ValueError("scheduled_time must be HH:MM or HH:MM:SS")
+
+    old = np.array(order)
+    is_new = old < 0
+    source = np.where(is_new, 0, old)
+    new_stop_id = _new_stop_id(route.stop_ids)
+    stop_ids = [route.stop_ids[i] if i >= 0 else new_stop_id for i in order]
+    canonical_ids = None
+    if route.canonical_ids is not None:
+        canonical_ids = [route.canonical_ids[i] if i >= 0 else canonical_id or f"{route.id}:{new_stop_id}"
+                         for i in order]
+    stop_names = [route.stop_names[i] if i >= 0 else stop.name for i in order]
+    coordinates = route.coordinates[source]
+    schedule = route.schedule()[source]
+    features = route.segment_features[source]
+    arrival_us = route.arrival_us[source]
+    if is_new.any():
+        coordinates[is_new] = [stop.latitude, stop.longitude]
+        features[is_new] = [0, EDIT_DWELL_SECONDS, 0]
+    for i in retimed:
+        schedule[i] = scheduled_minutes
+
+    # Сегмент затронут, если у остановки сменилась предыдущая или время
+    previous = np.concatenate([[-2], old[:-1]])
+    touched = is_new | (previous != np.where(old > 0, old - 1, -2))
+    for i in retimed:
+        touched[i] = True
+        if i + 1 < len(order):
+            touched[i + 1] = True
+    touched = np.flatnonzero(touched)
+
+    rows = touched[touched > 0]
+    features[touched, 0] = 0
+    features[touched, 2] = 0
+    features[rows, 2] = haversine_km(coordinates[rows - 1, 0], coordinates[rows - 1, 1],
+                                     coordinates[rows, 0], coordinates[rows, 1])
+    travel = schedule[rows] - schedule[rows - 1]
+    if np.isnan(travel).any():
+        # Как в /api/routes/create: непарсящиеся времена - среднее по маршруту
+        known = np.delete(features[:, 0], rows)
+        known = np.concatenate([known, travel[~np.isnan(travel)]])
+        travel[np.isnan(travel)] = known.mean() if len(known) else 0
+    features[rows, 0] = travel
+
+    # Предсказание пропускается только у первой остановки (строка с индексом 0)
+    skip_prediction = np.zeros(len(order), dtype=bool)
+    skip_prediction[0] = route.skip_prediction[0]
+
+    edited = Route(route.id, route.name, stop_ids, stop_names, coordinates, arrival_us,
+                   features, route.start_us, skip_prediction, route.model_version, schedule, canonical_ids)
+    return edited, int(touched[0]) if len(touched) else len(order)
+
+
+def route_diff(old, new, first):
+    # Изменения маршрута начиная с позиции first: остановки и сегменты
+    # (по позиции в новом маршруте), id удалённых остановок и новая длина
+    old_labels = old.arrival_labels()
+    new_labels = new.arrival_labels()
+    old_travel = old.travel_times()
+    new_travel = new.travel_times()
+    old_coordinates = old.coordinates.tolist()
+    new_coordinates = new.coordinates.tolist()
+
+    changed = [
+        i for i in range(first, len(new))
+        if i >= len(old) or (new.stop_ids[i], new.stop_names[i], new_coordinates[i], new_labels[i])
+        != (old.stop_ids[i], old.stop_names[i], old_coordinates[i], old_labels[i])
+    ]
+    segments = [
+        i for i in range(max(first - 1, 0), len(new) - 1)
+        if i >= len(old) - 1 or (new.stop_ids[i], new.stop_ids[i + 1], new_travel[i])
+        != (old.stop_ids[i], old.stop_ids[i + 1], old_travel[i])
+    ]
+    kept = set(new.stop_ids)
+    stops = [
+        {
+            "position": i,
+            "id": new.stop_ids[i],
+            "name": new.stop_names[i],
+            "coordinates": new_coordinates[i],
+            "predictedArrivalTime": new_labels[i]
+        }
+        for i in changed
+    ]
+    if new.canonical_ids is not None:
+        for stop in stops:
+            stop["canonicalId"] = new.canonical_ids[stop["position"]]
+    return {
+        "id": new.id,
+        "stopCount": len(new),
+        "removed": [stop_id for stop_id in old.stop_ids if stop_id not in kept],
+        "stops": stops,
+        "segments": [
+            {"position": i, "from": new.stop_ids[i], "to": new.stop_ids[i + 1], "travelTime": new_travel[i]}
+            for i in segments
+        ],
+        "modelVersion": new.model_version
+    }
@@ -0,0 +1,122 @@
+# Поток событий для клиентов (GET /api/events, server-sent events):
+# изменения маршрутов и прогресс загрузок. Событие кодируется в текст SSE
+# один раз и общее для всех клиентов. У клиента своя очередь, ограниченная
+# по байтам: если он не успевает её разбирать, очередь сбрасывается и клиент
+# получает одно событие resync - перечитать /api/routes. Последние события
+# хранятся в кольцевом буфере, переподключившийся клиент с Last-Event-ID
+# получает пропущенные, если они ещё там, иначе - resync.
+# События видны только клиентам того процесса uvicorn, где случилось изменение.
+import asyncio
+import json
+import threading
+from collections import deque
+
+RESYNC = 'resync'
+
+
+class Subscription:
+    def __init__(self, loop, max_bytes):
+        self.loop = loop
+        self.max_bytes = max_bytes
+        self.overflows = 0
+        self._queue = deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+        self._wakeup_pending = False
+
+    def push(self, event_id, payload, wake=True):
+        # Вызывается из любого потока; event loop будится не чаще раза на пачку
+        with self._lock:
+            if self._bytes + len(payload) > self.max_bytes:
+                self._queue.clear()
+                self._bytes = 0
+                self.overflows += 1
+                payload = encode_event(event_id, RESYNC, {"reason": "overflow"})
+            self._queue.append(payload)
+            self._bytes += len(payload)
+            if not wake or self._wakeup_pending:
+                return
+            self._wakeup_pending = True
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        with self._lock:
+            self._wakeup_pending = False
+        self._ready.set()
+
+    async def next(self, timeout):
+        # Всё накопленное одним куском; None, если за timeout ничего не пришло
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        with self._lock:
+            self._ready.clear()
+            chunk = b''.join(self._queue)
+            self._queue.clear()
+            self._bytes = 0
+        return chunk or None
+
+
+def encode_event(event_id, event_type, data):
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event_type}\ndata: {body}\n\n".encode('utf-8')
+
+
+class EventHub:
+
+    def __init__(self, client_buffer_bytes=1 << 20, history=1024, max_clients=100):
+        self.client_buffer_bytes = client_buffer_bytes
+        self.max_clients = max_clients
+        self._history = deque(maxlen=history)
+        self._clients = set()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def publish(self, event_type, make_data):
+        # make_data вызывается, только если есть кому отправлять: без клиентов
+        # изменения маршрутов не кодируются, а история обрывается
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+            if not self._clients:
+                self._history.clear()
+                return
+            payload = encode_event(event_id, event_type, make_data())
+            self._history.append((event_id, payload))
+            # Под блокировкой, чтобы события доходили до клиентов по порядку id
+            for client in self._clients:
+                client.push(event_id, payload)
+
+    def subscribe(self, last_event_id=None):
+        # Подписка на события после last_event_id (заголовок Last-Event-ID)
+        with self._lock:
+            if len(self._clients) >= self.max_clients:
+                raise ValueError(f"Too many event stream clients ({self.max_clients})")
+            client = Subscription(asyncio.get_running_loop(), self.client_buffer_bytes)
+            self._clients.add(client)
+            if last_event_id is None:
+                return client
+            try:
+                last_event_id = int(last_event_id)
+            except ValueError:
+                last_event_id = 0
+            missed = [(event_id, payload) for event_id, payload in self._history if event_id > last_event_id]
+            complete = (last_event_id == self._next_id - 1
+                        or bool(missed) and missed[0][0] == last_event_id + 1)
+            if not complete:
+                client.push(self._next_id - 1, encode_event(self._next_id - 1, RESYNC, {"reason": "gap"}), wake=False)
+            else:
+                for event_id, payload in missed:
+                    client.push(event_id, payload, wake=False)
+            if client._queue:
+                client._ready.set()
+            return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
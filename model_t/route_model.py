@@ -0,0 +1,152 @@
+import numpy as np
+
+MINUTE_US = 60 * 10**6
+HOUR_US = 60 * MINUTE_US
+
+
+class Route:
+    # Внутреннее представление маршрута: массивы вместо словарей на каждую
+    # остановку. В JSON превращается только на границе ответа (to_dict /
+    # to_compact). Время прибытия - микросекунды от полуночи дня расчёта.
+    # Исходные признаки сегментов сохраняются, чтобы маршрут можно было
+    # пересчитать новой моделью; у маршрутов старого формата их нет (None).
+    # scheduled_minutes - плановое время остановок, нужно для правки маршрута.
+    # canonical_ids - id остановок в общем индексе (stop_index.py), если
+    # координаты привязывались к известным остановкам.
+    __slots__ = ('id', 'name', 'stop_ids', 'stop_names', 'coordinates', 'arrival_us',
+                 'segment_features', 'start_us', 'skip_prediction', 'model_version',
+                 'scheduled_minutes', 'canonical_ids')
+
+    def __init__(self, id, name, stop_ids, stop_names, coordinates, arrival_us,
+                 segment_features=None, start_us=None, skip_prediction=None, model_version=None,
+                 scheduled_minutes=None, canonical_ids=None):
+        self.id = id
+        self.name = name
+        self.stop_ids = stop_ids
+        self.stop_names = stop_names
+        self.coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        self.arrival_us = np.asarray(arrival_us, dtype=np.int64)
+        self.segment_features = (None if segment_features is None
+                                 else np.asarray(segment_features, dtype=np.float64).reshape(-1, 3))
+        self.start_us = start_us
+        self.skip_prediction = (None if skip_prediction is None
+                                else np.asarray(skip_prediction, dtype=bool))
+        self.model_version = model_version
+        self.scheduled_minutes = (None if scheduled_minutes is None
+                                  else np.asarray(scheduled_minutes, dtype=np.float64))
+        self.canonical_ids = canonical_ids
+
+    def can_rescore(self):
+        return self.segment_features is not None
+
+    def with_arrivals(self, arrival_us, model_version):
+        return Route(self.id, self.name, self.stop_ids, self.stop_names, self.coordinates, arrival_us,
+                     self.segment_features, self.start_us, self.skip_prediction, model_version,
+                     self.scheduled_minutes, self.canonical_ids)
+
+    def schedule(self):
+        # Маршруты, сохранённые без планового времени, восстанавливают его
+        # из времени старта и плановых длительностей сегментов
+        if self.scheduled_minutes is not None:
+            return self.scheduled_minutes
+        return self.start_us / MINUTE_US + np.cumsum(self.segment_features[:, 0])
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def arrival_labels(self):
+        hours = ((self.arrival_us // HOUR_US) % 24).tolist()
+        minutes = ((self.arrival_us // MINUTE_US) % 60).tolist()
+        return [f"{h:02d}:{m:02d}" for h, m in zip(hours, minutes)]
+
+    def travel_times(self):
+        arrivals = self.arrival_us.tolist()
+        return [round((arrivals[i] - arrivals[i - 1]) / 10**6 / 60, 2) for i in range(1, len(arrivals))]
+
+    def _stop_dicts(self):
+        stops = [
+            {
+                "id": stop_id,
+                "name": name,
+                "coordinates": coordinates,
+                "predictedArrivalTime": label
+            }
+            for stop_id, name, coordinates, label in zip(
+                self.stop_ids, self.stop_names, self.coordinates.tolist(), self.arrival_labels()
+            )
+        ]
+        if self.canonical_ids is not None:
+            for stop, canonical_id in zip(stops, self.canonical_ids):
+                stop["canonicalId"] = canonical_id
+        return stops
+
+    def to_dict(self):
+        stops = self._stop_dicts()
+        return {
+            "id": self.id,
+            "name": self.name,
+            "stops": stops,
+            "segments": [
+                {"from": stops[i], "to": stops[i + 1], "travelTime": travel_time}
+                for i, travel_time in enumerate(self.travel_times())
+            ],
+            "modelVersion": self.model_version
+        }
+
+    def to_compact(self):
+        # Сегменты ссылаются на id остановок вместо вложенных копий
+        return {
+            "id": self.id,
+            "name": self.name,
+            "stops": self._stop_dicts(),
+            "segments": [
+                {"from": self.stop_ids[i], "to": self.stop_ids[i + 1], "travelTime": travel_time}
+                for i, travel_time in enumerate(self.travel_times())
+            ],
+            "modelVersion": self.model_version
+        }
+
+    def to_storage(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "stopIds": self.stop_ids,
+            "stopNames": self.stop_names,
+            "coordinates": self.coordinates.ravel().tolist(),
+            "arrivalUs": self.arrival_us.tolist(),
+            "segmentFeatures": None if self.segment_features is None else self.segment_features.ravel().tolist(),
+            "startUs": self.start_us,
+            "skipPrediction": None if self.skip_prediction is None else self.skip_prediction.tolist(),
+            "modelVersion": self.model_version,
+            "scheduledMinutes": None if self.scheduled_minutes is None else self.scheduled_minutes.tolist(),
+            "canonicalIds": self.canonical_ids
+        }
+
+    @classmethod
+    def from_storage(cls, data):
+        if "segments" in data:
+            return cls.from_dict(data)
+        return cls(data["id"], data["name"], data["stopIds"], data["stopNames"],
+                   data["coordinates"], data["arrivalUs"], data.get("segmentFeatures"),
+                   data.get("startUs"), data.get("skipPrediction"), data.get("modelVersion"),
+                   data.get("scheduledMinutes"), data.get("canonicalIds"))
+
+    @classmethod
+    def from_dict(cls, data):
+        # Маршрут в формате ответа API: время прибытия восстанавливается из
+        # HH:MM первой остановки и travelTime сегментов
+        stops = data["stops"]
+        arrival_us = []
+        for i, stop in enumerate(stops):
+            if i == 0:
+                hours, minutes = stop["predictedArrivalTime"].split(':')
+                arrival_us.append((int(hours) * 60 + int(minutes)) * MINUTE_US)
+            else:
+                travel_time = data["segments"][i - 1]["travelTime"]
+                arrival_us.append(arrival_us[-1] + int(round(travel_time * MINUTE_US)))
+        return cls(
+            data["id"], data["name"],
+            [stop["id"] for stop in stops], [stop["name"] for stop in stops],
+            [stop["coordinates"] for stop in stops], arrival_us,
+            model_version=data.get("modelVersion")
+        )
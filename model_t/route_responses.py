@@ -0,0 +1,97 @@
+import hashlib
+import json
+import threading
+
+ROUTE_FIELDS = ('id', 'name', 'stops', 'segments')
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _id_key(route_id):
+    # id созданных маршрутов - числа (время в секундах), сравниваются как числа
+    return (0, int(route_id), '') if route_id.isdigit() else (1, 0, route_id)
+
+
+def make_etag(body):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or any(tag.removeprefix('W/') == etag for tag in candidates)
+
+
+class RouteListCache:
+    # Готовые байты ответа GET /api/routes. Каждый маршрут сериализуется
+    # один раз на ревизию хранилища (и на набор полей), страницы собираются
+    # склейкой уже готовых кусков, полный ответ и его ETag кэшируются целиком.
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._revision = None
+        self._routes = []
+        self._positions = {}
+        self._parts = {}
+        self._full = {}
+
+    def _refresh(self):
+        revision, routes = self.store.snapshot()
+        if revision != self._revision:
+            self._revision = revision
+            self._routes = routes
+            self._positions = {route.id: i for i, route in enumerate(routes)}
+            self._parts = {}
+            self._full = {}
+
+    def _route_parts(self, fields, compact):
+        parts = self._parts.get((fields, compact))
+        if parts is None:
+            parts = []
+            light = fields is not None and set(fields) <= {'id', 'name'}
+            for route in self._routes:
+                if light:
+                    data = {"id": route.id, "name": route.name}
+                else:
+                    data = route.to_compact() if compact else route.to_dict()
+                if fields is not None:
+                    data = {field: data[field] for field in fields}
+                parts.append(_dumps(data))
+            self._parts[(fields, compact)] = parts
+        return parts
+
+    def is_empty(self):
+        with self._lock:
+            self._refresh()
+            return not self._routes
+
+    def render(self, fields=None, cursor=None, limit=None, compact=False):
+        # Возвращает (body, etag). cursor - id последнего маршрута прошлой
+        # страницы; если его уже удалили, страница начинается со следующего
+        # по порядку id маршрута
+        with self._lock:
+            self._refresh()
+            if cursor is None and limit is None:
+                cached = self._full.get((fields, compact))
+                if cached is None:
+                    body = b'{"routes":[' + b','.join(self._route_parts(fields, compact)) + b']}'
+                    cached = self._full[(fields, compact)] = (body, make_etag(body))
+                return cached
+
+            start = 0 if cursor is None else self._cursor_start(cursor)
+            end = len(self._routes) if limit is None else min(start + limit, len(self._routes))
+            next_cursor = self._routes[end - 1].id if end < len(self._routes) and end > start else None
+            body = (b'{"routes":[' + b','.join(self._route_parts(fields, compact)[start:end])
+                    + b'],"nextCursor":' + _dumps(next_cursor) + b'}')
+            return body, make_etag(body)
+
+    def _cursor_start(self, cursor):
+        position = self._positions.get(cursor)
+        if position is not None:
+            return position + 1
+        key = _id_key(cursor)
+        return next((i for i, route in enumerate(self._routes) if _id_key(route.id) > key), len(self._routes))
@@ -0,0 +1,323 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+from route_model import Route
+
+
+def create_route_stops(conn):
+    # route_stops - канонические id остановок сохранённых маршрутов: по ним
+    # StopRegistry.prune удаляет остановки, на которые никто не ссылается.
+    # В базе, созданной до route_stops, таблица заполняется по маршрутам.
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'route_stops'").fetchone():
+            return
+        conn.execute('CREATE TABLE route_stops (route_id TEXT NOT NULL, stop_id TEXT NOT NULL)')
+        conn.execute('CREATE INDEX route_stops_route ON route_stops (route_id)')
+        conn.execute('CREATE INDEX route_stops_stop ON route_stops (stop_id)')
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'routes'").fetchone():
+            for route_id, body in conn.execute('SELECT id, body FROM routes').fetchall():
+                conn.executemany('INSERT INTO route_stops (route_id, stop_id) VALUES (?, ?)',
+                                 _route_stop_rows(route_id, json.loads(body).get('canonicalIds')))
+
+
+def _route_stop_rows(route_id, canonical_ids):
+    return [(route_id, stop_id) for stop_id in dict.fromkeys(canonical_ids or [])]
+
+
+class RouteStore:
+    # Хранилище маршрутов в SQLite (WAL), общее для нескольких воркеров
+    # uvicorn. В процессе держится словарь id -> маршрут в порядке вставки:
+    # он заполняется лениво при первом чтении и сбрасывается, когда другой
+    # процесс меняет базу (PRAGMA data_version).
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._conn = None
+        self._routes = {}
+        self._complete = False
+        self._data_version = None
+        self._on_change = []
+        self._reserved = set()
+        # Растёт при любом изменении набора маршрутов, видимом этому процессу
+        self.revision = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get('ROUTES_DB', os.path.join('data', 'routes.db')))
+
+    def on_change(self, callback):
+        # callback(kind, items) после записи, вне блокировки: kind - 'created',
+        # 'updated' (маршруты), 'deleted' (id) или 'reset' (новый полный набор)
+        self._on_change.append(callback)
+
+    def _notify(self, kind, items):
+        for callback in self._on_change:
+            callback(kind, items)
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS routes ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'id TEXT NOT NULL UNIQUE, '
+                'body TEXT NOT NULL)'
+            )
+            conn.commit()
+            create_route_stops(conn)
+            self._conn = conn
+        return self._conn
+
+    def _sync(self):
+        conn = self._connect()
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._data_version:
+            self._invalidate()
+            self._data_version = version
+        return conn
+
+    def _write(self, conn, routes, cache=True):
+        # Маршруты пишутся пачками по batch_size в одной транзакции. Без
+        # REPLACE: маршрут с уже занятым id - IntegrityError, а не перезапись.
+        # cache=False - только в базу: следующее чтение возьмёт их оттуда
+        for start in range(0, len(routes), self.batch_size):
+            batch = routes[start:start + self.batch_size]
+            conn.executemany(
+                'INSERT INTO routes (id, body) VALUES (?, ?)',
+                [(route.id, json.dumps(route.to_storage())) for route in batch]
+            )
+            self._write_stops(conn, batch, replace=False)
+        for route in routes:
+            self._routes.pop(route.id, None)
+            if cache:
+                self._routes[route.id] = route
+        if not cache:
+            self._complete = False
+        self.revision += 1
+
+    def _write_stops(self, conn, routes, replace=True):
+        if replace:
+            conn.executemany('DELETE FROM route_stops WHERE route_id = ?', [(route.id,) for route in routes])
+        conn.executemany('INSERT INTO route_stops (route_id, stop_id) VALUES (?, ?)',
+                         [row for route in routes for row in _route_stop_rows(route.id, route.canonical_ids)])
+
+    def get(self, route_id):
+        with self._lock:
+            conn = self._sync()
+            if route_id in self._routes or self._complete:
+                return self._routes.get(route_id)
+            row = conn.execute('SELECT body FROM routes WHERE id = ?', (route_id,)).fetchone()
+            return Route.from_storage(json.loads(row[0])) if row else None
+
+    def list(self):
+        return self.snapshot()[1]
+
+    def snapshot(self):
+        with self._lock:
+            conn = self._sync()
+            if not self._complete:
+                self._routes = {
+                    route_id: Route.from_storage(json.loads(body))
+                    for route_id, body in conn.execute('SELECT id, body FROM routes ORDER BY seq')
+                }
+                self._complete = True
+            return self.revision, list(self._routes.values())
+
+    def __len__(self):
+        with self._lock:
+            conn = self._sync()
+            if self._complete:
+                return len(self._routes)
+            return conn.execute('SELECT COUNT(*) FROM routes').fetchone()[0]
+
+    def add(self, route):
+        self.add_many([route])
+
+    def _invalidate(self):
+        self._routes = {}
+        self._complete = False
+        self.revision += 1
+
+    def add_many(self, routes, cache=True):
+        with self._lock:
+            conn = self._sync()
+            try:
+                with conn:
+                    self._write(conn, routes, cache)
+            except Exception:
+                self._invalidate()
+                raise
+        self._notify('created', routes)
+
+    def replace_all(self, routes):
+        with self._lock:
+            conn = self._sync()
+            try:
+                with conn:
+                    conn.execute('DELETE FROM routes')
+                    conn.execute('DELETE FROM route_stops')
+                    self._routes = {}
+                    self._write(conn, routes)
+            except Exception:
+                self._invalidate()
+                raise
+            self._complete = True
+        self._notify('reset', routes)
+
+    def stage_replacement(self):
+        # Замена всех маршрутов по частям (потоковая загрузка): см. StagedRoutes
+        return StagedRoutes(self)
+
+    def update_many(self, routes, revision):
+        # Обновляет маршруты на месте, не меняя порядок. Если набор маршрутов
+        # изменился после снимка с этой ревизией, ничего не пишет и возвращает None.
+        # Только пересчёт прибытия: остановки (route_stops) не меняются.
+        with self._lock:
+            conn = self._sync()
+            if self.revision != revision:
+                return None
+            try:
+                with conn:
+                    conn.executemany(
+                        'UPDATE routes SET body = ? WHERE id = ?',
+                        [(json.dumps(route.to_storage()), route.id) for route in routes]
+                    )
+            except Exception:
+                self._invalidate()
+                raise
+            for route in routes:
+                if route.id in self._routes:
+                    self._routes[route.id] = route
+            self.revision += 1
+            revision = self.revision
+        self._notify('updated', routes)
+        return revision
+
+    def update(self, route):
+        # Обновляет один маршрут на месте без проверки ревизии; False, если его нет
+        with self._lock:
+            conn = self._sync()
+            try:
+                with conn:
+                    updated = conn.execute(
+                        'UPDATE routes SET body = ? WHERE id = ?',
+                        (json.dumps(route.to_storage()), route.id)
+                    ).rowcount
+                    if updated:
+                        self._write_stops(conn, [route])
+            except Exception:
+                self._invalidate()
+                raise
+            if route.id in self._routes:
+                self._routes[route.id] = route
+            if updated:
+                self.revision += 1
+        if updated:
+            self._notify('updated', [route])
+        return updated > 0
+
+    def delete(self, route_id):
+        with self._lock:
+            conn = self._sync()
+            with conn:
+                deleted = conn.execute('DELETE FROM routes WHERE id = ?', (route_id,)).rowcount
+                conn.execute('DELETE FROM route_stops WHERE route_id = ?', (route_id,))
+            self._routes.pop(route_id, None)
+            if deleted:
+                self.revision += 1
+        if deleted:
+            self._notify('deleted', [route_id])
+        return deleted > 0
+
+    def reserve_id(self, route_id):
+        # id создаваемых маршрутов - время в секундах, при совпадении берём
+        # следующее. id занят до release_id, поэтому параллельные запросы
+        # этого процесса не получат одинаковый; гонку с другим процессом
+        # ловит INSERT без REPLACE.
+        with self._lock:
+            while route_id in self._reserved or self.get(route_id) is not None:
+                route_id = str(int(route_id) + 1)
+            self._reserved.add(route_id)
+            return route_id
+
+    def release_id(self, route_id):
+        with self._lock:
+            self._reserved.discard(route_id)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._invalidate()
+
+
+class StagedRoutes:
+    # Новый набор маршрутов копится во временных таблицах соединения
+    # хранилища (в памяти Python от них ничего не остаётся) и одной
+    # транзакцией заменяет все маршруты в commit. До commit хранилище отдаёт
+    # прежние маршруты; discard (или ошибка до commit) ничего не меняет.
+    # Слушатели получают одно событие 'replaced' с числом маршрутов: самих
+    # маршрутов в памяти нет, клиенты перечитывают список.
+
+    def __init__(self, store):
+        self.store = store
+        self.count = 0
+        self._table = f"staged_{uuid.uuid4().hex}"
+        self._open = True
+        with store._lock:
+            conn = store._sync()
+            with conn:
+                conn.execute(f'CREATE TEMP TABLE {self._table} ('
+                             'seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, body TEXT NOT NULL)')
+                conn.execute(f'CREATE TEMP TABLE {self._table}_stops (route_id TEXT NOT NULL, stop_id TEXT NOT NULL)')
+
+    def add_many(self, routes):
+        # Возвращает id маршрутов, которые уже были в наборе (они не пишутся)
+        duplicates = []
+        with self.store._lock:
+            conn = self.store._sync()
+            with conn:
+                added = []
+                for route in routes:
+                    inserted = conn.execute(f'INSERT OR IGNORE INTO {self._table} (id, body) VALUES (?, ?)',
+                                            (route.id, json.dumps(route.to_storage()))).rowcount
+                    (added if inserted else duplicates).append(route)
+                conn.executemany(f'INSERT INTO {self._table}_stops (route_id, stop_id) VALUES (?, ?)',
+                                 [row for route in added for row in _route_stop_rows(route.id, route.canonical_ids)])
+        self.count += len(routes) - len(duplicates)
+        return [route.id for route in duplicates]
+
+    def commit(self):
+        store = self.store
+        with store._lock:
+            conn = store._sync()
+            try:
+                with conn:
+                    conn.execute('DELETE FROM routes')
+                    conn.execute('DELETE FROM route_stops')
+                    conn.execute(f'INSERT INTO routes (id, body) SELECT id, body FROM {self._table} ORDER BY seq')
+                    conn.execute(f'INSERT INTO route_stops (route_id, stop_id) '
+                                 f'SELECT route_id, stop_id FROM {self._table}_stops')
+            finally:
+                store._invalidate()
+            self.discard()
+        store._notify('replaced', self.count)
+        return self.count
+
+    def discard(self):
+        with self.store._lock:
+            if not self._open or self.store._conn is None:
+                return
+            self._open = False
+            with self.store._conn as conn:
+                conn.execute(f'DROP TABLE IF EXISTS temp.{self._table}')
+                conn.execute(f'DROP TABLE IF EXISTS temp.{self._table}_stops')
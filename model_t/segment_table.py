@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from features import haversine_km
+
+# Плотная таблица предсказаний для известных сегментов: ось длины сегмента
+# (пары соседних остановок из stops_data.csv и 0 для первой остановки),
+# плановое время в пути (целые минуты), dwell_time, день недели, час.
+# Значения - ровно то, что вернула бы модель на той же строке float32.
+# Файл не хранится в git: его пишет train.py, сервер при старте и смене
+# модели перестраивает его, если нет таблицы для текущей версии
+# (SegmentTable.for_model), вручную:
+#   python segment_table.py [--pairs all] [--max-travel-time 60]
+DEFAULT_TABLE_PATH = os.path.join('data', 'segment_table.npy')
+DEFAULT_STOPS_PATH = os.path.join('data', 'stops_data.csv')
+DEFAULT_DWELL_VALUES = (30,)  # app.py ставит dwell_time_in_seconds = 30
+DEFAULT_MAX_TRAVEL_TIME = 60
+
+
+def known_segment_lengths(stops, pairs='adjacent'):
+    # Длины сегментов между остановками маршрута в обоих направлениях
+    coordinates = stops[['latitude', 'longitude']].to_numpy(dtype=np.float64)
+    if pairs == 'all':
+        start, end = np.nonzero(~np.eye(len(coordinates), dtype=bool))
+    else:
+        start = np.concatenate([np.arange(len(coordinates) - 1), np.arange(1, len(coordinates))])
+        end = np.concatenate([np.arange(1, len(coordinates)), np.arange(len(coordinates) - 1)])
+    lengths = haversine_km(coordinates[start, 0], coordinates[start, 1], coordinates[end, 0], coordinates[end, 1])
+    return np.unique(np.concatenate([[0.0], lengths]).astype(np.float32))
+
+
+class SegmentTable:
+    # Быстрый путь перед моделью: строка признаков, все значения которой
+    # лежат на осях таблицы, отвечается индексом в массиве (memory-mapped),
+    # остальные строки возвращаются как промахи.
+
+    def __init__(self, values, lengths, dwell_values, model_version, path=None):
+        self.values = values
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.dwell_values = np.asarray(dwell_values, dtype=np.float32)
+        self.max_travel_time = values.shape[1] - 1
+        self.model_version = model_version
+        self.path = path
+        self._flat = values.reshape(-1)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def build(cls, model, lengths, dwell_values=DEFAULT_DWELL_VALUES, max_travel_time=DEFAULT_MAX_TRAVEL_TIME,
+              batch_rows=1 << 20):
+        lengths = np.unique(np.asarray(lengths, dtype=np.float32))
+        dwell_values = np.unique(np.asarray(dwell_values, dtype=np.float32))
+        travel_times = np.arange(max_travel_time + 1, dtype=np.float32)
+        # Порядок осей совпадает с порядком индекса в lookup
+        grid = np.meshgrid(np.arange(len(lengths)), travel_times, np.arange(len(dwell_values)),
+                           np.arange(7, dtype=np.float32), np.arange(24, dtype=np.float32), indexing='ij')
+        features = np.column_stack([
+            grid[1].ravel(),
+            dwell_values[grid[2].ravel()],
+            lengths[grid[0].ravel()],
+            grid[3].ravel(),
+            grid[4].ravel(),
+        ]).astype(np.float32)
+        values = np.empty(len(features), dtype=np.float32)
+        for start in range(0, len(features), batch_rows):
+            values[start:start + batch_rows] = model.predict(features[start:start + batch_rows])
+        shape = (len(lengths), len(travel_times), len(dwell_values), 7, 24)
+        return cls(values.reshape(shape), lengths, dwell_values, model.version)
+
+    def save(self, path):
+        # Массив и метаданные пишутся во временные файлы и подменяются целиком:
+        # уже отображённая в память таблица остаётся на старом inode
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        tmp_meta_path = f"{path}.{os.getpid()}.json.tmp"
+        np.save(tmp_path, self.values)
+        with open(tmp_meta_path, 'w') as f:
+            json.dump({
+                "modelVersion": self.model_version,
+                "lengths": self.lengths.tolist(),
+                "dwellValues": self.dwell_values.tolist(),
+            }, f)
+        os.replace(tmp_path, path)
+        os.replace(tmp_meta_path, os.path.splitext(path)[0] + '.json')
+        self.path = path
+
+    @classmethod
+    def load(cls, path=DEFAULT_TABLE_PATH):
+        with open(os.path.splitext(path)[0] + '.json') as f:
+            meta = json.load(f)
+        values = np.load(path, mmap_mode='r')
+        return cls(values, meta["lengths"], meta["dwellValues"], meta["modelVersion"], path)
+
+    @classmethod
+    def from_env(cls):
+        # SEGMENT_TABLE - путь к таблице, пустое значение отключает быстрый путь
+        path = os.environ.get('SEGMENT_TABLE', DEFAULT_TABLE_PATH)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            return cls.load(path)
+        except Exception as e:
+            print(f"Error loading segment table from {path}: {e}")
+            return None
+
+    @classmethod
+    def for_model(cls, model, path=DEFAULT_TABLE_PATH, stops_path=DEFAULT_STOPS_PATH):
+        # Таблица из path, если её построила эта версия модели. Если файла нет
+        # или он от другой версии - строится по stops_path и сохраняется
+        # вместо старого. Пустой path отключает быстрый путь
+        if not path:
+            return None
+        if os.path.exists(path):
+            try:
+                table = cls.load(path)
+                if table.model_version == model.version:
+                    return table
+            except Exception as e:
+                print(f"Error loading segment table from {path}: {e}")
+        try:
+            cls.build(model, known_segment_lengths(pd.read_csv(stops_path))).save(path)
+            print(f"Segment table for model {model.version} rebuilt at {path}")
+            return cls.load(path)
+        except Exception as e:
+            print(f"Error building segment table for model {model.version}: {e}")
+            return None
+
+    def lookup(self, features):
+        # (значения, маска попаданий) для матрицы признаков модели
+        features = np.asarray(features, dtype=np.float32)
+        travel_time, dwell, length, day, hour = features.T
+
+        length_index = np.searchsorted(self.lengths, length).clip(0, len(self.lengths) - 1)
+        dwell_index = np.searchsorted(self.dwell_values, dwell).clip(0, len(self.dwell_values) - 1)
+        hit = (
+            (self.lengths[length_index] == length)
+            & (self.dwell_values[dwell_index] == dwell)
+            & (travel_time >= 0) & (travel_time <= self.max_travel_time) & (travel_time == np.floor(travel_time))
+            & (day >= 0) & (day <= 6) & (hour >= 0) & (hour <= 23)
+        )
+        index = length_index[hit].astype(np.int64)
+        for axis, size in ((travel_time[hit], self.max_travel_time + 1), (dwell_index[hit], len(self.dwell_values)),
+                           (day[hit], 7), (hour[hit], 24)):
+            index = index * size + axis.astype(np.int64)
+
+        values = np.empty(len(features), dtype=np.float32)
+        values[hit] = self._flat[index]
+        n_hits = int(hit.sum())
+        with self._lock:
+            self.hits += n_hits
+            self.misses += len(features) - n_hits
+        return values, hit
+
+    def take_counts(self):
+        # Как PredictionCache.take_counts
+        with self._lock:
+            counts = {"hits": self.hits, "misses": self.misses}
+            self.hits = self.misses = 0
+        return counts
+
+    def add_counts(self, counts):
+        with self._lock:
+            self.hits += counts["hits"]
+            self.misses += counts["misses"]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "modelVersion": self.model_version,
+                "shape": list(self.values.shape),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from model_loader import load_model
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', help='model file, by default as the server picks it')
+    parser.add_argument('--stops', default=DEFAULT_STOPS_PATH)
+    parser.add_argument('--pairs', choices=['adjacent', 'all'], default='adjacent')
+    parser.add_argument('--max-travel-time', type=int, default=DEFAULT_MAX_TRAVEL_TIME)
+    parser.add_argument('--output', default=DEFAULT_TABLE_PATH)
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    table = SegmentTable.build(model, known_segment_lengths(pd.read_csv(args.stops), args.pairs),
+                               max_travel_time=args.max_travel_time)
+    table.save(args.output)
+    print(f"Segment table {table.values.shape} for model {model.version} saved to {args.output}")
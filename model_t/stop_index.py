@@ -0,0 +1,339 @@
+import math
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from features import haversine_km
+from route_store import create_route_stops
+
+METERS_PER_DEGREE = 111320
+_KEY_OFFSET = 1 << 30
+
+
+def _cell(values, cell_deg):
+    return np.floor(np.asarray(values, dtype=np.float64) / cell_deg).astype(np.int64) + _KEY_OFFSET
+
+
+class StopIndex:
+    # Сетка по широте/долготе: ключ ячейки - (строка << 32) | столбец,
+    # остановки отсортированы по ключу, поэтому ряд соседних ячеек - один
+    # непрерывный диапазон, который находится через searchsorted.
+    # Ячейка cell_m метров по широте; по долготе она уже на cos(широты),
+    # это учитывается шириной окна поиска.
+
+    def __init__(self, ids, names, coordinates, cell_m=50):
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        self.cell_m = cell_m
+        self.cell_deg = cell_m / METERS_PER_DEGREE
+        keys = (_cell(coordinates[:, 0], self.cell_deg) << 32) | _cell(coordinates[:, 1], self.cell_deg)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.coordinates = coordinates[order]
+        self.ids = [ids[i] for i in order.tolist()]
+        self.names = [names[i] for i in order.tolist()]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _window(self, lat, lon, radius_m):
+        # Диапазоны [lo, hi) отсортированных остановок в ячейках вокруг точек
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        rows = _cell(lat, self.cell_deg)
+        cols = _cell(lon, self.cell_deg)
+        ny = int(math.ceil(radius_m / self.cell_m))
+        cos_lat = np.cos(np.radians(np.clip(np.abs(lat), 0, 85))).min() if len(lat) else 1.0
+        nx = int(math.ceil(radius_m / (self.cell_m * cos_lat)))
+        for dy in range(-ny, ny + 1):
+            row = (rows + dy) << 32
+            lo = np.searchsorted(self.keys, row | (cols - nx), side='left')
+            hi = np.searchsorted(self.keys, row | (cols + nx), side='right')
+            yield lo, hi
+
+    def snap(self, coordinates, tolerance_m):
+        # Индекс ближайшей известной остановки не дальше tolerance_m, иначе -1
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        best = np.full(len(coordinates), -1, dtype=np.int64)
+        if not len(self) or not len(coordinates) or tolerance_m <= 0:
+            return best
+        best_distance = np.full(len(coordinates), tolerance_m / 1000, dtype=np.float64)
+        lat, lon = coordinates[:, 0], coordinates[:, 1]
+        for lo, hi in self._window(lat, lon, tolerance_m):
+            for step in range(int((hi - lo).max(initial=0))):
+                candidate = lo + step
+                has = np.flatnonzero(candidate < hi)
+                distance = haversine_km(lat[has], lon[has], self.coordinates[candidate[has], 0],
+                                        self.coordinates[candidate[has], 1])
+                closer = distance <= best_distance[has]
+                best[has[closer]] = candidate[has[closer]]
+                best_distance[has[closer]] = distance[closer]
+        return best
+
+    def nearest(self, lat, lon, limit=10, radius_m=1000):
+        # Ближайшие остановки в радиусе: [(индекс, расстояние в метрах)]
+        if not len(self):
+            return []
+        candidates = np.concatenate([np.arange(lo[0], hi[0]) for lo, hi in self._window([lat], [lon], radius_m)])
+        distance = haversine_km(lat, lon, self.coordinates[candidates, 0], self.coordinates[candidates, 1]) * 1000
+        inside = distance <= radius_m
+        candidates, distance = candidates[inside], distance[inside]
+        order = np.argsort(distance, kind='stable')[:limit]
+        return list(zip(candidates[order].tolist(), distance[order].tolist()))
+
+    def stop(self, i, distance_m=None):
+        result = {"id": self.ids[i], "name": self.names[i], "coordinates": self.coordinates[i].tolist()}
+        if distance_m is not None:
+            result["distance"] = round(distance_m, 1)
+        return result
+
+
+def known_stops(path=os.path.join('data', 'stops_data.csv')):
+    # Справочник остановок: id, названия и координаты из stops_data.csv
+    if not os.path.exists(path):
+        return [], [], np.zeros((0, 2))
+    stops = pd.read_csv(path, dtype={'stop_id': str})
+    stops = stops.drop_duplicates(subset=['stop_id', 'latitude', 'longitude'])
+    return (stops['stop_id'].str.strip().tolist(), stops['address'].astype(str).tolist(),
+            stops[['latitude', 'longitude']].to_numpy(dtype=np.float64))
+
+
+def _meters(lat1, lon1, lat2, lon2):
+    return float(haversine_km(lat1, lon1, lat2, lon2)) * 1000
+
+
+class StopRegistry:
+    # Справочник остановок плюс остановки, зарегистрированные при загрузке
+    # маршрутов (таблица stops в ROUTES_DB, общая для воркеров). Новая
+    # остановка получает id "q<строка>_<столбец>" по ячейке сетки размером в
+    # допуск привязки: id зависит только от координат, а не от маршрута.
+    # Точка привязывается к ближайшей остановке не дальше допуска - из
+    # справочника, зарегистрированной или новой из той же пачки (с учётом
+    # соседних ячеек); если такой нет, её ячейка становится новой остановкой.
+    # Повтор той же пачки даёт те же id. Остановки, на которые не ссылается
+    # ни один сохранённый маршрут (route_stops), удаляет prune.
+    # register=False - только справочник, без записи (пакетный расчёт).
+
+    def __init__(self, path, reference=None, register=True, cell_m=50):
+        self.path = path
+        self.register = register and path is not None
+        self.cell_m = cell_m
+        self._reference = reference
+        self._reference_index = None
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._generation = None
+        self._reset()
+
+    def _reset(self):
+        self._seq = 0
+        # Зарегистрированные остановки в порядке регистрации
+        self._ids, self._names, self._coordinates = [], [], []
+        self._positions = {}
+        # Индекс по первым base_size зарегистрированным плюс маленький индекс
+        # по остальным: новые остановки не пересобирают весь индекс
+        self._base = None
+        self._base_size = 0
+        self._recent = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get('ROUTES_DB', os.path.join('data', 'routes.db')))
+
+    def _connect(self):
+        # Соединение не переживает fork (PREDICTION_POOL=process)
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS stops ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'id TEXT NOT NULL UNIQUE, '
+                'name TEXT NOT NULL, '
+                'latitude REAL NOT NULL, '
+                'longitude REAL NOT NULL)'
+            )
+            # Растёт при каждом prune: процессы перечитывают остановки целиком
+            conn.execute('CREATE TABLE IF NOT EXISTS stop_registry (generation INTEGER NOT NULL)')
+            conn.execute('INSERT INTO stop_registry (generation) SELECT 0 '
+                         'WHERE NOT EXISTS (SELECT 1 FROM stop_registry)')
+            conn.commit()
+            create_route_stops(conn)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _load(self):
+        # Дочитывает остановки, зарегистрированные после прошлого чтения
+        # (в том числе другими процессами)
+        if self._reference_index is None:
+            ids, names, coordinates = self._reference if self._reference is not None else known_stops()
+            self._reference_index = StopIndex(list(ids), list(names), coordinates, cell_m=self.cell_m)
+        if self.path is None:
+            return
+        conn = self._connect()
+        generation = conn.execute('SELECT generation FROM stop_registry').fetchone()[0]
+        if generation != self._generation:
+            self._reset()
+            self._generation = generation
+        rows = conn.execute(
+            'SELECT seq, id, name, latitude, longitude FROM stops WHERE seq > ? ORDER BY seq', (self._seq,)
+        ).fetchall()
+        for seq, stop_id, name, latitude, longitude in rows:
+            self._positions[stop_id] = len(self._ids)
+            self._ids.append(stop_id)
+            self._names.append(name)
+            self._coordinates.append((latitude, longitude))
+            self._seq = seq
+
+    def _indexes(self):
+        if self._base is None or len(self._ids) - self._base_size > max(1000, len(self._base) // 4):
+            self._base = StopIndex(self._ids, self._names, self._coordinates, cell_m=self.cell_m)
+            self._base_size = len(self._ids)
+            self._recent = None
+        if self._recent is None or len(self._recent) != len(self._ids) - self._base_size:
+            rest = slice(self._base_size, None)
+            self._recent = StopIndex(self._ids[rest], self._names[rest], self._coordinates[rest], cell_m=self.cell_m)
+        return [self._reference_index, self._base, self._recent]
+
+    def _nearest_registered(self, coordinates, tolerance_m):
+        # Позиция ближайшей зарегистрированной остановки не дальше допуска
+        # (или -1) и расстояние до неё в метрах
+        position = np.full(len(coordinates), -1, dtype=np.int64)
+        distance = np.full(len(coordinates), np.inf)
+        for index in self._indexes()[1:]:
+            match = index.snap(coordinates, tolerance_m)
+            found = np.flatnonzero(match >= 0)
+            found_distance = haversine_km(coordinates[found, 0], coordinates[found, 1],
+                                          index.coordinates[match[found], 0],
+                                          index.coordinates[match[found], 1]) * 1000
+            closer = found_distance < distance[found]
+            position[found[closer]] = [self._positions[index.ids[i]] for i in match[found[closer]].tolist()]
+            distance[found[closer]] = found_distance[closer]
+        return position, distance
+
+    def _assign(self, coordinates, names, tolerance_m):
+        # Id и координаты остановок для точек, не привязанных к справочнику, и
+        # отметка, что остановка создана этой пачкой
+        cell_deg = tolerance_m / METERS_PER_DEGREE
+        rows = (_cell(coordinates[:, 0], cell_deg) - _KEY_OFFSET).tolist()
+        cols = (_cell(coordinates[:, 1], cell_deg) - _KEY_OFFSET).tolist()
+        # Ячейка по долготе уже на cos(широты): в пределах допуска может
+        # оказаться не только соседний столбец
+        spans = [int(math.ceil(1 / max(math.cos(math.radians(min(abs(lat), 85))), 1e-6)))
+                 for lat in coordinates[:, 0].tolist()]
+        registered, registered_distance = self._nearest_registered(coordinates, tolerance_m)
+
+        def key(cell):
+            return f"q{cell[0]}_{cell[1]}"
+
+        def nearest_new(i, representatives):
+            best, best_distance = None, tolerance_m
+            for dy in (-1, 0, 1):
+                for dx in range(-spans[i], spans[i] + 1):
+                    j = representatives.get((rows[i] + dy, cols[i] + dx))
+                    if j is None:
+                        continue
+                    distance = _meters(coordinates[i, 0], coordinates[i, 1], coordinates[j, 0], coordinates[j, 1])
+                    if distance <= best_distance:
+                        best, best_distance = j, distance
+            return best, best_distance
+
+        # Первый проход - новые остановки: точка, рядом с которой (в пределах
+        # допуска) нет ни зарегистрированной, ни уже выбранной новой, а её
+        # ячейка свободна
+        representatives = {}
+        for i in range(len(coordinates)):
+            cell = (rows[i], cols[i])
+            if (registered[i] < 0 and cell not in representatives and key(cell) not in self._positions
+                    and nearest_new(i, representatives)[0] is None):
+                representatives[cell] = i
+        if representatives:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    'INSERT OR IGNORE INTO stops (id, name, latitude, longitude) VALUES (?, ?, ?, ?)',
+                    [(key(cell), str(names[i]), float(coordinates[i, 0]), float(coordinates[i, 1]))
+                     for cell, i in representatives.items()]
+                )
+            self._load()
+
+        # Второй проход - ближайшая остановка в пределах допуска; если её
+        # нет, остановка своей ячейки (она уже есть: иначе точка стала бы новой)
+        ids = np.empty(len(coordinates), dtype=object)
+        snapped = np.empty_like(coordinates)
+        created = np.zeros(len(coordinates), dtype=bool)
+        for i in range(len(coordinates)):
+            j, distance = nearest_new(i, representatives)
+            if j is not None and distance < registered_distance[i]:
+                stop_id = key((rows[j], cols[j]))
+                created[i] = True
+            elif registered[i] >= 0:
+                stop_id = self._ids[registered[i]]
+            else:
+                stop_id = key((rows[i], cols[i]))
+            ids[i] = stop_id
+            snapped[i] = self._coordinates[self._positions[stop_id]]
+        return ids, snapped, created
+
+    def snap(self, coordinates, names, tolerance_m):
+        # Возвращает (id остановок, координаты, привязана ли к известной) на
+        # каждую точку. Без регистрации у непривязанных точек id None и
+        # исходные координаты.
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        if not len(coordinates):
+            return np.full(0, None, dtype=object), coordinates, np.zeros(0, dtype=bool)
+        # Одинаковые координаты пачки привязываются один раз, в порядке
+        # первого появления
+        unique, first, inverse = np.unique(coordinates, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind='stable')
+        unique, first = unique[order], first[order]
+        inverse = np.argsort(order)[inverse.reshape(-1)]
+        with self._lock:
+            self._load()
+            reference = self._indexes()[0]
+            match = reference.snap(unique, tolerance_m)
+            matched = match >= 0
+            ids = np.full(len(unique), None, dtype=object)
+            ids[matched] = [reference.ids[i] for i in match[matched].tolist()]
+            snapped = unique.copy()
+            snapped[matched] = reference.coordinates[match[matched]]
+            rest = np.flatnonzero(~matched)
+            if self.register and len(rest):
+                ids[rest], snapped[rest], created = self._assign(
+                    unique[rest], [names[i] for i in first[rest].tolist()], tolerance_m)
+                matched[rest] = ~created
+        return ids[inverse], snapped[inverse], matched[inverse]
+
+    def prune(self):
+        # Удаляет остановки, на которые не ссылается ни один сохранённый
+        # маршрут; вызывается после удаления и замены маршрутов. Остановку
+        # пачки, ещё не дошедшей до хранилища, prune тоже удалит - следующая
+        # загрузка зарегистрирует её ячейку заново под тем же id.
+        if not self.register:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                removed = conn.execute(
+                    'DELETE FROM stops WHERE id NOT IN (SELECT stop_id FROM route_stops)'
+                ).rowcount
+                if removed:
+                    conn.execute('UPDATE stop_registry SET generation = generation + 1')
+            return removed
+
+    def nearest(self, lat, lon, limit=10, radius_m=1000):
+        # Ближайшие известные остановки в радиусе, radius_m в метрах
+        with self._lock:
+            self._load()
+            found = [index.stop(i, distance) for index in self._indexes()
+                     for i, distance in index.nearest(lat, lon, limit, radius_m)]
+        return sorted(found, key=lambda stop: stop["distance"])[:limit]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
@@ -0,0 +1,95 @@
+# Расписание маршрута на день: сетка отправлений и матрица прибытия
+# отправления x остановки. Матрица считается в app.py одним lockstep-проходом,
+# здесь - разбор сетки и кодирование ответа (JSON, CSV или бинарный поток).
+import json
+
+import numpy as np
+
+from features import time_to_minutes
+from route_model import MINUTE_US, HOUR_US
+
+TIMETABLE_MAX_DEPARTURES = 24 * 60
+TIMETABLE_CHUNK_ROWS = 256
+# Больше ячеек отправление x остановка - JSON отдаётся потоком (iter_timetable_json)
+TIMETABLE_JSON_STREAM_CELLS = 100000
+
+
+def clock_to_minutes(value):
+    # Как time_to_minutes, но конец суток можно указать как 24:00
+    if value in ('24:00', '24:00:00'):
+        return 24 * 60
+    minutes = time_to_minutes(value)
+    if np.isnan(minutes):
+        raise ValueError(f"Invalid time {value!r}, expected HH:MM")
+    return minutes
+
+
+def departure_grid(start, end, every):
+    # Отправления [start, end) с шагом every минут, в микросекундах от полуночи
+    start_minutes = clock_to_minutes(start)
+    end_minutes = clock_to_minutes(end)
+    if every < 1:
+        raise ValueError("every must be at least 1 minute")
+    if end_minutes <= start_minutes:
+        raise ValueError("end must be after start")
+    departures = np.arange(start_minutes, end_minutes, every, dtype=np.int64) * MINUTE_US
+    if len(departures) > TIMETABLE_MAX_DEPARTURES:
+        raise ValueError(f"At most {TIMETABLE_MAX_DEPARTURES} departures per timetable")
+    return departures
+
+
+def clock_labels(us):
+    # HH:MM для массива микросекунд любой формы, как Route.arrival_labels
+    hours = ((us // HOUR_US) % 24).ravel().tolist()
+    minutes = ((us // MINUTE_US) % 60).ravel().tolist()
+    return np.array([f"{h:02d}:{m:02d}" for h, m in zip(hours, minutes)]).reshape(np.shape(us))
+
+
+def timetable_json(route, departures_us, arrivals_us, model_version):
+    return {
+        "routeId": route.id,
+        "stops": route.stop_ids,
+        "departures": clock_labels(departures_us).tolist(),
+        "arrivals": clock_labels(arrivals_us).tolist(),
+        "modelVersion": model_version
+    }
+
+
+def iter_timetable_json(route, departures_us, arrivals_us, model_version):
+    # Тот же документ, что timetable_json, но строки arrivals кодируются
+    # кусками по TIMETABLE_CHUNK_ROWS, а не одной строкой на всю матрицу
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+    yield (f'{{"routeId":{dumps(route.id)},"stops":{dumps(route.stop_ids)},'
+           f'"departures":{dumps(clock_labels(departures_us).tolist())},"arrivals":[')
+    for start in range(0, len(arrivals_us), TIMETABLE_CHUNK_ROWS):
+        rows = dumps(clock_labels(arrivals_us[start:start + TIMETABLE_CHUNK_ROWS]).tolist())[1:-1]
+        yield (',' if start else '') + rows
+    yield f'],"modelVersion":{dumps(model_version)}}}'
+
+
+def iter_timetable_csv(route, departures_us, arrivals_us):
+    # Строка на отправление: время отправления и HH:MM прибытия на каждую остановку
+    yield ','.join(['departure'] + [_csv_field(stop_id) for stop_id in route.stop_ids]) + '\n'
+    for start in range(0, len(departures_us), TIMETABLE_CHUNK_ROWS):
+        rows = slice(start, start + TIMETABLE_CHUNK_ROWS)
+        labels = clock_labels(arrivals_us[rows]).tolist()
+        yield ''.join(
+            departure + ',' + ','.join(row) + '\n'
+            for departure, row in zip(clock_labels(departures_us[rows]).tolist(), labels)
+        )
+
+
+def iter_timetable_binary(arrivals_us):
+    # int32 little-endian, секунды от полуночи дня расчёта, построчно
+    for start in range(0, len(arrivals_us), TIMETABLE_CHUNK_ROWS):
+        block = arrivals_us[start:start + TIMETABLE_CHUNK_ROWS] // 10**6
+        yield block.astype('<i4').tobytes()
+
+
+def _csv_field(value):
+    value = str(value)
+    if any(char in value for char in ',"\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from metrics import add_profile, start_profile
+
+
+PROGRESS_POLL_SECONDS = 0.1
+
+
+class PredictionPoolFull(Exception):
+    pass
+
+
+def _put_progress(progress_queue, *args):
+    progress_queue.put(args)
+
+
+def _drain(progress_queue):
+    items = []
+    while True:
+        try:
+            items.append(progress_queue.get_nowait())
+        except queue.Empty:
+            return items
+
+
+def _run_in_process(fn, args, take_stats):
+    # В процессе-воркере метрики, замеры этапов и счётчики кэшей пишутся в
+    # копии процесса; они возвращаются вместе с результатом, родитель их
+    # добавляет к своим. Первый take сбрасывает унаследованное при fork.
+    if take_stats is None:
+        return fn(*args), None, None
+    take_stats()
+    timings = start_profile()
+    result = fn(*args)
+    return result, timings, take_stats()
+
+
+class PredictionPool:
+    # Выполняет тяжёлую работу (pandas, model.predict) вне event loop.
+    # Одновременно принимается не больше workers + queue_size задач,
+    # остальные запросы сразу получают PredictionPoolFull (503).
+
+    # take_stats / merge_stats - сбор метрик воркера в процессе-воркере
+    # (функция уровня модуля, передаётся в процесс) и их учёт в родителе.
+
+    def __init__(self, kind='thread', workers=None, queue_size=None, take_stats=None, merge_stats=None):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown pool kind: {kind}")
+        self.kind = kind
+        self.take_stats = take_stats
+        self.merge_stats = merge_stats
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.queue_size = self.workers * 4 if queue_size is None else queue_size
+        self.pending = 0
+        self._executor = None
+        self._stream_executor = None
+        self._manager = None
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        workers = os.environ.get('PREDICTION_WORKERS')
+        queue_size = os.environ.get('PREDICTION_QUEUE_SIZE')
+        return cls(
+            kind=os.environ.get('PREDICTION_POOL', 'thread'),
+            workers=int(workers) if workers else None,
+            queue_size=int(queue_size) if queue_size else None,
+            **kwargs,
+        )
+
+    @property
+    def capacity(self):
+        return self.workers + self.queue_size
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='predict')
+        return self._executor
+
+    def _get_stream_executor(self):
+        # Генераторы нельзя передать в другой процесс, поэтому потоковые
+        # ответы всегда продвигаются в потоках.
+        if self.kind == 'thread':
+            return self._get_executor()
+        if self._stream_executor is None:
+            self._stream_executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='stream')
+        return self._stream_executor
+
+    def _get_manager(self):
+        # Очереди прогресса из процессов-воркеров: обычную multiprocessing.Queue
+        # нельзя передать в уже запущенный процесс, прокси менеджера - можно
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager
+
+    def _acquire(self):
+        if self.pending >= self.capacity:
+            raise PredictionPoolFull(f"Prediction queue is full ({self.pending}/{self.capacity})")
+        self.pending += 1
+
+    async def run(self, fn, *args, progress=None):
+        # progress - колбэк прогресса, вызывается в этом процессе: fn получает
+        # последним аргументом функцию с теми же аргументами. В процессе-воркере
+        # это запись в очередь, её читает и передаёт в progress родитель.
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            if self.kind == 'thread':
+                if progress is not None:
+                    args += (progress,)
+                # Контекст запроса (профилирование этапов) переходит в поток
+                call = partial(contextvars.copy_context().run, fn, *args)
+                return await loop.run_in_executor(self._get_executor(), call)
+            progress_queue = None
+            if progress is not None:
+                progress_queue = self._get_manager().Queue()
+                args += (partial(_put_progress, progress_queue),)
+            call = partial(_run_in_process, fn, args, self.take_stats)
+            future = loop.run_in_executor(self._get_executor(), call)
+            if progress_queue is not None:
+                await self._forward_progress(future, progress_queue, progress)
+            result, timings, stats = await future
+            if stats is not None:
+                add_profile(timings)
+                if self.merge_stats is not None:
+                    self.merge_stats(stats)
+            return result
+        finally:
+            self.pending -= 1
+
+    async def _forward_progress(self, future, progress_queue, progress):
+        loop = asyncio.get_running_loop()
+        while True:
+            finished = future.done()
+            for args in await loop.run_in_executor(None, _drain, progress_queue):
+                progress(*args)
+            if finished:
+                return
+            await asyncio.wait({future}, timeout=PROGRESS_POLL_SECONDS)
+
+    def reserve(self):
+        # Слот для потокового ответа занимается сразу, чтобы 503 вернулся
+        # до начала ответа, и освобождается, когда генератор закончится.
+        self._acquire()
+
+    async def stream(self, generator):
+        loop = asyncio.get_running_loop()
+        executor = self._get_stream_executor()
+        done = object()
+        context = contextvars.copy_context()
+        try:
+            while True:
+                item = await loop.run_in_executor(executor, context.run, next, generator, done)
+                if item is done:
+                    break
+                yield item
+        finally:
+            self.pending -= 1
+            try:
+                generator.close()
+            except ValueError:
+                pass  # генератор ещё выполняется в потоке после отключения клиента
+
+    def restart(self):
+        # Процессы-воркеры держат копию модели со старта; после подмены модели
+        # новые задачи должны попасть в свежие процессы
+        if self.kind == 'process' and self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def shutdown(self):
+        for executor in (self._executor, self._stream_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+        self._executor = None
+        self._stream_executor = None
+        self._manager = None